@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+"""
+Aperture photometry in NumPy, in place of IRAF apphot.phot + txdump and imexamine (calibrate, escut, uchvc, maglimit2)
+(the psf-star phot in completeness stays in IRAF: pstselect and psf read its apphot database)
+
+    ph = phot('AGC249525_g.fits', 'AGC249525_g.sdssxy', apertures=5.*fwhm, annulus=6.*fwhm)
+    ph['mag'], ph['merr'], ph['xcen'], ph['msky']...
+    write_txdump('AGC249525_g_cal.sdssphot', ph, txdump_fields, require=('mag','merr'))
+
+phot() follows what apphot.phot does with the parameters the pipeline always uses
+(centerpars calgorithm=centroid, fitskypars salgorithm=median, photpars zmag), so the
+numbers are the ones phot + txdump used to give:
+
+    center  the marginal-sum centroid in a cbox x cbox box (the marginals with their mean
+            subtracted, negative values dropped), iterated until the box stops moving;
+            a shift of more than maxshift pixels keeps the input position (cier=1)
+    sky     the median of the pixels between annulus and annulus+dannulus, rejecting
+            pixels more than sky_reject sigma from it until none are left to reject;
+            stdev and nsky are those of the pixels that are left
+    sums    pixels count with the fraction max(0, min(1, r_ap - r + 0.5)), as apphot does
+    mag     zmag - 2.5 log10(flux) + 2.5 log10(itime), flux = sum - area*msky, and
+            merr = 1.0857 sqrt(flux/gain + area*stdev^2 + area^2*stdev^2/nsky) / flux
+
+Apertures that hang off the image, contain pixels above datamax or have no flux left
+after the sky get mag = merr = nan (INDEF in the txdump files). Positions are IRAF pixel
+coordinates (the first pixel is centred on 1,1), and gain, exposure time, airmass and
+filter come from the header keywords in keywords.
+
+radprof() makes the imexamine 'a' (radial profile) measurements getfwhm used imexamine
+for, on all the sources at once: centroid, sky, flux/mag, moments, and a circular gaussian
+(or moffat) profile fitted by least squares over a grid of widths, giving peak and fwhm;
+write_log() writes them in the logfile layouts the scripts read back in.
+
+Images are memory-mapped and only the pixels around the sources are read. Sources go
+through in batches of about max_pixels pixels, spread over jobs processes (all cores by
+default, or UCHVC_JOBS) when there is more than one batch. Run this file to check it
+against a direct one-star-at-a-time implementation and the true fluxes of synthetic
+stars, and to time it.
+"""
+import os
+import time
+import numpy as np
+
+cbox = 9.               # centering box width, pixels
+maxshift = 3.           # largest centering shift accepted, pixels
+maxiter = 10            # centering iterations
+dannulus = 10.          # sky annulus width, pixels
+sky_reject = 3.         # sky pixel rejection, sigma
+sky_maxreject = 50      # sky rejection cycles
+zmag = 0.
+datamin = None          # good data range (None = no limit)
+datamax = 50000.
+keywords = {'gain':'gain', 'exposure':'exptime', 'airmass':'airmass', 'filter':'filter'}
+max_pixels = 1<<22      # pixels gathered per batch of sources
+jobs = int(os.environ.get('UCHVC_JOBS', '0')) or None   # None: all cores
+
+# the txdump fields the pipeline reads back in (calibrate, escut, phot_sources.txdump)
+txdump_fields = ['id', 'mag', 'merr', 'msky', 'stdev', 'rapert', 'xcen', 'ycen', 'ifilter', 'xairmass', 'image']
+
+_formats = {'id':'{:d}', 'xinit':'{:.3f}', 'yinit':'{:.3f}', 'xcen':'{:.3f}', 'ycen':'{:.3f}', 'cier':'{:d}',
+            'msky':'{:.7g}', 'stdev':'{:.7g}', 'nsky':'{:d}', 'rapert':'{:.2f}', 'sum':'{:.7g}', 'area':'{:.7g}',
+            'flux':'{:.7g}', 'mag':'{:.3f}', 'merr':'{:.3f}', 'itime':'{:.7g}', 'xairmass':'{:.7g}',
+            'ifilter':'{:s}', 'image':'{:s}'}
+
+_images = {}            # image file -> memory-mapped data, one per process
+
+def _open(image):
+    if image not in _images:
+        from astropy.io import fits
+        with fits.open(image, memmap=True) as hdul:
+            hdu = [h for h in hdul if h.data is not None][0]
+            _images[image] = hdu.data
+    return _images[image]
+
+def _header(image):
+    from astropy.io import fits
+    with fits.open(image, memmap=True) as hdul:
+        return [h for h in hdul if h.data is not None][0].header
+
+def read_coords(coords):
+    # x, y from the first two columns of an IRAF coordinate list (comments start with #)
+    xy = np.loadtxt(coords, usecols=(0,1), ndmin=2, comments='#')
+    return xy[:,0], xy[:,1]
+
+def _nint(v):
+    # IRAF nint: round half away from zero
+    return (np.sign(v)*np.floor(np.abs(v)+0.5)).astype(int)
+
+def _offsets(rmin, rmax):
+    # pixel offsets (dy, dx) whose distance from a centre anywhere in the central pixel
+    # can fall between rmin and rmax (plus the half pixel of the fractional edge), nearest first
+    r = int(np.ceil(rmax)) + 2
+    dy, dx = np.mgrid[-r:r+1, -r:r+1]
+    d = np.hypot(dy, dx).ravel()
+    keep = np.where((d >= rmin - 1.5) & (d <= rmax + 1.5))[0]
+    keep = keep[np.argsort(d[keep], kind='mergesort')]
+    return dy.ravel()[keep], dx.ravel()[keep], d[keep]
+
+def _gather(data, x0, y0, dy, dx):
+    # the pixels at (y0+dy, x0+dx) (IRAF coordinates) for each source, nan off the image
+    ny, nx = data.shape
+    iy = y0[:,None] - 1 + dy[None,:]
+    ix = x0[:,None] - 1 + dx[None,:]
+    on = (iy >= 0) & (iy < ny) & (ix >= 0) & (ix < nx)
+    flat = np.clip(iy, 0, ny-1)*nx + np.clip(ix, 0, nx-1)
+    pix = np.take(np.ravel(data), flat).astype(float)
+    pix[~on] = np.nan
+    return pix
+
+def _centroid(data, x, y, box, shift, niter):
+    half = int(box/2.)
+    off = np.arange(-half, half+1)
+    dy, dx = [a.ravel() for a in np.meshgrid(off, off, indexing='ij')]
+    xc, yc = x.copy(), y.copy()
+    x0, y0 = _nint(xc), _nint(yc)
+    for it in range(niter):
+        pix = _gather(data, x0, y0, dy, dx).reshape(len(x), len(off), len(off))
+        cx, cy = xc.copy(), yc.copy()
+        for marg, c, c0 in ((np.nansum(pix, axis=1), cx, x0), (np.nansum(pix, axis=2), cy, y0)):
+            w = marg - marg.mean(axis=1)[:,None]
+            w[w < 0] = 0.
+            tot = w.sum(axis=1)
+            ok = tot > 0
+            c[ok] = c0[ok] + (w[ok]*off).sum(axis=1)/tot[ok]
+        xc, yc = cx, cy
+        nx0, ny0 = _nint(xc), _nint(yc)
+        if np.all((nx0 == x0) & (ny0 == y0)):
+            break
+        x0, y0 = nx0, ny0
+    big = (np.abs(xc - x) > shift) | (np.abs(yc - y) > shift)
+    xc[big], yc[big] = x[big], y[big]
+    return xc, yc, big.astype(int)
+
+def _sky(pix, lo_data, hi_data, k, nreject):
+    # median sky with iterative k-sigma rejection, on every source at once: the pixels are
+    # sorted once, so what survives each cycle is a contiguous run [lo, hi) of each row
+    bad = ~np.isfinite(pix)
+    if lo_data is not None:
+        bad |= pix < lo_data
+    if hi_data is not None:
+        bad |= pix > hi_data
+    s = np.sort(np.where(bad, np.inf, pix), axis=1)
+    n = len(s)
+    rows = np.arange(n)
+    lo = np.zeros(n, dtype=int)
+    hi = (~bad).sum(axis=1)
+    fin = np.where(np.isfinite(s), s, 0.)
+    c1 = np.concatenate((np.zeros((n,1)), np.cumsum(fin, axis=1)), axis=1)
+    c2 = np.concatenate((np.zeros((n,1)), np.cumsum(fin**2, axis=1)), axis=1)
+    last = np.maximum(s.shape[1]-1, 0)
+    for cycle in range(nreject+1):
+        m = hi - lo
+        good = m > 0
+        mm = np.maximum(m, 1)
+        med = 0.5*(s[rows, np.minimum(lo + (mm-1)//2, last)] + s[rows, np.minimum(lo + mm//2, last)])
+        mean = (c1[rows, hi] - c1[rows, lo])/mm
+        var = np.maximum((c2[rows, hi] - c2[rows, lo])/mm - mean**2, 0.)*mm/np.maximum(mm-1, 1)
+        std = np.sqrt(var)
+        if cycle == nreject:
+            break
+        nlo = np.maximum(lo, (s < (med - k*std)[:,None]).sum(axis=1))
+        nhi = np.minimum(hi, (s <= (med + k*std)[:,None]).sum(axis=1))
+        nlo[~good], nhi[~good] = lo[~good], hi[~good]
+        if np.all((nlo == lo) & (nhi == hi)):
+            break
+        lo, hi = nlo, nhi
+    m = hi - lo
+    med[m == 0], std[m == 0] = np.nan, np.nan
+    return med, std, m
+
+def _measure(data, x, y, apertures, annulus, width, centroid, lo_data, hi_data):
+    # centres, sky and aperture sums for a batch of sources
+    if centroid:
+        xc, yc, cier = _centroid(data, x, y, cbox, maxshift, maxiter)
+    else:
+        xc, yc, cier = x.copy(), y.copy(), np.zeros(len(x), dtype=int)
+    x0, y0 = _nint(xc), _nint(yc)
+    fx, fy = (xc - x0)[:,None], (yc - y0)[:,None]
+
+    dy, dx, d = _offsets(annulus, annulus + width)
+    pix = _gather(data, x0, y0, dy, dx)
+    r = np.hypot(dy[None,:] - fy, dx[None,:] - fx)
+    pix[(r < annulus) | (r > annulus + width)] = np.nan
+    msky, stdev, nsky = _sky(pix, lo_data, hi_data, sky_reject, sky_maxreject)
+
+    # the aperture pixels are nearest first, so each aperture only looks at the ones it can reach
+    dy, dx, d = _offsets(0., max(apertures))
+    pix = _gather(data, x0, y0, dy, dx)
+    r = np.hypot(dy[None,:] - fy, dx[None,:] - fx)
+    nap = len(apertures)
+    asum, area, bad = np.zeros((len(x), nap)), np.zeros((len(x), nap)), np.zeros((len(x), nap), dtype=bool)
+    flag = ~np.isfinite(pix)
+    if hi_data is not None:
+        flag |= pix > hi_data
+    if lo_data is not None:
+        flag |= pix < lo_data
+    pix[~np.isfinite(pix)] = 0.
+    for j, ap in enumerate(apertures):
+        k = np.searchsorted(d, ap + 1.5, side='right')
+        frac = np.clip(ap + 0.5 - r[:,:k], 0., 1.)
+        asum[:,j] = np.einsum('ij,ij->i', frac, pix[:,:k])
+        area[:,j] = frac.sum(axis=1)
+        bad[:,j] = ((frac > 0) & flag[:,:k]).any(axis=1)
+    return xc, yc, cier, msky, stdev, nsky, asum, area, bad
+
+def _work(args):
+    func, image, x, y, params = args
+    return func(_open(image), x, y, *params)
+
+def _batched(func, name, data, x, y, params, npix, njobs):
+    # func(data, x, y, *params) over batches of sources of about max_pixels gathered pixels
+    # (npix per source), in njobs processes when there is more than one batch and the image
+    # is a file the workers can open themselves; the outputs of the batches, concatenated
+    per = max(1, max_pixels // npix)
+    batches = [slice(i, i+per) for i in range(0, len(x), per)]
+    if len(batches) > 1 and name != 'array' and njobs != 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(njobs)
+        try:
+            parts = pool.map(_work, [(func, name, x[b], y[b], params) for b in batches])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parts = [func(data, x[b], y[b], *params) for b in batches]
+    if not parts:
+        parts = [func(data, x, y, *params)]
+    return [np.concatenate(p) for p in zip(*parts)]
+
+def _sources(image, coords):
+    # (name, data, x, y) for an image file or array and a coordinate file or (x, y) arrays
+    if isinstance(coords, str):
+        x, y = read_coords(coords)
+    else:
+        x, y = [np.atleast_1d(np.asarray(c, dtype=float)) for c in coords]
+    if isinstance(image, str):
+        return image, _open(image), x, y
+    return 'array', image, x, y
+
+def _value(header, key, default):
+    name = keywords.get(key)
+    if header is None or not name or name not in header:
+        return default
+    return header[name]
+
+def phot(image, coords, apertures, annulus, dannulus=None, centroid=True, zmag=None, datamin=None, datamax=None, header=None, njobs=None):
+    # aperture photometry of the sources at coords (an IRAF coordinate file, or (x, y) arrays)
+    # in image (a FITS file, or an array with its header given separately). apertures is a
+    # radius or a list of them, all in pixels. Returns a structured array with one row per
+    # source, in coordinate file order (id = line number), and per-aperture columns
+    # rapert/sum/area/flux/mag/merr of shape (n, napertures)
+    g = globals()
+    dannulus = g['dannulus'] if dannulus is None else dannulus
+    zmag = g['zmag'] if zmag is None else zmag
+    lo_data = g['datamin'] if datamin is None else datamin
+    hi_data = g['datamax'] if datamax is None else datamax
+    njobs = jobs if njobs is None else njobs
+    apertures = [float(a) for a in np.atleast_1d(apertures)]
+    nap = len(apertures)
+
+    name, data, x, y = _sources(image, coords)
+    if header is None and name != 'array':
+        header = _header(name)
+
+    gain = float(_value(header, 'gain', 1.0))
+    itime = float(_value(header, 'exposure', 1.0))
+    airmass = _value(header, 'airmass', np.nan)
+    airmass = np.nan if isinstance(airmass, str) else float(airmass)
+    ifilter = str(_value(header, 'filter', 'INDEF')).strip().replace(' ', '_') or 'INDEF'
+
+    npix = len(_offsets(annulus, annulus + dannulus)[0]) + len(_offsets(0., max(apertures))[0])
+    params = (apertures, annulus, dannulus, centroid, lo_data, hi_data)
+    xc, yc, cier, msky, stdev, nsky, asum, area, bad = _batched(_measure, name, data, x, y, params, npix, njobs)
+
+    flux = asum - area*msky[:,None]
+    good = ~bad & (flux > 0) & (nsky[:,None] > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mag = np.where(good, zmag - 2.5*np.log10(np.where(good, flux, 1.)) + 2.5*np.log10(itime), np.nan)
+        err = np.sqrt(flux/gain + area*stdev[:,None]**2 + area**2*stdev[:,None]**2/nsky[:,None])
+        merr = np.where(good, 1.0857*err/np.where(good, flux, 1.), np.nan)
+
+    dtype = [('id', int), ('xinit', float), ('yinit', float), ('xcen', float), ('ycen', float), ('cier', int),
+             ('msky', float), ('stdev', float), ('nsky', int), ('rapert', float, (nap,)), ('sum', float, (nap,)),
+             ('area', float, (nap,)), ('flux', float, (nap,)), ('mag', float, (nap,)), ('merr', float, (nap,)),
+             ('itime', float), ('xairmass', float), ('ifilter', 'U32'), ('image', 'U256')]
+    out = np.zeros(len(x), dtype=dtype)
+    out['id'] = np.arange(1, len(x)+1)
+    out['xinit'], out['yinit'], out['xcen'], out['ycen'], out['cier'] = x, y, xc, yc, cier
+    out['msky'], out['stdev'], out['nsky'] = msky, stdev, nsky
+    out['rapert'] = apertures
+    out['sum'], out['area'], out['flux'], out['mag'], out['merr'] = asum, area, flux, mag, merr
+    out['itime'], out['xairmass'], out['ifilter'], out['image'] = itime, airmass, ifilter, name
+    return out
+
+def txdump_rows(ph, fields=txdump_fields, require=()):
+    # the rows txdump would print for these fields: per-aperture fields give one value per
+    # aperture, nan is INDEF, and rows with INDEF in any of the require fields are left out
+    keep = np.ones(len(ph), dtype=bool)
+    for f in require:
+        v = ph[f].reshape(len(ph), -1)
+        keep &= np.isfinite(v).all(axis=1)
+    rows = []
+    for row in ph[keep]:
+        vals = []
+        for f in fields:
+            fmt = _formats[f]
+            for v in np.atleast_1d(row[f]):
+                if isinstance(v, (float, np.floating)) and not np.isfinite(v):
+                    vals.append('INDEF')
+                else:
+                    vals.append(fmt.format(v.item() if hasattr(v, 'item') else v))
+        rows.append('  '.join(vals))
+    return rows
+
+def write_txdump(out_file, ph, fields=txdump_fields, require=()):
+    # write txdump_rows to out_file (atomically, like the other products); returns out_file
+    tmp = '{:s}.{:d}.tmp'.format(out_file, os.getpid())
+    with open(tmp, 'w') as f:
+        for line in txdump_rows(ph, fields, require):
+            f.write(line + '\n')
+    getattr(os, 'replace', os.rename)(tmp, out_file)
+    return out_file
+
+# imexamine 'a' (radial profile) measurements, for getfwhm
+magzero = 25.           # imexamine's magnitude zero point
+_sigmas = np.exp(np.linspace(np.log(0.3), np.log(20.), 61))    # gaussian sigma search grid
+_betas = np.array([1.5, 2.0, 2.5, 3.0, 4.0, 5.0, 7.0, 10.0])   # moffat beta grid
+
+# log layouts: 'imexam' is the imexamine logfile line (COL LINE COORDINATES R MAG FLUX SKY
+# PEAK E PA BETA ENCLOSED GAUSSIAN/MOFFAT DIRECT, read by uchvc/escut), 'calibrate' the
+# columns odi_calibrate reads back (col line mag flux sky n rmom ellip pa peak fwhm)
+log_layouts = {'imexam':['xcen', 'ycen', 'xcen', 'ycen', 'radius', 'mag', 'flux', 'sky', 'peak', 'ellip', 'pa', 'beta', 'enclosed', 'fwhm', 'direct'],
+               'calibrate':['xcen', 'ycen', 'mag', 'flux', 'sky', 'npix', 'rmom', 'ellip', 'pa', 'peak', 'fwhm']}
+_formats.update({'radius':'{:.2f}', 'sky':'{:.2f}', 'npix':'{:d}', 'rmom':'{:.2f}', 'ellip':'{:.2f}', 'pa':'{:.0f}',
+                 'peak':'{:.1f}', 'beta':'{:.2f}', 'enclosed':'{:.2f}', 'fwhm':'{:.2f}', 'direct':'{:.2f}', 'flag':'{:d}'})
+
+def _best_scale(v, w, models):
+    # least-squares amplitude of each model profile against v (weights w), and the one
+    # with the smallest residual: models is a list of (n, m) profiles
+    best_chi, best_k, best_a = None, None, None
+    for k, prof in enumerate(models):
+        pw = prof*w
+        a = (pw*v).sum(axis=1)/np.maximum((pw*prof).sum(axis=1), 1e-300)
+        chi = (w*(v - a[:,None]*prof)**2).sum(axis=1)
+        if best_chi is None:
+            best_chi, best_k, best_a = chi, np.zeros(len(v), dtype=int), a
+        else:
+            better = chi < best_chi
+            best_chi, best_k, best_a = np.where(better, chi, best_chi), np.where(better, k, best_k), np.where(better, a, best_a)
+    return best_k, best_a, best_chi
+
+def _refine(v, w, r, make, grid):
+    # fit make(r, p) to v over the sorted 1d parameter grid, then again on a finer grid
+    # between the neighbours of the best point; returns the parameter and the amplitude
+    k, a, chi = _best_scale(v, w, [make(r, p) for p in grid])
+    lo, hi = grid[np.maximum(k-1, 0)], grid[np.minimum(k+1, len(grid)-1)]
+    fine = [lo + (hi - lo)*t for t in np.linspace(0., 1., 21)]
+    kf, af, chi = _best_scale(v, w, [make(r, p[:,None]) for p in fine])
+    return lo + (hi - lo)*np.linspace(0., 1., 21)[kf], af, chi
+
+def _gauss(r, sig):
+    return np.exp(-0.5*(r/sig)**2)
+
+def _profile(data, x, y, radius, buff, width, rplot, center, fittype):
+    if center:
+        xc, yc, cier = _centroid(data, x, y, 2*radius + 1, rplot, maxiter)
+    else:
+        xc, yc = x.copy(), y.copy()
+    x0, y0 = _nint(xc), _nint(yc)
+    fx, fy = (xc - x0)[:,None], (yc - y0)[:,None]
+
+    # background: median of the annulus buff..buff+width beyond the object radius
+    dy, dx, d = _offsets(radius + buff, radius + buff + width)
+    pix = _gather(data, x0, y0, dy, dx)
+    r = np.hypot(dy[None,:] - fy, dx[None,:] - fx)
+    pix[(r < radius + buff) | (r > radius + buff + width)] = np.nan
+    sky = _sky(pix, None, None, sky_reject, sky_maxreject)[0]
+
+    dy, dx, d = _offsets(0., max(rplot, radius))
+    pix = _gather(data, x0, y0, dy, dx)
+    r = np.hypot(dy[None,:] - fy, dx[None,:] - fx)
+    use = (r <= rplot) & np.isfinite(pix)
+    off = ((r <= rplot) & ~np.isfinite(pix)).any(axis=1)
+    v = np.where(use, pix - sky[:,None], 0.)
+    w = use.astype(float)
+
+    # flux, moments and shape inside the object radius
+    inner = use & (r <= radius)
+    npix = inner.sum(axis=1)
+    flux = np.where(inner, v, 0.).sum(axis=1)
+    pos = np.where(inner, np.maximum(v, 0.), 0.)
+    tot = np.maximum(pos.sum(axis=1), 1e-300)
+    ddx, ddy = dx[None,:] - fx, dy[None,:] - fy
+    mxx, myy, mxy = (pos*ddx**2).sum(axis=1)/tot, (pos*ddy**2).sum(axis=1)/tot, (pos*ddx*ddy).sum(axis=1)/tot
+    root = np.sqrt(((mxx - myy)/2.)**2 + mxy**2)
+    l1, l2 = (mxx + myy)/2. + root, np.maximum((mxx + myy)/2. - root, 0.)
+    ellip = 1. - np.sqrt(l2/np.maximum(l1, 1e-300))
+    pa = np.degrees(0.5*np.arctan2(2*mxy, mxx - myy))
+    rmom = np.sqrt(mxx + myy)
+
+    # the profile fit out to rplot
+    if fittype == 'moffat':
+        best = None
+        for beta in _betas:
+            make = lambda rr, alpha: (1. + (rr/alpha)**2)**(-beta)
+            alpha, a, chi = _refine(v, w, r, make, _sigmas*2.)
+            fw = 2.*alpha*np.sqrt(2.**(1./beta) - 1.)
+            if best is None:
+                best = [chi, a, fw, np.full(len(x), beta)]
+            else:
+                better = chi < best[0]
+                best = [np.where(better, new, old) for new, old in zip([chi, a, fw, np.full(len(x), beta)], best)]
+        chi, peak, fwhm, beta = best
+    else:
+        sig, peak, chi = _refine(v, w, r, _gauss, _sigmas)
+        fwhm, beta = 2.*np.sqrt(2.*np.log(2.))*sig, np.full(len(x), np.nan)
+
+    # enclosed: twice the radius holding half the flux inside rplot; direct: twice the
+    # radius where the (pixel-sorted) profile drops below half the fitted peak
+    order = np.argsort(np.where(use, r, np.inf), axis=1)
+    rows = np.arange(len(x))[:,None]
+    rs, vs = r[rows, order], v[rows, order]*w[rows, order]
+    cum = np.cumsum(vs, axis=1)
+    half = np.argmax(cum >= 0.5*cum[:,-1:], axis=1)
+    enclosed = 2.*rs[np.arange(len(x)), half]
+    from scipy import ndimage
+    below = (ndimage.uniform_filter1d(vs, 5, axis=1, mode='nearest') < 0.5*peak[:,None]) & np.isfinite(rs)
+    first = np.argmax(below, axis=1)
+    direct = np.where(below.any(axis=1), 2.*rs[np.arange(len(x)), first], np.nan)
+
+    flag = (off*1) | ((flux <= 0)*2) | ((~np.isfinite(fwhm) | (fwhm <= 0) | (fwhm >= 2.*rplot) | (peak <= 0))*4)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mag = np.where(flux > 0, magzero - 2.5*np.log10(np.where(flux > 0, flux, 1.)), np.nan)
+    fit_bad = (flag & 5) > 0
+    for a in (fwhm, peak, enclosed, direct):
+        a[fit_bad] = np.nan
+    return xc, yc, sky, npix, flux, mag, rmom, ellip, pa, peak, beta, enclosed, fwhm, direct, flag
+
+def radprof(image, coords, radius=4.0, buff=7.0, width=5.0, rplot=15.0, center=True, fittype='gaussian', njobs=None):
+    # the imexamine 'a' measurements for every source at coords, with the rimexam parameters
+    # of the same names: centroid in a 2*radius+1 box, sky = median of the annulus from
+    # radius+buff to radius+buff+width, flux/mag (zero point magzero), moments, ellipticity
+    # and position angle inside radius, and a circular gaussian (or moffat) profile fitted
+    # out to rplot, giving peak and fwhm. Returns a structured array, one row per source;
+    # flag is 1 for pixels off the image, 2 for no flux, 4 for a failed fit (nan fwhm/peak)
+    njobs = jobs if njobs is None else njobs
+    name, data, x, y = _sources(image, coords)
+    npix = len(_offsets(radius + buff, radius + buff + width)[0]) + len(_offsets(0., max(rplot, radius))[0])
+    params = (radius, buff, width, rplot, center, fittype)
+    # the fit keeps one profile per grid point in memory, so smaller batches than phot
+    cols = _batched(_profile, name, data, x, y, params, 4*npix, njobs)
+    names = ['xcen', 'ycen', 'sky', 'npix', 'flux', 'mag', 'rmom', 'ellip', 'pa', 'peak', 'beta', 'enclosed', 'fwhm', 'direct', 'flag']
+    dtype = [('id', int), ('xinit', float), ('yinit', float), ('radius', float)] + [(c, int if c in ('npix', 'flag') else float) for c in names]
+    out = np.zeros(len(x), dtype=dtype)
+    out['id'], out['xinit'], out['yinit'], out['radius'] = np.arange(1, len(x)+1), x, y, radius
+    for c, v in zip(names, cols):
+        out[c] = v
+    return out
+
+def write_log(out_file, prof, layout='imexam', indef='INDEF'):
+    # write radprof results as an imexamine-style log (see log_layouts), one line per
+    # source in coordinate order, with indef for values that couldn't be measured
+    fields = log_layouts[layout]
+    tmp = '{:s}.{:d}.tmp'.format(out_file, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write('# ' + ' '.join(fields) + '\n')
+        for line in txdump_rows(prof, fields):
+            f.write(line.replace('INDEF', indef) + '\n')
+    getattr(os, 'replace', os.rename)(tmp, out_file)
+    return out_file
+
+def _direct(data, x, y, apertures, annulus, width, lo_data=None, hi_data=datamax):
+    # one star at a time, straight from the apphot description, for the self-check
+    ny, nx = data.shape
+    yy, xx = np.mgrid[1:ny+1, 1:nx+1]
+    half = int(cbox/2.)
+    xc, yc = x, y
+    for it in range(maxiter):
+        x0, y0 = int(np.floor(xc+0.5)), int(np.floor(yc+0.5))
+        box = data[y0-1-half:y0+half, x0-1-half:x0+half].astype(float)
+        off = np.arange(-half, half+1)
+        mx, my = box.sum(axis=0), box.sum(axis=1)
+        wx, wy = np.clip(mx - mx.mean(), 0, None), np.clip(my - my.mean(), 0, None)
+        xc, yc = x0 + (wx*off).sum()/wx.sum(), y0 + (wy*off).sum()/wy.sum()
+        if (int(np.floor(xc+0.5)), int(np.floor(yc+0.5))) == (x0, y0):
+            break
+    if abs(xc - x) > maxshift or abs(yc - y) > maxshift:
+        xc, yc = x, y
+    r = np.hypot(xx - xc, yy - yc)
+    sky = data[(r >= annulus) & (r <= annulus + width)].astype(float)
+    if hi_data is not None:
+        sky = sky[sky <= hi_data]
+    for cycle in range(sky_maxreject):
+        med, std = np.median(sky), sky.std(ddof=1)
+        keep = np.abs(sky - med) <= sky_reject*std
+        if keep.all():
+            break
+        sky = sky[keep]
+    med, std = np.median(sky), sky.std(ddof=1)
+    sums = [(np.clip(ap - r + 0.5, 0, 1)*data).sum() for ap in apertures]
+    areas = [np.clip(ap - r + 0.5, 0, 1).sum() for ap in apertures]
+    return xc, yc, med, std, len(sky), np.array(sums), np.array(areas)
+
+def check(nstars=150, size=1024, fwhm=5.0, sky=500., gain=1.5, seed=0, timing=20000):
+    # synthetic gaussian stars on a poisson sky: compare phot() with _direct() and the true
+    # fluxes, radprof() with the true fwhm, then time phot() on timing sources
+    rng = np.random.RandomState(seed)
+    sig = fwhm/2.355
+    x = rng.uniform(60, size-60, nstars)
+    y = rng.uniform(60, size-60, nstars)
+    flux = 10**rng.uniform(3, 5.5, nstars)
+    yy, xx = np.mgrid[1:size+1, 1:size+1]
+    model = np.full((size, size), sky)
+    for k in range(nstars):
+        sl = (slice(max(int(y[k])-30, 0), int(y[k])+30), slice(max(int(x[k])-30, 0), int(x[k])+30))
+        model[sl] += flux[k]/(2*np.pi*sig**2)*np.exp(-0.5*((xx[sl]-x[k])**2 + (yy[sl]-y[k])**2)/sig**2)
+    # whole counts/gain, dithered as flat fielding does: on whole counts the median sky moves
+    # in steps of 1/gain, which over a 5 fwhm aperture is about 1 sigma of the flux
+    data = (rng.poisson(model*gain) + rng.uniform(-0.5, 0.5, model.shape))/gain
+    xin, yin = x + rng.uniform(-1.5, 1.5, nstars), y + rng.uniform(-1.5, 1.5, nstars)
+    aps = [fwhm, 2*fwhm, 5*fwhm]
+    ph = phot(data, (xin, yin), aps, 6*fwhm, header={'gain':gain, 'exptime':1.0}, datamax=None)
+
+    worst = dict(xcen=0., msky=0., sum=0.)
+    for k in range(0, nstars, max(1, nstars//50)):
+        xc, yc, med, std, nsk, sums, areas = _direct(data, xin[k], yin[k], aps, 6*fwhm, dannulus, hi_data=None)
+        worst['xcen'] = max(worst['xcen'], abs(ph['xcen'][k]-xc), abs(ph['ycen'][k]-yc))
+        worst['msky'] = max(worst['msky'], abs(ph['msky'][k]-med))
+        worst['sum'] = max(worst['sum'], np.abs(ph['sum'][k]-sums).max()/sums.max())
+    print('vs one star at a time: centre {:.1e} px, sky {:.1e}, sums {:.1e} (relative)'.format(worst['xcen'], worst['msky'], worst['sum']))
+    cpos = np.hypot(ph['xcen']-x, ph['ycen']-y)
+    print('centres: median {:.3f} px from the true position'.format(np.median(cpos)))
+    # stars with nothing else out to the edge of the sky annulus
+    sep = np.hypot(x[:,None]-x[None,:], y[:,None]-y[None,:]) + 1e9*np.eye(nstars)
+    alone = sep.min(axis=1) > 6*fwhm + dannulus + 3*fwhm
+    dm = ph['mag'][alone,2] - (-2.5*np.log10(flux[alone]))
+    pull = dm/ph['merr'][alone,2]
+    print('5 fwhm aperture, {:d} isolated stars: median mag - true {:+.4f}, pull rms {:.2f}'.format(alone.sum(), np.nanmedian(dm), np.nanstd(pull)))
+    # merr is apphot's, whose area^2*stdev^2/nsky term is the error of a mean sky; a median
+    # scatters about sqrt(pi/2) times more, so the full pull runs a little over 1. Taking
+    # each star's own sky error out leaves the source and aperture terms on their own
+    fl, ar = ph['flux'][alone,2], ph['area'][alone,2]
+    rest = (fl + ar*(ph['msky'][alone]-sky) - flux[alone])/np.sqrt(fl/gain + ar*ph['stdev'][alone]**2)
+    print('    with the sky error taken out: pull rms {:.2f}'.format(np.nanstd(rest)))
+
+    t0 = time.time()
+    pr = radprof(data, (xin, yin), rplot=3*fwhm)
+    ok = pr['flag'] == 0
+    print('radprof: median gaussian fwhm {:.3f}, enclosed {:.3f}, direct {:.3f} (true {:.3f}), {:d}/{:d} fitted, {:.2f} s'.format(
+        np.median(pr['fwhm'][ok]), np.median(pr['enclosed'][ok]), np.median(pr['direct'][ok]), fwhm, ok.sum(), nstars, time.time()-t0))
+
+    if timing:
+        xt, yt = rng.uniform(60, size-60, timing), rng.uniform(60, size-60, timing)
+        import shutil
+        import tempfile
+        from astropy.io import fits
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for njobs in (1, None):
+                if njobs is None:
+                    img = os.path.join(tmp_dir, 'aphot_check.fits')
+                    fits.PrimaryHDU(data.astype(np.float32)).writeto(img)
+                else:
+                    img = data
+                t0 = time.time()
+                phot(img, (xt, yt), aps, 6*fwhm, header={'gain':gain, 'exptime':1.0}, njobs=njobs)
+                print('{:d} sources, {:s}: {:.2f} s'.format(timing, 'one process' if njobs == 1 else 'all cores', time.time()-t0))
+        finally:
+            _images.clear()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    check()
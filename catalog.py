@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar star catalogs for the CMD-filter/overdensity scripts (magfilter, psmap, *_cmds, *_sigs)
+
+A catalog is a structured NumPy array with one named field per column, so every
+subset (error cut, CMD filter, circle, bright/red stars...) is a single boolean-mask
+selection of all the columns at once, and the columns themselves are views:
+
+    cat = read_catalog('calibrated_mags.dat', calibrated_cols)
+    cat = cat[error_cut(cat, 0.2)]
+    i_mag_f, gmi_f = select(cat, stars_f, 'i_mag', 'gmi')
+
+Parsing the text files is by far the slowest part of loading, so read_catalog keeps
+a binary copy of each catalog next to its source file (calibrated_mags.dat ->
+calibrated_mags.dat.9c.npy) and memory-maps that on later loads. The copy is only
+used while the source file's size and mtime (or, if just the mtime moved, its sha1)
+still match what was recorded when it was written; otherwise it is rebuilt.
+
+Circle selections on the sky (detection circle, reference circle, ...) go through a
+KD-tree on the arcmin offsets, built once per catalog with sky_index:
+
+    tree = sky_index(cat)
+    stars_circ = select_within(tree, (x0, y0), 3.0)
+
+project() does the same for the pixel -> sky transformation: all_pix2world (with
+the distortion terms) is evaluated once per catalog and image header and the world
+coordinates are kept in a .sky file next to the catalog.
+
+match_xy() pairs two position lists within a tolerance, nearest first and each source
+at most once, with one KD-tree pair search; uchvc uses it to keep the sources detected
+in both g and i, completeness to find which artificial stars were recovered:
+
+    ii, ig, sep = match_xy(xi, yi, xg, yg, 7.0)
+"""
+import os
+import hashlib
+import numpy as np
+from scipy.spatial import cKDTree
+
+cache_catalogs = True   # write/read the binary sidecar copies at all
+_replace = getattr(os, 'replace', os.rename)
+
+# column layouts of the photometry files, in file order
+calibrated_cols = ['gx', 'gy', 'g_mag', 'g_ierr', 'ix', 'iy', 'i_mag', 'i_ierr', 'gmi']
+daophot_cols = ['id', 'ra', 'dec', 'ix', 'iy', 'am_g', 'g_i', 'g_ierr', 'am_i', 'i_i', 'i_ierr', 'g_mag', 'i_mag', 'gmi', 'chi', 'sharp', 'ebv']
+daophot_fwhm_cols = daophot_cols + ['g_fwhm', 'fwhm_s']
+
+# derived columns every catalog carries: color error, star fwhm, and sky positions
+# (arcmin offsets from the image corner and decimal degrees, filled in by add_sky)
+derived_cols = ['gmi_err', 'fwhm_s', 'i_ra', 'i_dec', 'i_rad', 'i_decd']
+
+def _sha1(path, blocksize=1<<20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _sidecar(mag_file, columns):
+    base = '{:s}.{:d}c'.format(mag_file, len(columns))
+    return base + '.npy', base + '.key.npz'
+
+def _cached(mag_file, columns, fwhm):
+    # memory-map the sidecar copy of a catalog, or None if it's missing or stale
+    npy, key = _sidecar(mag_file, columns)
+    if not (os.path.isfile(npy) and os.path.isfile(key)):
+        return None
+    try:
+        st = os.stat(mag_file)
+        with np.load(key) as k:
+            size, mtime, sha1 = int(k['size']), float(k['mtime']), str(k['sha1'])
+            names, fill = [str(c) for c in k['names']], float(k['fwhm'])
+        if names != list(columns) or (fill != fwhm and 'fwhm_s' not in columns) or size != st.st_size:
+            return None
+        if mtime != st.st_mtime:
+            # touched but maybe not changed: compare contents, and remember the new mtime if they match
+            if _sha1(mag_file) != sha1:
+                return None
+            _write_key(key, st, sha1, columns, fwhm)
+        return np.load(npy, mmap_mode='r')
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+def _write_key(key, st, sha1, columns, fwhm):
+    tmp = '{:s}.{:d}.tmp'.format(key, os.getpid())
+    with open(tmp, 'wb') as f:
+        np.savez(f, size=st.st_size, mtime=st.st_mtime, sha1=sha1, names=np.array(columns), fwhm=fwhm)
+    _replace(tmp, key)
+
+def _store(mag_file, columns, fwhm, cat):
+    # write the sidecar (data first, then the key that validates it) atomically;
+    # a read-only data directory just means no cache
+    npy, key = _sidecar(mag_file, columns)
+    try:
+        st = os.stat(mag_file)
+        sha1 = _sha1(mag_file)
+        tmp = '{:s}.{:d}.tmp'.format(npy, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, cat)
+        _replace(tmp, npy)
+        _write_key(key, st, sha1, columns, fwhm)
+    except (IOError, OSError):
+        pass
+
+def read_catalog(mag_file, columns, fwhm=1.0, cache=None):
+    # read the leading len(columns) columns of a photometry file into a catalog.
+    # fwhm fills the fwhm_s column when the file doesn't have one. With the cache
+    # on (default cache_catalogs) the result is a read-only memory map of the binary
+    # copy; subsets made with a mask (e.g. the error cut) are ordinary arrays again
+    if cache is None:
+        cache = cache_catalogs
+    if cache:
+        cat = _cached(mag_file, columns, fwhm)
+        if cat is not None:
+            return cat
+    data = np.loadtxt(mag_file, usecols=tuple(range(len(columns))), ndmin=2)
+    names = list(columns) + [c for c in derived_cols if c not in columns]
+    cat = np.zeros(len(data), dtype=[(c, float) for c in names])
+    for k, c in enumerate(columns):
+        cat[c] = data[:,k]
+    if 'fwhm_s' not in columns:
+        cat['fwhm_s'] = fwhm
+    cat['gmi_err'] = np.sqrt(cat['g_ierr']**2 + cat['i_ierr']**2)
+    if cache:
+        _store(mag_file, columns, fwhm, cat)
+    return cat
+
+def error_cut(cat, mag_error_cut=0.2):
+    # mask of stars with good enough photometry: i error and the matching color error
+    color_error_cut = np.sqrt(2.0)*mag_error_cut
+    return (cat['gmi_err'] < color_error_cut) & (cat['i_ierr'] < mag_error_cut)
+
+def project(x, y, header, cache_file=None, origin=1):
+    # world coordinates of the pixel positions (x, y) under the WCS in header, plus the
+    # world coordinates of the image corner pixel (0,0). With cache_file (normally the
+    # catalog's file name) the result is kept in cache_file.sky.<header hash>.npz and
+    # reused as long as the header and the pixel positions are the same
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    hdr = header.tostring().encode('ascii') if hasattr(header, 'tostring') else str(header).encode('ascii')
+    sky_file, key = None, None
+    if cache_file is not None and cache_catalogs:
+        sky_file = '{:s}.sky.{:s}.npz'.format(cache_file, hashlib.sha1(hdr).hexdigest()[:12])
+        h = hashlib.sha1(hdr)
+        h.update(np.array([origin, len(x)], dtype=float).tobytes())
+        h.update(np.ascontiguousarray(x).tobytes())
+        h.update(np.ascontiguousarray(y).tobytes())
+        key = h.hexdigest()
+        if os.path.isfile(sky_file):
+            try:
+                with np.load(sky_file) as d:
+                    if str(d['key']) == key:
+                        return d['world'], float(d['corner'][0]), float(d['corner'][1])
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+
+    from astropy import wcs
+    w = wcs.WCS(header)
+    world = w.all_pix2world(np.column_stack((x, y)), origin)
+    ra_corner, dec_corner = w.all_pix2world(0, 0, origin)
+
+    if sky_file is not None:
+        try:
+            tmp = '{:s}.{:d}.tmp'.format(sky_file, os.getpid())
+            with open(tmp, 'wb') as f:
+                np.savez(f, key=key, world=world, corner=np.array([ra_corner, dec_corner]))
+            _replace(tmp, sky_file)
+        except (IOError, OSError):
+            pass
+    return world, float(ra_corner), float(dec_corner)
+
+def add_sky(cat, world, ra_corner, dec_corner):
+    # fill the sky columns from world coordinates of (ix, iy): decimal degrees, and
+    # arcmin offsets from the image corner
+    cat['i_rad'] = world[:,0]
+    cat['i_decd'] = world[:,1]
+    cat['i_ra'] = np.abs((world[:,0]-ra_corner)*60)
+    cat['i_dec'] = np.abs((world[:,1]-dec_corner)*60)
+    return cat
+
+def columns(cat, *names):
+    # the named columns, as views
+    return tuple(cat[c] for c in names)
+
+def select(cat, mask, *names):
+    # the named columns of the stars in mask (boolean or index array), selected in one go
+    return columns(cat[mask], *names)
+
+def sky_index(cat):
+    # KD-tree on the arcmin offsets (i_ra, i_dec) of a catalog, for select_within
+    return cKDTree(np.column_stack((cat['i_ra'], cat['i_dec'])))
+
+def select_within(tree, center, radius):
+    # indices (in catalog order) of the stars within radius arcmin of center=(i_ra, i_dec)
+    return np.sort(np.asarray(tree.query_ball_point(center, radius), dtype=int))
+
+def match_xy(x1, y1, x2, y2, tol):
+    # pair the sources of two position lists (g and i detections, artificial stars and
+    # what was recovered) that are within tol of each other, each source at most once:
+    # pairs are taken closest first, ties by index, so the result doesn't depend on the
+    # order of the lists beyond that. Returns the index pairs (i1, i2), in i1 order, and
+    # their separations; sources with non-finite positions are never matched.
+    xy1 = np.column_stack((np.asarray(x1, dtype=float).ravel(), np.asarray(y1, dtype=float).ravel()))
+    xy2 = np.column_stack((np.asarray(x2, dtype=float).ravel(), np.asarray(y2, dtype=float).ravel()))
+    idx1 = np.flatnonzero(np.isfinite(xy1).all(axis=1))
+    idx2 = np.flatnonzero(np.isfinite(xy2).all(axis=1))
+    if len(idx1) == 0 or len(idx2) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+    pairs = cKDTree(xy1[idx1]).sparse_distance_matrix(cKDTree(xy2[idx2]), tol, output_type='ndarray')
+    order = np.lexsort((pairs['j'], pairs['i'], pairs['v']))
+    i, j, d = pairs['i'][order], pairs['j'][order], pairs['v'][order]
+    i1, i2, sep = [], [], []
+    while len(i):
+        # the pairs that are the closest left for both of their sources are final; dropping
+        # every other pair of those sources and repeating is the same as taking the pairs
+        # one by one, closest first, but a round at a time
+        first1 = np.zeros(len(i), dtype=bool)
+        first1[np.unique(i, return_index=True)[1]] = True
+        first2 = np.zeros(len(j), dtype=bool)
+        first2[np.unique(j, return_index=True)[1]] = True
+        take = first1 & first2
+        i1.append(i[take])
+        i2.append(j[take])
+        sep.append(d[take])
+        rest = ~(np.isin(i, i[take]) | np.isin(j, j[take]))
+        i, j, d = i[rest], j[rest], d[rest]
+    if not i1:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+    i1, i2, sep = np.concatenate(i1), np.concatenate(i2), np.concatenate(sep)
+    order = np.argsort(i1, kind='mergesort')
+    return idx1[i1[order]], idx2[i2[order]], sep[order]
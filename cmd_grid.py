@@ -10,6 +10,7 @@ from astropy import wcs
 from photutils import detect_sources, source_properties, properties_table
 from photutils.utils import random_cmap
 from distfit import distfit
+from catalog import read_catalog, error_cut, project, add_sky, columns, calibrated_cols
 import aplpy
 from scipy.stats import binned_statistic_2d
 import matplotlib.patches as patches
@@ -27,40 +28,24 @@ print ra_c0, dec_c0, ra_cN-ra_c0, dec_cN-dec_c0
 mag_file = 'calibrated_mags.dat'
 
 # read in magnitudes, colors, and positions(x,y)
-gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8),unpack=True)
-print len(gxr), "total stars"
+cat = read_catalog(mag_file, calibrated_cols)
+print len(cat), "total stars"
 
 # filter out the things with crappy color errors
-color_error_cut = np.sqrt(2.0)*0.2
 mag_error_cut = 0.2
+cat = cat[error_cut(cat, mag_error_cut)]
+g_mag, g_ierr, ix, iy, i_mag, i_ierr, gmi, gmi_err = columns(cat, 'g_mag', 'g_ierr', 'ix', 'iy', 'i_mag', 'i_ierr', 'gmi', 'gmi_err')
 
-gmi_errr = np.array([np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr))])
-gx = np.array([gxr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-gy = np.array([gyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-g_mag = np.array([g_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-g_ierr = np.array([g_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-ix = np.array([ixr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-iy = np.array([iyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-i_mag = np.array([i_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-i_ierr = np.array([i_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-gmi = np.array([gmir[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-gmi_err = np.array([np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-
-print len(gx), "after color+mag error cut"
+print len(cat), "after color+mag error cut"
 # nid = np.loadtxt(mag_file,usecols=(0,),dtype=int,unpack=True)
-pixcrd = zip(ix,iy)
 
-world = w.all_pix2world(pixcrd, 1)
-ra_c, dec_c = w.all_pix2world(0,0,1)
+world, ra_c, dec_c = project(ix, iy, hdu.header, mag_file)
 # ra_c_d,dec_c_d = deg2HMS(ra=ra_c, dec=dec_c, round=True)
 # print 'Corner RA:',ra_c_d,':: Corner Dec:',dec_c_d
 
-# split the ra and dec out into individual arrays and transform to arcmin from the corner
-i_ra = [abs((world[i,0]-ra_c)*60) for i in range(len(world[:,0]))]
-i_dec = [abs((world[i,1]-dec_c)*60) for i in range(len(world[:,1]))]
-# also preserve the decimal degrees for reference
-i_rad = [world[i,0] for i in range(len(world[:,0]))]
-i_decd = [world[i,1] for i in range(len(world[:,1]))]
+# transform to arcmin from the corner, and also preserve the decimal degrees for reference
+add_sky(cat, world, ra_c, dec_c)
+i_ra, i_dec, i_rad, i_decd = columns(cat, 'i_ra', 'i_dec', 'i_rad', 'i_decd')
 
 bin_count, xedges, yedges, bin_id = binned_statistic_2d(i_rad, i_decd, gmi, statistic='count', bins=[5,5], range=[[ra_cN,ra_c0],[dec_c0,dec_cN]], expand_binnumbers=True)
 xcenters= 0.5*(xedges[1:]+xedges[:-1])
@@ -7,6 +7,7 @@ import glob
 from scipy import interpolate
 import matplotlib.pyplot as plt
 from uchvc_cal import download_sdss, js_calibrate
+from odi_calibrate import apply_calibration
 
 fits_g = 'AGC249525_g_sh.fits'
 fits_i = 'AGC249525_i_sh.fits'
@@ -66,9 +67,6 @@ compg = fg(xnew)
 compi = fi(xnew)
 
 # convert inst. mags to calibrated
-tolerance = 0.0001
-g_magjs = []
-i_magjs = []
 g_0 = xnew - kg*gairmass
 i_0 = xnew - ki*iairmass
 gmi_0 = mugi*(g_0-i_0) + zpgi
@@ -81,40 +79,8 @@ gmi0 = mugi*(g0-i0) + zpgi
 i_mag = i0 + epsgi*(gmi0) + zpi
 g_mag = gmi0 + i_mag
 
-for j,mag in enumerate(g_0):
-    color_guess = 0.0
-    color_diff = 1.0
-    while abs(color_diff) > tolerance:
-        g_caljs = g_0[j] + eps_g*color_guess + zp_g
-        i_caljs = i_0[j] + eps_i*color_guess + zp_i
-        color_new = g_caljs - i_caljs
-        color_diff = color_guess-color_new
-        color_guess = color_new
-        # print j, g_cal, i_cal, color_new
-    g_magjs.append(g_caljs)
-    i_magjs.append(i_caljs)
-g_magjs = np.array(g_magjs)
-i_magjs = np.array(i_magjs)
-
-gmagjs = []
-imagjs = []
-# g0 = g_i - kg*gairmass 
-# i0 = i_i - ki*iairmass 
-for j,mag in enumerate(g0):
-    color_guess = 0.0
-    color_diff = 1.0
-    while abs(color_diff) > tolerance:
-        gcaljs = g0[j] + eps_g*color_guess + zp_g
-        icaljs = i0[j] + eps_i*color_guess + zp_i
-        color_new = gcaljs - icaljs
-        color_diff = color_guess-color_new
-        color_guess = color_new
-        print j, gcaljs, icaljs, color_new
-    gmagjs.append(gcaljs)
-    imagjs.append(icaljs)
-
-gmagjs = np.array(gmagjs)
-imagjs = np.array(imagjs)
+g_magjs, i_magjs = apply_calibration(g_0, i_0, eps_g, zp_g, eps_i, zp_i)
+gmagjs, imagjs = apply_calibration(g0, i0, eps_g, zp_g, eps_i, zp_i)
 
 # print g_magjs-g_cal, i_magjs-i_cal
 
@@ -9,7 +9,7 @@ from scipy import interpolate
 from scipy.optimize import curve_fit
 from scipy.special import erfc
 import matplotlib.pyplot as plt
-from odi_calibrate import download_sdss, js_calibrate, get_calibration
+from odi_calibrate import download_sdss, js_calibrate, get_calibration, apply_calibration
 
 def cubic(x, a, b, c, d):
     return a*x**3 + b*x**2 + c*x + d
@@ -60,44 +60,13 @@ def main():
     gXAIRMASS, iXAIRMASS = gXAIRMASS.astype(float)[0], iXAIRMASS.astype(float)[0]
     
     # convert inst. mags to calibrated
-    tolerance = 0.0001
-    g_magjs = []
-    i_magjs = []
     g_0 = xnew - kg*gXAIRMASS
     i_0 = xnew - ki*iXAIRMASS
-    for j,mag in enumerate(g_0):
-        color_guess = 0.0
-        color_diff = 1.0
-        while abs(color_diff) > tolerance:
-            g_caljs = g_0[j] + eps_g*color_guess + zp_g
-            i_caljs = i_0[j] + eps_i*color_guess + zp_i
-            color_new = g_caljs - i_caljs
-            color_diff = color_guess-color_new
-            color_guess = color_new
-            # print j, g_cal, i_cal, color_new
-        g_magjs.append(g_caljs)
-        i_magjs.append(i_caljs)
-    g_magjs = np.array(g_magjs)
-    i_magjs = np.array(i_magjs)
-    
-    g_js = []
-    i_js = []
+    g_magjs, i_magjs = apply_calibration(g_0, i_0, eps_g, zp_g, eps_i, zp_i)
+    
     g0 = gi - kg*gXAIRMASS
     i0 = ii - ki*iXAIRMASS
-    for j,mag in enumerate(g0):
-        color_guess = 0.0
-        color_diff = 1.0
-        while abs(color_diff) > tolerance:
-            g_cjs = g0[j] + eps_g*color_guess + zp_g
-            i_cjs = i0[j] + eps_i*color_guess + zp_i
-            color_new = g_cjs - i_cjs
-            color_diff = color_guess-color_new
-            color_guess = color_new
-            # print j, g_cal, i_cal, color_new
-        g_js.append(g_cjs)
-        i_js.append(i_cjs)
-    g_js = np.array(g_js)
-    i_js = np.array(i_js)
+    g_js, i_js = apply_calibration(g0, i0, eps_g, zp_g, eps_i, zp_i)
     
     # print(g_js, i_js)
     
@@ -4,6 +4,8 @@ import os
 import numpy as np
 from pyraf import iraf
 import glob
+import regions
+import catalog
 
 path = os.getcwd()
 subpath = path+'/compl'
@@ -17,6 +19,7 @@ filters_ = ['g','i']  ####### change me!
 max_mag = -6.0
 step = 0.1
 nartstars = 100
+match_tol = 6.    # pixels between an artificial star and its recovered source
 #######################
 # fwhm = 6.780
 # sigma = 8.9
@@ -56,8 +59,6 @@ for filter_ in filters_:
     iraf.daophot(_doprint=0)
     iraf.tables(_doprint=0)
     
-    iraf.unlearn(iraf.ptools.pselect,iraf.tables.tcreate,iraf.tables.tmatch,iraf.tables.tinfo,iraf.tables.tdump)
-    
     # first measure the psf for the image
     iraf.unlearn(iraf.phot,iraf.datapars,iraf.photpars,iraf.centerpars,iraf.fitskypars)
     
@@ -81,6 +82,8 @@ for filter_ in filters_:
     iraf.photpars.setParam('apertures',iraf.nint(4.*fwhm))
     iraf.fitskypars.setParam('annulus',(6.*fwhm))
     
+    # this phot stays in IRAF (not aphot.phot): pstselect and psf read its whole apphot
+    # database output, not just the txdump columns aphot writes
     iraf.apphot.phot(image=full_img, coords='apcor_stars_'+filter_+'.txt', output=filter_+"_psfstars.mag.1")
     
     with open('apcor_stars_'+filter_+'.txt') as foo:
@@ -120,8 +123,7 @@ for filter_ in filters_:
     iraf.datapars.sigma=sigma
     iraf.findpars.threshold=threshold
     
-    if os.path.isfile('mask.reg'):
-        m3,m4,m5,m6 = np.loadtxt('mask.reg',usecols=(2,3,4,5),unpack=True)
+    mask_boxes = regions.read_regions('mask.reg') if os.path.isfile('mask.reg') else None
     
     inst_mags = np.arange(max_mag, 1.0, step)
     
@@ -134,9 +136,6 @@ for filter_ in filters_:
         dao_coo = compl+objname+'_'+filter_+'_crop_add.'+'{:+4.1f}'.format(mag)+'.coo.1'
         phot_out = compl+objname+'_'+filter_+'_crop_add.'+'{:+4.1f}'.format(mag)+'.mag.1'
         art_coo = compl+objname+'_'+filter_+'_crop_add.'+'{:+4.1f}'.format(mag)+'.fits.art'
-        art_tab = compl+objname+'_'+filter_+'_crop_add.'+'{:+4.1f}'.format(mag)+'_art.tab'
-        phot_tab = compl+objname+'_'+filter_+'_crop_add.'+'{:+4.1f}'.format(mag)+'_phot.tab'
-        match_tab = compl+objname+'_'+filter_+'_crop_add.'+'{:+4.1f}'.format(mag)+'_tmatch.tab'
         match_file = compl+objname+'_'+filter_+'_crop_add.'+'{:+4.1f}'.format(mag)+'_tmatch.tdump'
         next_mag = mag + step
         
@@ -152,87 +151,25 @@ for filter_ in filters_:
     # for file_ in glob.glob('*add*.mag.1'):
         if not os.path.isfile(phot_out+'a'):
             print('pselect-ing', phot_out)
-            if os.path.isfile('temp2') :    
-                os.remove('temp2')
-            iraf.ptools.pselect(infi=phot_out, outfi='temp1', expr="MAG != INDEF")
-            if os.path.isfile('mask.reg'):
-                for i in range(len(m3)) :
-                    mx1 = m3[i] - (m5[i]/2.)
-                    mx2 = m3[i] + (m5[i]/2.)
-                    my1 = m4[i] - (m6[i]/2.)
-                    my2 = m4[i] + (m6[i]/2.)
-                    iraf.ptools.pselect(infi='temp1', outfi='temp2', expr='(XCE < '+repr(int(mx1))+' || XCE > '+repr(int(mx2))+') || (YCE < '+repr(int(my1))+' || YCE > '+repr(int(my2))+')')
-                    os.rename('temp2', 'temp1')
-            os.rename('temp1', phot_out+'a')
-            if os.path.isfile('temp1') :    
-                os.remove('temp1')
+            regions.select_apphot(phot_out, phot_out+'a', mask_boxes, require=('MAG',))
             
     # for file_ in glob.glob('*.art'):
     
         if not os.path.isfile(art_coo+'.1a'):
             print('pselect-ing', art_coo)
-            if os.path.isfile('temp2') :    
-                os.remove('temp2')
-            iraf.ptools.pselect(infi=art_coo, outfi='temp1', expr="MAG != INDEF")
-            if os.path.isfile('mask.reg'):
-                for i in range(len(m3)) :
-                    mx1 = m3[i] - (m5[i]/2.)
-                    mx2 = m3[i] + (m5[i]/2.)
-                    my1 = m4[i] - (m6[i]/2.)
-                    my2 = m4[i] + (m6[i]/2.)
-                    iraf.ptools.pselect(infi='temp1', outfi='temp2', expr='(XCE < '+repr(int(mx1))+' || XCE > '+repr(int(mx2))+') || (YCE < '+repr(int(my1))+' || YCE > '+repr(int(my2))+')')
-                    os.rename('temp2', 'temp1')
-            os.rename('temp1', art_coo+'.1a')
-            if os.path.isfile('temp1') :    
-                os.remove('temp1')
-    
-    # for file_ in glob.glob('*.pselect'):
-        if not os.path.isfile(art_tab):
-            print('creating artificial star table from', art_coo+'.1a')
-            iraf.tables.tcreate.setParam("nlines",0)
-            iraf.tables.tcreate(art_tab, os.path.dirname(os.path.abspath(__file__))+"/art_table.description", art_coo+'.1a')
-        
-    # for file_ in glob.glob('*.mag.1a'):
-        print('reformatting', phot_out)
-        f1 = open(phot_out, 'r')
-        f2 = open('temp1', 'w')
-        for line in f1:
-            if line[0] == 'A' or line[0] == 'H':
-                line = line[0:22]+' '+line[23:72]+' '+line[73:-1]+'\n'
-            f2.write(line.replace('\\', ''))
-        f1.close()
-        f2.close()
-        
-        os.remove(phot_out)
-        os.rename('temp1', phot_out)
-        if not os.path.isfile(phot_tab):
-            print('creating phot table from', phot_out)
-            iraf.tables.tcreate.setParam("nlines",5)
-            iraf.tables.tcreate(phot_tab, os.path.dirname(os.path.abspath(__file__))+"/phot_table.description", phot_out)
-        
-    # artFiles = glob.glob('*_art.tab')
-    # photFiles = glob.glob('*_phot.tab')
-    # namedFiles = glob.glob('*add*.mag.1a')
-        iraf.tables.tmatch.setParam('incol1',"ID, XCEN, YCEN, MAG")
-        iraf.tables.tmatch.setParam('incol2',"ID, XINIT, YINIT, MAG, MERR, IFILTER")
-    # 
-    # for i in range(len(artFiles)):
-    #     if not os.path.isfile(namedFiles[i][0:9]+'.'+filter_+"."+artFiles[i][-8:-4]+"_tmatch.tab"):
-        print('matching',art_tab, '&', phot_tab)
-        iraf.tables.tmatch(art_tab, phot_tab, match_tab, "xcen,ycen", "xinit,yinit", 6.)
+            regions.select_apphot(art_coo, art_coo+'.1a', mask_boxes, require=('MAG',))
+    
+    # match the surviving artificial stars to the detections, nearest first and each at most once
+        header, fields, records = regions.read_textdb(art_coo+'.1a')
+        art_id, art_x, art_y, art_mag = regions.textdb_columns(fields, records, 'ID', 'XCENTER', 'YCENTER', 'MAG')
+        header, fields, records = regions.read_textdb(phot_out)
+        ph_id, ph_x, ph_y, ph_mag, ph_merr = regions.textdb_columns(fields, records, 'ID', 'XINIT', 'YINIT', 'MAG', 'MERR')
+        print('matching', art_coo+'.1a', '&', phot_out)
+        m_art, m_ph, m_sep = catalog.match_xy(art_x, art_y, ph_x, ph_y, match_tol)
         if not os.path.isfile(match_file):
-            iraf.tables.tdump.setParam('datafile',match_file)
-            iraf.tables.tdump(match_tab)
-    # 
-        iraf.tables.tinfo.setParam('ttout',"no")
-    # 
-    # for i, file_ in enumerate(glob.glob('*tmatch.tab')):
-        iraf.tables.tinfo(art_tab)
-        artk = iraf.tables.tinfo.getParam('nrows')
-    
-        iraf.tables.tinfo(match_tab)
-        matchk = iraf.tables.tinfo.getParam('nrows')
-        pct = float(matchk)/float(artk)
+            np.savetxt(match_file, np.column_stack((art_id[m_art], art_x[m_art], art_y[m_art], art_mag[m_art], ph_id[m_ph], ph_x[m_ph], ph_y[m_ph], ph_mag[m_ph], ph_merr[m_ph], m_sep)),
+                       fmt='%d %.3f %.3f %.3f %d %.3f %.3f %.3f %.3f %.3f', header='ID XCEN YCEN MAG ID_2 XINIT YINIT MAG_2 MERR SEP')
+        pct = float(len(m_art))/float(len(art_x))
         print(mag, pct)
         print(" ",mag,"        ",pct, file=cTable)
     cTable.close()
@@ -4,38 +4,11 @@ def escut(image, pos_file, fwhm, peak):
     import numpy as np
     import matplotlib.pyplot as plt
     from scipy import stats
-    from pyraf import iraf
+    import aphot
     # import sewpy
     import os
     from matplotlib.path import Path
     
-    iraf.images(_doprint=0)
-    iraf.tv(_doprint=0)
-    iraf.ptools(_doprint=0)
-    iraf.noao(_doprint=0)
-    iraf.digiphot(_doprint=0)
-    iraf.photcal(_doprint=0)
-    iraf.apphot(_doprint=0)  
-    iraf.imutil(_doprint=0)
-    
-    iraf.unlearn(iraf.phot,iraf.datapars,iraf.photpars,iraf.centerpars,iraf.fitskypars)
-    iraf.apphot.phot.setParam('interactive',"no")
-    iraf.apphot.phot.setParam('verify',"no")
-    iraf.datapars.setParam('datamax',50000.)
-    iraf.datapars.setParam('gain',"gain")
-    iraf.datapars.setParam('ccdread',"rdnoise")
-    iraf.datapars.setParam('exposure',"exptime")
-    iraf.datapars.setParam('airmass',"airmass")
-    iraf.datapars.setParam('filter',"filter")
-    iraf.datapars.setParam('obstime',"time-obs")
-    # iraf.datapars.setParam('obstime',"date-obs")
-    iraf.datapars.setParam('sigma',"INDEF")
-    iraf.photpars.setParam('zmag',0.)
-    iraf.centerpars.setParam('cbox',9.)
-    iraf.centerpars.setParam('maxshift',3.)
-    iraf.fitskypars.setParam('salgorithm',"median")
-    iraf.fitskypars.setParam('dannulus',10.)
-    
     # clean up the indefs so we can actually do stats, but reassign them to 99999 so we don't lose track of things
     # keep a separate list without them to do the median (we need floats)
     indefs = np.where(fwhm=='INDEF')
@@ -82,12 +55,10 @@ def escut(image, pos_file, fwhm, peak):
         #     for j in range(len(xpos)):
         #         print >> f, xpos[j], ypos[j], fwhm[j], idno[j]
         
-        iraf.datapars.setParam('fwhmpsf',ap1x)
-        iraf.photpars.setParam('apertures',repr(ap1x)+', '+repr(ap2x))
-        iraf.fitskypars.setParam('annulus',4.*ap1x)
-        iraf.apphot.phot(image=image, coords=pos_file, output=image[0:-5]+'.phot')
-        with open(image[0:-5]+'.txdump','w+') as txdump_out :
-            iraf.ptools.txdump(textfiles=image[0:-5]+'.phot', fields="id,mag,merr,msky,stdev,rapert,xcen,ycen,ifilter,xairmass,image", expr='MAG[1] != INDEF && MERR[1] != INDEF && MAG[2] != INDEF && MERR[2] != INDEF', headers='no', Stdout=txdump_out)
+        # two apertures with aphot (IRAF apphot.phot recipe: cbox=9, maxshift=3, median sky
+        # in a 10 pixel annulus, datamax=50000), only stars measured in both
+        ph = aphot.phot(image, pos_file, [ap1x, ap2x], 4.*ap1x, dannulus=10., datamax=50000.)
+        aphot.write_txdump(image[0:-5]+'.txdump', ph, aphot.txdump_fields, require=('mag','merr'))
             
     mag1x, mag2x = np.loadtxt(image[0:-5]+'.txdump', usecols=(1,2), unpack=True)
     iraf_id = np.loadtxt(image[0:-5]+'.txdump', usecols=(0,), dtype=int, unpack=True)
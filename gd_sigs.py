@@ -10,7 +10,8 @@ import matplotlib.gridspec as gridspec
 import matplotlib.cm as cm
 import scipy.stats as ss
 from collections import OrderedDict
-from magfilter import deg2HMS, grid_smooth, getHIellipse, dist2HIcentroid, make_filter, filter_sources, distfit, dm_sigplot
+from catalog import read_catalog, error_cut, project, add_sky, columns, select, calibrated_cols
+from magfilter import deg2HMS, grid_smooth, getHIellipse, dist2HIcentroid, make_filter, filter_sources, errorbar_lengths, filter_intervals, sweep_mask, distfit, dm_sigplot
 
 def main():
     objects = OrderedDict([('AGC249525',26.78)])
@@ -35,25 +36,12 @@ def main():
         
         # read in magnitudes, colors, and positions(x,y)
         # gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir,fwhm_sr= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8,11),unpack=True)
-        gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8),unpack=True)
-        # print len(gxr), "total stars"
-        fwhm_sr = np.ones_like(gxr)
+        cat = read_catalog(mag_file, calibrated_cols)
+        # print len(cat), "total stars"
         # filter out the things with crappy color errors
-        color_error_cut = np.sqrt(2.0)*0.2
         mag_error_cut = 0.2
-        
-        gmi_errr = [np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr))]
-        gx = [gxr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        gy = [gyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        g_mag = [g_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        g_ierr = [g_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        ix = [ixr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        iy = [iyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        i_mag = [i_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        i_ierr = np.array([i_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-        gmi = [gmir[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        fwhm_s = [fwhm_sr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        gmi_err = np.array([np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
+        cat = cat[error_cut(cat, mag_error_cut)]
+        g_mag, g_ierr, ix, iy, i_mag, i_ierr, gmi, gmi_err, fwhm_s = columns(cat, 'g_mag', 'g_ierr', 'ix', 'iy', 'i_mag', 'i_ierr', 'gmi', 'gmi_err', 'fwhm_s')
         
         i_ierrAVG, bedges, binid = ss.binned_statistic(i_mag,i_ierr,statistic='median',bins=10,range=[15,25])
         gmi_errAVG, bedges, binid = ss.binned_statistic(i_mag,gmi_err,statistic='median',bins=10,range=[15,25])
@@ -65,7 +53,6 @@ def main():
         # print gmi_errAVG
         # print len(gx), "after color+mag error cut"
         # nid = np.loadtxt(mag_file,usecols=(0,),dtype=int,unpack=True)
-        pixcrd = zip(ix,iy)
         
         
         # print "Reading WCS info from image header..."
@@ -92,19 +79,15 @@ def main():
         # Convert pixel coordinates to world coordinates
         # The second argument is "origin" -- in this case we're declaring we
         # have 1-based (Fortran-like) coordinates.
-        world = w.all_pix2world(pixcrd, 1)
-        ra_corner, dec_corner = w.all_pix2world(0,0,1)
+        world, ra_corner, dec_corner = project(ix, iy, fits_i[0].header, mag_file)
         ra_c_d,dec_c_d = deg2HMS(ra=ra_corner, dec=dec_corner, round=True)
         # print 'Corner RA:',ra_c_d,':: Corner Dec:',dec_c_d
         
         fits_i.close()
         
-        # split the ra and dec out into individual arrays and transform to arcmin from the corner
-        i_ra = [abs((world[i,0]-ra_corner)*60) for i in range(len(world[:,0]))]
-        i_dec = [abs((world[i,1]-dec_corner)*60) for i in range(len(world[:,1]))]
-        # also preserve the decimal degrees for reference
-        i_rad = [world[i,0] for i in range(len(world[:,0]))]
-        i_decd = [world[i,1] for i in range(len(world[:,1]))]
+        # transform to arcmin from the corner, and also preserve the decimal degrees for reference
+        add_sky(cat, world, ra_corner, dec_corner)
+        i_ra, i_dec, i_rad, i_decd = columns(cat, 'i_ra', 'i_dec', 'i_rad', 'i_decd')
         
         search = open(obj+'_search'+fwhm_sm_string+'.txt','w+')
         
@@ -115,27 +98,22 @@ def main():
         
         dms = np.arange(22.0,27.0,0.01)
         
+        # find each star's filter dm ranges once, then each step is a lookup
+        cm_filter0, gi_iso0, i_iso0 = make_filter(0.0, filter_file)
+        f_intervals = filter_intervals(gmi, i_mag, errorbar_lengths(gmi_err), errorbar_lengths(i_ierr), cm_filter0)
+        
         for dm in dms:
             mpc = pow(10,((dm + 5.)/5.))/1000000.
             dm_string = '{:5.2f}'.format(dm).replace('.','_')
         
-            cm_filter, gi_iso, i_m_iso = make_filter(dm, filter_file)
-            stars_f = filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, filter_sig = 1)
+            gi_iso, i_m_iso = gi_iso0, i_iso0 + dm
+            stars_f = sweep_mask(f_intervals, len(i_mag), dm)
         
-            xy_points = zip(i_ra,i_dec)
+            xy_points = np.column_stack((i_ra,i_dec))
         
             # make new vectors containing only the filtered points
             
-            i_mag_f = [i_mag[i] for i in range(len(i_mag)) if (stars_f[i])]
-            g_mag_f = [g_mag[i] for i in range(len(i_mag)) if (stars_f[i])]
-            gmi_f = [gmi[i] for i in range(len(i_mag)) if (stars_f[i])]
-            i_ra_f = [i_ra[i] for i in range(len(i_mag)) if (stars_f[i])]
-            i_dec_f = [i_dec[i] for i in range(len(i_mag)) if (stars_f[i])]
-            i_rad_f = [i_rad[i] for i in range(len(i_mag)) if (stars_f[i])]
-            i_decd_f = [i_decd[i] for i in range(len(i_mag)) if (stars_f[i])]
-            i_x_f = [ix[i] for i in range(len(i_mag)) if (stars_f[i])]
-            i_y_f = [iy[i] for i in range(len(i_mag)) if (stars_f[i])]
-            fwhm_sf = [fwhm_s[i] for i in range(len(i_mag)) if (stars_f[i])]
+            i_mag_f, g_mag_f, gmi_f, i_ra_f, i_dec_f, i_rad_f, i_decd_f, i_x_f, i_y_f, fwhm_sf = select(cat, stars_f, 'i_mag', 'g_mag', 'gmi', 'i_ra', 'i_dec', 'i_rad', 'i_decd', 'ix', 'iy', 'fwhm_s')
             n_in_filter = len(i_mag_f)
             
             xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl = grid_smooth(i_ra_f, i_dec_f, fwhm_sm, width, height)
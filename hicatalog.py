@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+The UCHVC HI catalog (predblist.sort.csv), read once per process
+
+lookup(object) gives the catalog row for a target as a dict, with the HI position
+already in decimal degrees:
+
+    hi = lookup('AGC249525')
+    hi['ra'], hi['dec'], hi['a'], hi['b'], hi['pa'], hi['m_hi']
+
+Targets are found by name (HVC...) or altname (AGC...), case-insensitively. Names
+that aren't in the catalog exactly fall back to the old substring match on the
+altname, then the name column, and the answer is remembered.
+"""
+import os
+import numpy as np
+
+catalog_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'predblist.sort.csv')
+
+# column layout of predblist.sort.csv, in file order
+hi_cols = ['name', 'altname', 'hi_coords', 'cz', 'w50', 'size', 'm_hi', 'a40', 'other_obs', 'wiyn_obs', 'inst', 'mis', 'stacked', 'proc', 'a', 'b', 'pa']
+_float_cols = ['cz', 'w50', 'm_hi', 'a', 'b', 'pa']
+
+_db = {}                # catalog file -> (records, index)
+
+def parse_coords(coord):
+    # 'hhmmss.s+ddmmss' -> (ra, dec) in decimal degrees
+    ra = 15.0*(float(coord[0:2]) + float(coord[2:4])/60. + float(coord[4:8])/3600.)
+    dec = float(coord[9:11]) + float(coord[11:13])/60. + float(coord[13:15])/3600.
+    if coord[8] == '-':
+        dec = -dec
+    return ra, dec
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+def load(path=None):
+    # the catalog as a list of records and a name/altname -> record index, parsed on first use
+    if path is None:
+        path = catalog_file
+    if path not in _db:
+        rows = np.loadtxt(path, dtype=str, delimiter=',', ndmin=2)
+        records, index = [], {}
+        for row in rows:
+            rec = dict(zip(hi_cols, [v.strip() for v in row]))
+            for c in _float_cols:
+                rec[c] = _float(rec[c])
+            rec['ra'], rec['dec'] = parse_coords(rec['hi_coords'])
+            records.append(rec)
+            for key in (rec['name'].upper(), rec['altname'].upper()):
+                if key and key not in index:
+                    index[key] = rec
+        _db[path] = (records, index)
+    return _db[path]
+
+def lookup(object, path=None):
+    # the catalog record for object (name or altname); KeyError if there isn't one
+    records, index = load(path)
+    key = object.upper()
+    if key not in index:
+        match = [rec for rec in records if key in rec['altname']] or [rec for rec in records if key in rec['name']]
+        if not match:
+            raise KeyError('{:s} is not in the HI catalog'.format(object))
+        index[key] = match[0]
+    return index[key]
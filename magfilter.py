@@ -26,168 +26,35 @@ from astropy.io import fits
 # from pyraf import iraf
 import scipy.stats as ss
 from scipy import signal
-from odi_calibrate import query, filtercomment, usage, write_header
-from photutils import detect_sources, source_properties
-from photutils.utils import random_cmap
+from odi_calibrate import query, filtercomment, usage, write_header, download_sdss_gal
+import nullcache
+import hicatalog
+import smoothing
+from catalog import read_catalog, error_cut, project, add_sky, columns, select, sky_index, select_within, calibrated_cols, daophot_cols
 try :
     from scipy import ndimage
 except ImportError :
     print('bad import')
 
 daophot = True #set to True for daophot photometry for loading in the data file and setting fwhm values since they are not included
+sequential_levels = (90.0, 95.0)   # significance thresholds the sequential Monte Carlo has to decide
+sequential_batch = 100             # samples drawn between its checks
+sequential_z = 2.576               # width of its confidence interval (99%)
+null_block = 32                    # smoothing matrix rows per product in null_peaks
+null_dense = 0.03                  # fields with more stars than this per pixel go through null_peaks as a count cube
+significance_methods = ('mc', 'sequential', 'analytic')
+analytic_from = {}                 # (width, height, fwhm) -> n the analytic significance is good from (see calibrate_significance)
 
 def downloadSDSSgal(img1, img2):
-    formats = ['csv','xml','html']
-    
-    astro_url='http://skyserver.sdss3.org/public/en/tools/search/x_sql.aspx'
-    public_url='http://skyserver.sdss3.org/public/en/tools/search/x_sql.aspx'
-    
-    default_url=public_url
-    default_fmt='csv'
-    
-    try: 
-        import sys
-        import numpy as np
-        from astropy.io import fits
-        from astropy import wcs
-        import os
-        import string
-    except ImportError:
-        print("You should 'pip install astropy' before you try to run this program") 
-    
-    print('fetching SDSS data from \n--> '+public_url)
-    
-    image = img1
-    
-    # read in the image header and save it to a variable for non-destructive editing
-    hdulist = fits.open(image)
-    hdr = hdulist[0].header
-    hdulist.close()
-    # get the image dimensions
-    xdim = hdr['NAXIS1']
-    ydim = hdr['NAXIS2']
-    
-    # and find the image center
-    xc = xdim/2.0
-    yc = ydim/2.0
-    
-    # get the CD matrix keywords
-    cd11 = hdr['CD1_1']
-    cd22 = hdr['CD2_2']
-    # try to load cd12 and cd21, if they don't exist, set them to zero
-    try :
-        cd12 = hdr['CD1_2']
-    except:
-        cd12 = 0.0
-    try :
-        cd21 = hdr['CD2_1']
-    except:
-        cd21 = 0.0
-    
-    # get rid of keywords starting with PV, they don't work with astropy.wcs
-    # and steven thinks they are redundant anyway
-    pvlist = hdr['PV*']
-    for pv in pvlist:
-        hdr.remove(pv)
-        
-    # open the second fits image
-    hdulist = fits.open(img2)
-    hdr_r = hdulist[0].header
-    hdulist.close()
-    
-    pvlist = hdr_r['PV*']
-    for pv in pvlist:
-        hdr_r.remove(pv)
-    
-    # Parse the WCS keywords in the primary HDU
-    w = wcs.WCS(hdr)
-    w_r = wcs.WCS(hdr_r)
-    
-    # Some pixel coordinates of interest (these are the image centers)
-    pixcrd = np.array([[xc,yc]], np.float_)
-    
-    # Convert pixel coordinates to world coordinates
-    # The second argument is "origin" -- in this case we're declaring we
-    # have 1-based (Fortran-like) coordinates.
-    world = w.wcs_pix2world(pixcrd, 1)
-    # print(world)    
-    rac = world[0][0]
-    decc = world[0][1]
-    
-    # get the biggest radius of the image in arcminutes
-    pixscal1 = 3600*abs(cd11)
-    pixscal2 = 3600*abs(cd22)
-    xas = pixscal1 * xdim # in arcseconds
-    yas = pixscal2 * ydim
-    xam = xas/60    # to arcminutes
-    yam = yas/60
-    #print(xam,yam)
-    #radius for query: sqrt2 = 1.414
-    sizeam = 1.414*(xam+yam)/4
-    # print sizeam
-    
-    if not os.path.isfile(image[:-5]+'.sdssgal'):
-        # build the SDSS query
-        qry = "select O.ra, O.dec, O.u, O.err_u, O.g, \nO.err_g, O.r, O.err_r, O.i, \nO.err_i, O.z, O.err_z, O.probPSF \nfrom \ndbo.fGetNearbyObjEq("+repr(rac)+","+repr(decc)+","+repr(sizeam)+") \nas N inner join PhotoObjAll as O on O.objID = N.objID order by N.distance"
-    
-        # print it to the terminal
-        print('with query\n-->', qry)
-        url = default_url
-        fmt = default_fmt
-        writefirst = 1
-        verbose = 0
-    
-        # actually do the query
-    
-        ofp = open(image[:-5]+'.sdssgal','w+')
-        if verbose:
-            write_header(ofp,'#',url,qry)
-        file_ = query(qry,url,fmt)
-        # Output line by line (in case it's big)
-        line = file_.readline()
-        if line.startswith("ERROR"): # SQL Statement Error -> stderr
-            ofp = sys.stderr
-        if writefirst:
-            ofp.write(string.rstrip(line)+os.linesep)
-        line = file_.readline()
-        while line:
-            ofp.write(string.rstrip(line)+os.linesep)
-            line = file_.readline()
-        ofp.close()
-    
-    # read in the results
-    ras,decs,u,err_u,g,err_g,r,err_r,i,err_i,z,err_z = np.loadtxt(image[:-5]+'.sdssgal',usecols=(0,1,2,3,4,5,6,7,8,9,10,11), unpack=True, delimiter=',', skiprows=2)
-    probPSF = np.loadtxt(image[:-5]+'.sdssgal', usecols=(12,), dtype=int, unpack=True, delimiter=',', skiprows=2)
-    
-    coords2 = list(zip(ras,decs))
-    pixcrd2 = w.wcs_world2pix(coords2, 1)
-    pixcrd2_r = w_r.wcs_world2pix(coords2, 1)
-    
-    # keep things that are actually stars (defined as being psf's) and with the right magnitude range (arbitrary)
-    
-    keep_stars = ((probPSF == 0))# (psfMag_g < gmaglim) & (psfMagErr_g <0.1) & (psfMag_g > gmagbrlim))
-    print('keeping', len(np.where(keep_stars)[0]), 'galaxies of', len(g), 'sources')
-    
-    # then write out separate files for g and i
-    with open(image[:-5]+'.galxy','w+') as f1:
-        print("# x_g y_g ra dec u uerr g gerr r rerr i ierr z zerr (all modelmags)", file=f1)
-        for j,id in enumerate(np.where(keep_stars)[0]):
-            print(pixcrd2[id][0], pixcrd2[id][1], ras[id], decs[id], u[id], err_u[id], g[id], err_g[id], r[id], err_r[id], i[id], err_i[id], z[id], err_z[id], file=f1)
-            
-    with open(img2[:-5]+'.galxy','w+') as f1:
-        print("# x_r y_r ra dec u uerr g gerr r rerr i ierr z zerr (all modelmags)", file=f1)
-        for j,id in enumerate(np.where(keep_stars)[0]):
-            print(pixcrd2_r[id][0], pixcrd2_r[id][1], ras[id], decs[id], u[id], err_u[id], g[id], err_g[id], r[id], err_r[id], i[id], err_i[id], z[id], err_z[id], file=f1)
+    # SDSS galaxies on both images (.galxy); the query is shared with download_sdss
+    download_sdss_gal(img1, img2)
 
-    
 def galaxyMap(fits_file_i, fwhm, dm, filter_file):
     title_string = fits_file_i.split('_')[0]
     x_r, y_r, ra, dec, u, uerr, g, gerr, r, rerr, i, ierr, z, zerr = np.loadtxt(fits_file_i[:-5]+'.galxy', usecols=(0,1,2,3,4,5,6,7,8,9,10,11,12,13), unpack=True)
     gmi = g-i
     gmierr = [np.sqrt(gerr[j]**2 + ierr[j]**2) for j in range(len(g))]
     
-    pixcrd = list(zip(x_r,y_r))
-    
     fits_i = fits.open(fits_file_i)
     # Parse the WCS keywords in the primary HDU
     warnings.filterwarnings('ignore', category=UserWarning, append=True)
@@ -202,15 +69,14 @@ def galaxyMap(fits_file_i, fwhm, dm, filter_file):
     width = (ne_corner[0]-nw_corner[0])*60.
     height = (ne_corner[1]-se_corner[1])*60.
 
-    world = w.all_pix2world(pixcrd, 1)
-    ra_corner, dec_corner = w.all_pix2world(0,0,1)
+    world, ra_corner, dec_corner = project(x_r, y_r, fits_i[0].header, fits_file_i[:-5]+'.galxy')
     ra_c_d,dec_c_d = deg2HMS(ra=ra_corner, dec=dec_corner, round=True)
 
     fits_i.close()
     
-    # split the ra and dec out into individual arrays and transform to arcmin from the corner
-    i_ra = [abs((world[j,0]-ra_corner)*60) for j in range(len(world[:,0]))]
-    i_dec = [abs((world[j,1]-dec_corner)*60) for j in range(len(world[:,1]))]
+    # transform to arcmin from the corner
+    i_ra = np.abs((world[:,0]-ra_corner)*60)
+    i_dec = np.abs((world[:,1]-dec_corner)*60)
     
     if dm > 0:
         cm_filter, gi_iso, i_m_iso = make_filter(dm, filter_file)
@@ -259,37 +125,17 @@ def galaxyMap(fits_file_i, fwhm, dm, filter_file):
     return xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl
         
 def getHIellipse(object, ra_corner, dec_corner, centroid=False):
-    from astropy import units as u
-    from astropy.coordinates import SkyCoord
-    uchvcdb = os.path.dirname(os.path.abspath(__file__))+'/predblist.sort.csv'
-    name, coords, ar, br, par = np.loadtxt(uchvcdb, usecols=(1,2,14,15,16), dtype=str, delimiter=',', unpack=True)
     # print object
-    # find the right row
-    coord = [this for i,this in enumerate(coords) if object.upper() in name[i]][0]
-    a = [this for i,this in enumerate(ar) if object.upper() in name[i]][0]
-    b = [this for i,this in enumerate(br) if object.upper() in name[i]][0]
-    pa = [this for i,this in enumerate(par) if object.upper() in name[i]][0]
-
-    # parse the coordinate into a better string
-    rah = coord[0:2]
-    ram = coord[2:4]
-    ras = coord[4:8]
-    ded = coord[8:11]
-    dem = coord[11:13]
-    des = coord[13:15]
-
-    ra = rah+':'+ram+':'+ras
-    dec = ded+':'+dem+':'+des
-    coord_hi = SkyCoord(ra, dec, unit=(u.hourangle, u.deg))
-    ra_hi = coord_hi.ra.deg
-    dec_hi = coord_hi.dec.deg
+    # find the right row (the catalog is only read once)
+    hi = hicatalog.lookup(object)
+    ra_hi, dec_hi = hi['ra'], hi['dec']
     
     cosd = lambda x : np.cos(np.deg2rad(x))
     sind = lambda x : np.sin(np.deg2rad(x))
     
     hi_c_x, hi_c_y = abs((ra_hi-ra_corner)*60), abs((dec_hi-dec_corner)*60)
     
-    a, b, pa = a.astype(float)/2., b.astype(float)/2., -pa.astype(float)
+    a, b, pa = hi['a']/2., hi['b']/2., -hi['pa']
     
     t = np.array(list(range(0,359,1)))
     ell = np.array([a*cosd(t) , b*sind(t)])
@@ -312,67 +158,62 @@ def rotateImage(img, angle, pivot):
     imgR = ndimage.rotate(imgP, angle, order=5, reshape=False)
     return imgR[padY[0] : -padY[1], padX[0] : -padX[1]]
     
-def getHIcoincidence(x, y, object, ra_corner, dec_corner, height, width, dm):
-    from astropy import units as u
-    from astropy.coordinates import SkyCoord
-    import matplotlib.colors as colors
-    uchvcdb = os.path.dirname(os.path.abspath(__file__))+'/predblist.sort.csv'
-    name, coords, ar, br, par = np.loadtxt(uchvcdb, usecols=(1,2,14,15,16), dtype=str, delimiter=',', unpack=True)
-    # print object
-    # find the right row
-    coord = [this for i,this in enumerate(coords) if object.upper() in name[i]][0]
-    a = [this for i,this in enumerate(ar) if object.upper() in name[i]][0]
-    b = [this for i,this in enumerate(br) if object.upper() in name[i]][0]
-    pa = [this for i,this in enumerate(par) if object.upper() in name[i]][0]
-    
-    # parse the coordinate into a better string
-    rah = coord[0:2]
-    ram = coord[2:4]
-    ras = coord[4:8]
-    ded = coord[8:11]
-    dem = coord[11:13]
-    des = coord[13:15]
-    
-    ra = rah+':'+ram+':'+ras
-    dec = ded+':'+dem+':'+des
-    coord_hi = SkyCoord(ra, dec, unit=(u.hourangle, u.deg))
-    ra_hi = coord_hi.ra.deg
-    dec_hi = coord_hi.dec.deg
-    
-    cosd = lambda x : np.cos(np.deg2rad(x))
-    sind = lambda x : np.sin(np.deg2rad(x))
-    
-    hi_c_x, hi_c_y = np.zeros(1), np.zeros(1)
-    
-    hi_c_x[0], hi_c_y[0] = abs((ra_hi-ra_corner)*60), abs((dec_hi-dec_corner)*60)
-    
-    a, b, pa = a.astype(float)/2., b.astype(float)/2., -pa.astype(float)
-    
-    t = np.array(list(range(0,359,1)))
-    ell = np.array([a*cosd(t) , b*sind(t)])
-    rot = np.array([[cosd(pa) , -sind(pa)],[sind(pa) , cosd(pa)]])
-    ell_rot = np.zeros((2,ell.shape[1]))
-    for i in range(ell.shape[1]):
-        ell_rot[:,i] = np.dot(rot,ell[:,i])
-    hi_x_circ, hi_y_circ = hi_c_x[0]+ell_rot[0,:], hi_c_y[0]+ell_rot[1,:]
+_hi_maps = {}
 
-    # x_dist = np.random.multivariate_normal((hi_c_x, hi_c_y), cov, 10000) 
-     
-    bins_h = int(height * 60. / 8.)
-    bins_w = int(width * 60. / 8.)
-    grid, xedges, yedges = np.histogram2d(hi_c_y, hi_c_x, bins=[bins_h,bins_w], range=[[0,height],[0,width]], normed=True) 
-    xcenters = (xedges[:-1] + xedges[1:])/2.
-    ycenters = (yedges[:-1] + yedges[1:])/2.
-    # find the pivot point for the rotation == the HI centroid pixel from the histogram
-    pivot = np.unravel_index(grid.argmax(),grid.shape)
-    
-    # convolve the single point with a 2d gaussian w/ a, b as axis ratios
-    grid_gaus = ndimage.filters.gaussian_filter(grid, sigma=((bins_w/width)*2.*a/2.355, (bins_w/width)*2.*b/2.355), mode='nearest', cval=0)
-    
-    # rotate the image with the correct pivot point
-    grid_rot = rotateImage(grid_gaus/np.amax(grid_gaus), pa, [pivot[-1], pivot[0]])
+def HImap(object, ra_corner, dec_corner, height, width):
+    # the HI probability map on the star-count grid: the elliptical gaussian with the catalog's
+    # a and b as FWHM, rotated by pa, evaluated in closed form at the pixel centres and scaled to
+    # 1 at the HI centroid. kept per object and grid, with the grid centres and HI ellipse
+    key = (object, ra_corner, dec_corner, height, width)
+    if key not in _hi_maps:
+        hi = hicatalog.lookup(object)
+        hi_c_x, hi_c_y = abs((hi['ra']-ra_corner)*60), abs((hi['dec']-dec_corner)*60)
+        a, b, pa = hi['a']/2., hi['b']/2., -hi['pa']
+        
+        cosd = lambda x : np.cos(np.deg2rad(x))
+        sind = lambda x : np.sin(np.deg2rad(x))
+        t = np.array(list(range(0,359,1)))
+        rot = np.array([[cosd(pa) , -sind(pa)],[sind(pa) , cosd(pa)]])
+        ell_rot = np.dot(rot, np.array([a*cosd(t) , b*sind(t)]))
+        hi_x_circ, hi_y_circ = hi_c_x+ell_rot[0,:], hi_c_y+ell_rot[1,:]
+        
+        bins_h = int(height * 60. / 8.)
+        bins_w = int(width * 60. / 8.)
+        xedges = np.linspace(0, height, bins_h+1)
+        yedges = np.linspace(0, width, bins_w+1)
+        xcenters = (xedges[:-1] + xedges[1:])/2.
+        ycenters = (yedges[:-1] + yedges[1:])/2.
+        
+        # offsets from the centroid (rows are dec, columns ra) in the frame of the ellipse axes;
+        # the catalog's a runs along dec and b along ra before the rotation
+        d_dec, d_ra = xcenters[:,None]-hi_c_y, ycenters[None,:]-hi_c_x
+        if a == 0. or b == 0.:
+            # an unresolved axis (a or b 0 in the catalog): the old smoothing left the centroid pixel
+            # unsmoothed along it, so the map is a line one pixel wide through that pixel (just the
+            # pixel if both are 0), measured from its centre as the old rotation was
+            row = min(int(hi_c_y/height*bins_h), bins_h-1)
+            col = min(int(hi_c_x/width*bins_w), bins_w-1)
+            d_dec, d_ra = xcenters[:,None]-xcenters[row], ycenters[None,:]-ycenters[col]
+        u = cosd(pa)*d_dec + sind(pa)*d_ra
+        v = -sind(pa)*d_dec + cosd(pa)*d_ra
+        half_pix = 0.5*height/bins_h
+        grid_rot = np.ones((bins_h, bins_w))
+        for off, fw in ((u, 2.*a), (v, 2.*b)):
+            if fw > 0.:
+                grid_rot *= np.exp(-0.5*(off/(fw/2.355))**2)
+            else:
+                grid_rot[np.abs(off) > half_pix + 1e-9] = 0.
+        _hi_maps[key] = (grid_rot, xedges, yedges, xcenters, ycenters, hi_x_circ, hi_y_circ)
+    return _hi_maps[key]
+
+def getHIcoincidence(x, y, object, ra_corner, dec_corner, height, width, dm, plot=True):
+    # value of the HI map at grid pixel(s) (x, y) (row, column, as for S); x and y can be arrays
+    # of candidate peaks, which are all looked up at once
+    import matplotlib.colors as colors
+    grid_rot, xedges, yedges, xcenters, ycenters, hi_x_circ, hi_y_circ = HImap(object, ra_corner, dec_corner, height, width)
+    coinc = grid_rot[x, y]
     
-    if grid_rot[x][y] > 0.9:
+    if plot and np.any(coinc > 0.9):
         plt.clf()
         plt.figure(figsize=(5.5,5))
         bounds = np.linspace(0, 1, 11)
@@ -386,46 +227,58 @@ def getHIcoincidence(x, y, object, ra_corner, dec_corner, height, width, dm):
         plt.ylim(0,20)
         plt.xlabel('RA (arcmin)')
         plt.ylabel('Dec (arcmin)')
-        plt.title('{:s} @ dm = {:5.2f} : {:6.3f}%'.format(object, dm, grid_rot[x][y]*100.))
+        plt.title('{:s} @ dm = {:5.2f} : {:6.3f}%'.format(object, dm, np.max(coinc)*100.))
         plt.colorbar(gr, orientation='vertical')
         plt.savefig('{:s}_{:5.2f}_coinc.pdf'.format(object,dm))
     
-    return grid_rot[x][y]    
+    return coinc
     
 def dist2HIcentroid(ra, dec, ra_hi, dec_hi, distance):
-    from astropy import units as u
-    from astropy.coordinates import SkyCoord
-    c_hi = SkyCoord(ra = ra_hi, dec = dec_hi, distance=distance*1000000., unit=(u.deg, u.deg, u.pc))
-    c_peak = SkyCoord(ra = ra, dec = dec, distance=distance*1000000., unit=(u.hourangle, u.deg, u.pc))
-    sep = c_hi.separation(c_peak)
-    sep3d = c_hi.separation_3d(c_peak)
-    # print c_hi, c_peak, sep.arcsecond
-    return sep.arcsecond, sep3d
+    # separation (arcsec) of the peak(s) at (ra, dec) from the HI centroid, and the distance between
+    # them (pc) if both are at distance (Mpc). ra, dec are degrees, scalars or arrays of candidates
+    # (sexagesimal strings, hours and degrees, still work but go through SkyCoord)
+    if np.asarray(ra).dtype.kind in 'US':
+        from astropy import units as u
+        from astropy.coordinates import SkyCoord
+        c_peak = SkyCoord(ra = ra, dec = dec, unit=(u.hourangle, u.deg))
+        ra, dec = c_peak.ra.deg, c_peak.dec.deg
+    lon1, lat1 = np.deg2rad(ra_hi), np.deg2rad(dec_hi)
+    lon2, lat2 = np.deg2rad(ra), np.deg2rad(dec)
+    # Vincenty formula, as astropy's separation uses
+    dlon = lon2 - lon1
+    num1 = np.cos(lat2)*np.sin(dlon)
+    num2 = np.cos(lat1)*np.sin(lat2) - np.sin(lat1)*np.cos(lat2)*np.cos(dlon)
+    denom = np.sin(lat1)*np.sin(lat2) + np.cos(lat1)*np.cos(lat2)*np.cos(dlon)
+    sep = np.arctan2(np.hypot(num1, num2), denom)
+    sep3d = 2.*np.asarray(distance)*1000000.*np.sin(sep/2.)
+    # print ra_hi, dec_hi, ra, dec, np.rad2deg(sep)*3600.
+    return np.rad2deg(sep)*3600., sep3d
+
+def _sexagesimal(values, hours, round):
+    # [-]dd:mm:ss.s strings for an array of degrees (as hours of ra if hours)
+    values = np.asarray(values, dtype=float)
+    signs = np.where(np.signbit(values), '-', '')
+    values = np.abs(values)/15. if hours else np.abs(values)
+    whole = values.astype(int)
+    minutes = ((values-whole)*60).astype(int)
+    seconds = ((values-whole)*60 - minutes)*60
+    if round:
+        seconds = seconds.astype(int)
+    return ['{0}{1:02d}:{2:02d}:{3:04.1f}'.format(*v) for v in zip(signs, whole, minutes, seconds)]
 
 def deg2HMS(ra='', dec='', round=False):
-    RA, DEC, rs, ds = '', '', '', ''
-    if dec:
-        if str(dec)[0] == '-':
-            ds, dec = '-', abs(dec)
-        deg = int(dec)
-        decM = abs(int((dec-deg)*60))
-        if round:
-            decS = int((abs((dec-deg)*60)-decM)*60)
-        else:
-            decS = (abs((dec-deg)*60)-decM)*60
-        DEC = '{0}{1:02d}:{2:02d}:{3:04.1f}'.format(ds, deg, decM, decS)
-
-    if ra:
-        if str(ra)[0] == '-':
-            rs, ra = '-', abs(ra)
-        raH = int(ra/15)
-        raM = int(((ra/15)-raH)*60)
-        if round:
-            raS = int(((((ra/15)-raH)*60)-raM)*60)
-        else:
-            raS = ((((ra/15)-raH)*60)-raM)*60
-        RA = '{0}{1:02d}:{2:02d}:{3:04.1f}'.format(rs, raH, raM, raS)
-    if ra and dec:
+    # ra and/or dec (degrees) as sexagesimal strings; arrays of values give lists of strings,
+    # all converted in one go
+    RA, DEC = '', ''
+    if not (isinstance(dec, str) and dec == ''):
+        DEC = _sexagesimal(np.ravel(dec), False, round)
+        if np.ndim(dec) == 0:
+            DEC = DEC[0]
+    if not (isinstance(ra, str) and ra == ''):
+        RA = _sexagesimal(np.ravel(ra), True, round)
+        if np.ndim(ra) == 0:
+            RA = RA[0]
+    if len(RA) and len(DEC):
         return (RA, DEC)
     else:
         return RA or DEC    
@@ -458,7 +311,126 @@ def make_youngpop(dm, filter_file):
     # scale the filter to the DM: to find the apparent mag. just add the DM
     return gi_iso, i_m_iso
 
-def filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, filter_sig = 1, gal = False):
+def errorbar_mask(x, y, xerr, yerr, cm_filter, chunk=2048):
+    # test every star at once against the CMD filter polygon: a star is in if its point
+    # is inside, or if its horizontal (color) or vertical (mag) error bar crosses a polygon edge.
+    # exact for straight bars, so no sampling of the bars is needed
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    xerr = np.abs(np.asarray(xerr, dtype=float))
+    yerr = np.abs(np.asarray(yerr, dtype=float))
+    
+    # polygon edges, closing the last vertex back onto the first like contains_points does
+    x1, y1 = cm_filter.vertices[:,0], cm_filter.vertices[:,1]
+    x2, y2 = np.roll(x1,-1), np.roll(y1,-1)
+    
+    stars_f = cm_filter.contains_points(np.column_stack((x,y)))
+    # chunk over stars to bound the (stars x edges) work arrays
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(0, len(x), chunk):
+            xs, ys = x[k:k+chunk,None], y[k:k+chunk,None]
+            # edges straddling the star's magnitude, crossed within the color bar
+            cross = (y1 <= ys) != (y2 <= ys)
+            xc = x1 + (ys-y1)*(x2-x1)/(y2-y1)
+            hit = cross & (np.abs(xc-xs) <= xerr[k:k+chunk,None])
+            # edges straddling the star's color, crossed within the magnitude bar
+            cross = (x1 <= xs) != (x2 <= xs)
+            yc = y1 + (xs-x1)*(y2-y1)/(x2-x1)
+            hit |= cross & (np.abs(yc-ys) <= yerr[k:k+chunk,None])
+            stars_f[k:k+chunk] |= hit.any(axis=1)
+    return stars_f
+
+def _slices(xq, x1, y1, x2, y2):
+    # the intervals in y where the vertical lines x = xq (one per row) lie inside the polygon,
+    # as (lo, hi) arrays padded with nan: sort each row's edge crossings and pair them up
+    cross = (x1 <= xq) != (x2 <= xq)
+    yc = np.where(cross, y1 + (xq-x1)*(y2-y1)/(x2-x1), np.nan)
+    yc = np.sort(yc, axis=1)
+    if yc.shape[1] % 2:
+        yc = np.column_stack((yc, np.full(len(yc), np.nan)))
+    return yc[:,0::2], yc[:,1::2]
+
+def filter_intervals(x, y, xerr, yerr, cm_filter0, chunk=2048):
+    # the filter only slides along the magnitude axis with dm, so for a filter made at dm = 0
+    # work out once, for every star, the ranges of dm over which its error bars overlap it.
+    # returns the star index and the low/high dm of each merged range
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    xerr = np.abs(np.asarray(xerr, dtype=float))
+    yerr = np.abs(np.asarray(yerr, dtype=float))
+    
+    x1, y1 = cm_filter0.vertices[:,0], cm_filter0.vertices[:,1]
+    x2, y2 = np.roll(x1,-1), np.roll(y1,-1)
+    
+    idx, lo, hi = [], [], []
+    def keep(k, ys, a, b):
+        # a star at magnitude y overlaps a filter stretch [a, b] (at dm = 0) for dm in [y-b, y-a]
+        ok = np.isfinite(a) & np.isfinite(b) & (a <= b)
+        rows, cols = np.nonzero(ok)
+        idx.append(k + rows)
+        lo.append(ys[rows,0] - b[rows,cols])
+        hi.append(ys[rows,0] - a[rows,cols])
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(0, len(x), chunk):
+            xs, ys = x[k:k+chunk,None], y[k:k+chunk,None]
+            xe, ye = xerr[k:k+chunk,None], yerr[k:k+chunk,None]
+            
+            # magnitude bar: the filter slice at the star's color, widened by the bar
+            a, b = _slices(xs, x1, y1, x2, y2)
+            keep(k, ys, a - ye, b + ye)
+            
+            # color bar: every height at which the polygon reaches into the strip the bar spans.
+            # that is the y-extent of the edges clipped to the strip plus the slices on its sides
+            for xq in (xs - xe, xs + xe):
+                a, b = _slices(xq, x1, y1, x2, y2)
+                keep(k, ys, a, b)
+            xa, xb = xs - xe, xs + xe
+            vertical = (x1 == x2)
+            ta = np.where(vertical, 0., (xa-x1)/(x2-x1))
+            tb = np.where(vertical, 1., (xb-x1)/(x2-x1))
+            t0 = np.maximum(np.minimum(ta, tb), 0.)
+            t1 = np.minimum(np.maximum(ta, tb), 1.)
+            inside = (t0 <= t1) & (~vertical | ((xa <= x1) & (x1 <= xb)))
+            ya, yb = y1 + t0*(y2-y1), y1 + t1*(y2-y1)
+            keep(k, ys, np.where(inside, np.minimum(ya, yb), np.nan), np.where(inside, np.maximum(ya, yb), np.nan))
+    
+    idx, lo, hi = np.concatenate(idx), np.concatenate(lo), np.concatenate(hi)
+    if len(idx) == 0:
+        return idx, lo, hi
+    
+    # merge overlapping ranges star by star: offset each star onto its own stretch of one line
+    # so a single sort + running max merges everything without crossing between stars
+    span = hi.max() - lo.min() + 1.0
+    off = idx*span - lo.min()
+    order = np.lexsort((lo, idx))
+    idx, lo, hi, off = idx[order], lo[order], hi[order], off[order]
+    reach = np.maximum.accumulate(hi + off)
+    start = np.ones(len(idx), dtype=bool)
+    start[1:] = (lo[1:] + off[1:]) > reach[:-1]
+    group = np.cumsum(start) - 1
+    end = np.full(start.sum(), -np.inf)
+    np.maximum.at(end, group, hi)
+    return idx[start], lo[start], end
+
+def sweep_mask(intervals, n, dm):
+    # membership at one dm from the precomputed filter_intervals ranges
+    idx, lo, hi = intervals
+    stars_f = np.zeros(n, dtype=bool)
+    stars_f[idx[(lo <= dm) & (dm <= hi)]] = True
+    return stars_f
+
+def errorbar_lengths(err, filter_sig=1, legacy_bars=True):
+    # half-lengths of the error bars filter_sources tests. legacy_bars gives the bars the old
+    # sampled loop reached: points every 0.01*err out to int(filter_sig*err//0.001) steps
+    # (at least one, the star itself), i.e. about 10*err**2 long rather than filter_sig*err
+    err = np.asarray(err, dtype=float)
+    if not legacy_bars:
+        return np.abs(float(filter_sig)*err)
+    nsteps = np.maximum(np.abs(np.floor_divide(float(filter_sig)*err, 0.001)), 1.)
+    return 0.01*np.abs(err)*(nsteps-1.)
+
+def filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, filter_sig = 1, gal = False, legacy_bars = True):
     if cm_filter == None:
         stars_f = [True] * len(gmi)
     # first get the stars that are in the filter (points & 1-sig error bars!)
@@ -466,41 +438,32 @@ def filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, filter_sig = 1, gal =
         print(min(cm_filter.vertices[:,1]))
         stars_f = (0.75 < gmi) & (1.5 > gmi) & (min(cm_filter.vertices[:,1]) < i_mag)
     else:
-        stars_f = list(gmi)
-        for i in range(len(gmi)) :
-            nsteps_color = int(abs((float(filter_sig)*gmi_err[i])//0.001))
-            nsteps_mag = int(abs((float(filter_sig)*i_ierr[i])//0.001))
-            
-            if nsteps_color == 0 :
-                nsteps_color = 1
-            if nsteps_mag == 0 :
-                nsteps_mag = 1
-            
-            # each error bar, sampled as points
-            cm_points_l = [(gmi[i]-0.01*j*gmi_err[i],i_mag[i]) for j in range(nsteps_color)]
-            cm_points_r = [(gmi[i]+0.01*j*gmi_err[i],i_mag[i]) for j in range(nsteps_color)]
-            cm_points_u = [(gmi[i],i_mag[i]-0.01*j*i_ierr[i]) for j in range(nsteps_mag)]
-            cm_points_d = [(gmi[i],i_mag[i]+0.01*j*i_ierr[i]) for j in range(nsteps_mag)]
-
-            # check if the errorbar points fall in the filter        
-            stars_f_l = cm_filter.contains_points(cm_points_l)        
-            stars_f_r = cm_filter.contains_points(cm_points_r)        
-            stars_f_u = cm_filter.contains_points(cm_points_u)        
-            stars_f_d = cm_filter.contains_points(cm_points_d)        
-            
-            # if any part of any error bar is in the filter, it gets selected (True)
-            stars_f[i] = any(stars_f_l) | any(stars_f_r) | any(stars_f_u) | any(stars_f_d)  
+        # if any part of any error bar is in the filter, it gets selected (True)
+        stars_f = errorbar_mask(gmi, i_mag, errorbar_lengths(gmi_err, filter_sig, legacy_bars), errorbar_lengths(i_ierr, filter_sig, legacy_bars), cm_filter)
     
     # figure out how many stars are in the filter
     check = [stars_f[i] for i in range(len(stars_f)) if (stars_f[i])]
     # print len(check), "stars in filter"
     return stars_f
 
+def _segment(S):
+    # table of the sources detect_sources finds in a significance map
+    from photutils import detect_sources, source_properties
+    try: 
+        segm = detect_sources(S, 2.0, npixels=5)
+        props = source_properties(S, segm)
+        columns = ['id', 'maxval_xpos', 'maxval_ypos', 'max_value', 'area']
+        return props.to_table(columns=columns)
+    except ValueError:
+        return []
+
 def grid_smooth(i_ra_f, i_dec_f, fwhm, width, height):
     # bin the filtered stars into a grid with pixel size XXX
     # print "Binning for m-M =",dm
     # bins = 165
     # width = 30
+    # fwhm can also be a list of smoothing scales: the stars are binned once, and the result
+    # is a list with one (xedges, ..., tbl) tuple per scale
     bins_h = int(height * 60. / 8.)
     bins_w = int(width * 60. / 8.)
     # print bins_h, bins_w
@@ -508,7 +471,14 @@ def grid_smooth(i_ra_f, i_dec_f, fwhm, width, height):
     
     grid, xedges, yedges = np.histogram2d(i_dec_f, i_ra_f, bins=[bins_h,bins_w], range=[[0,height],[0,width]])
     hist_points = list(zip(xedges,yedges))
+    
+    if np.ndim(fwhm) > 0:
+        return [_smooth_grid(grid, xedges, yedges, f, width) for f in fwhm]
+    return _smooth_grid(grid, xedges, yedges, fwhm, width)
 
+def _smooth_grid(grid, xedges, yedges, fwhm, width):
+    # the part of grid_smooth after binning, for one smoothing scale
+    bins_w = grid.shape[1]
     sig = ((bins_w/width)*fwhm)/2.355
     sig3 = ((bins_w/width)*3.0)/2.355
     pltsig = fwhm/2.0
@@ -516,7 +486,7 @@ def grid_smooth(i_ra_f, i_dec_f, fwhm, width, height):
     pgrid_sigma = np.std(grid)
     
     # convolve the grid with a gaussian
-    grid_gaus = ndimage.filters.gaussian_filter(grid, sig, mode='constant', cval=0)
+    grid_gaus = smoothing.smooth(grid, sig)
     S = np.array(grid_gaus*0)
     S_th = 3.0
     
@@ -527,13 +497,7 @@ def grid_smooth(i_ra_f, i_dec_f, fwhm, width, height):
     
     above_th = [(int(i),int(j)) for i in range(len(S)) for j in range(len(S[i])) if (S[i][j] >= S_th)]
     
-    try: 
-        segm = detect_sources(S, 2.0, npixels=5)
-        props = source_properties(S, segm)
-        columns = ['id', 'maxval_xpos', 'maxval_ypos', 'max_value', 'area']
-        tbl = props.to_table(columns=columns)
-    except ValueError:
-        tbl = []
+    tbl = _segment(S)
     # print tbl
     # rand_cmap = random_cmap(segm.max + 1, random_state=12345)
     
@@ -547,42 +511,265 @@ def grid_smooth(i_ra_f, i_dec_f, fwhm, width, height):
     
     return xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl 
 
-def distfit(n,dists,title,width,height,fwhm,dm,samples=1000):
-    from scipy.stats import lognorm
+def _bin(v, edges):
+    # bin index of each value exactly as histogram2d assigns it (last edge closed), -1 if outside
+    b = np.searchsorted(edges, v, side='right') - 1
+    b[v == edges[-1]] = len(edges) - 2
+    b[~((v >= edges[0]) & (v <= edges[-1]))] = -1
+    return b
 
+def smooth_init(i_ra, i_dec, fwhm, width, height):
+    # state for grid_smooth_update over one catalog: the grid geometry, every star's bin, and
+    # per smoothing scale (fwhm can be a list, as for grid_smooth) the 1d smoothing matrices,
+    # whose rows are the separable pieces of each star's kernel stamp
+    bins_h = int(height * 60. / 8.)
+    bins_w = int(width * 60. / 8.)
+    sigs = [((bins_w/width)*f)/2.355 for f in np.atleast_1d(fwhm)]
+    xedges = np.linspace(0, height, bins_h+1)
+    yedges = np.linspace(0, width, bins_w+1)
+    bin_y, bin_x = _bin(np.asarray(i_dec, dtype=float), xedges), _bin(np.asarray(i_ra, dtype=float), yedges)
+    return {'shape':(bins_h, bins_w), 'multi':np.ndim(fwhm) > 0, 'sig':sigs, 'pltsig':[f/2.0 for f in np.atleast_1d(fwhm)],
+            'xedges':xedges, 'yedges':yedges, 'bin_y':bin_y, 'bin_x':bin_x, 'inside':(bin_y >= 0) & (bin_x >= 0),
+            'gauss_h':[smoothing.gauss_matrix(bins_h, sig) for sig in sigs], 'gauss_w':[smoothing.gauss_matrix(bins_w, sig) for sig in sigs],
+            'members':None, 'grid_gaus':None, 'updates':0}
+
+def grid_smooth_update(st, stars_f, max_delta=2000, refresh=200, segment=False):
+    # grid_smooth of the stars in stars_f (a mask over the catalog given to smooth_init), updating
+    # the previous call's smoothed map with the kernel stamps of the stars that entered (+) or
+    # left (-) the filter instead of re-binning and re-convolving the whole field. The stamps are
+    # separable, so all of them go on in one (h x m) . (m x w) product for m changed stars.
+    # A full rebuild happens on the first call, when more than max_delta stars changed, and
+    # every refresh updates (so rounding can't build up). segment=True also fills in tbl.
+    # With several scales (see smooth_init) the result is a list of tuples, one per scale
+    stars_f = np.asarray(stars_f, dtype=bool)
+    h, w = st['shape']
+    if st['members'] is None or st['updates'] >= refresh:
+        full = True
+    else:
+        changed = np.flatnonzero((stars_f != st['members']) & st['inside'])
+        full = len(changed) > max_delta
+    
+    if full:
+        keep = stars_f & st['inside']
+        grid = np.bincount(st['bin_y'][keep]*w + st['bin_x'][keep], minlength=h*w).reshape(h,w).astype(float)
+        st['grid_gaus'] = [smoothing.smooth(grid, sig) for sig in st['sig']]
+        st['updates'] = 0
+    elif len(changed):
+        sign = np.where(stars_f[changed], 1.0, -1.0)
+        for k, grid_gaus in enumerate(st['grid_gaus']):
+            grid_gaus += np.dot(st['gauss_h'][k][st['bin_y'][changed]].T*sign, st['gauss_w'][k][st['bin_x'][changed]])
+        st['updates'] += 1
+    st['members'] = stars_f.copy()
+    
+    results = []
+    for grid_gaus, pltsig in zip(st['grid_gaus'], st['pltsig']):
+        # the summary numbers come from the updated map in the same vectorised pass that makes S
+        grid_mean = np.mean(grid_gaus)
+        grid_sigma = np.std(grid_gaus)
+        S = (grid_gaus-grid_mean)/grid_sigma
+        tbl = _segment(S) if segment else []
+        # S is an increasing function of the smoothed map, so both peaks are at the same place
+        x_cent, y_cent = np.unravel_index(grid_gaus.argmax(),grid_gaus.shape)
+        results.append((st['xedges'], x_cent, st['yedges'], y_cent, S, x_cent, y_cent, pltsig, tbl))
+    return results if st['multi'] else results[0]
+
+def _band_blocks(npix, r, block):
+    # (out0, out1, in0, in1): a band of half-width r only maps rows in0:in1 onto rows out0:out1
+    return [(o0, min(npix, o0+block), max(0, o0-r), min(npix, o0+block+r)) for o0 in range(0, npix, block)]
+
+def null_peaks(n, width, height, fwhm, samples, batch=20, rng=None):
+    # peak significance of the smoothed density for `samples` uniform random fields of n stars,
+    # made `batch` fields at a time (small batches stay in cache). the stack is smoothed in float32
+    # as two banded matrix products, one product per block of rows of the smoothing matrix: along
+    # y, with the stack laid out as rows (x, field) (sparse fields as a sparse matrix of the stars,
+    # dense ones as a count cube, in blocks of 3*null_block as its products write strided), then
+    # along x in blocks of null_block, reducing each block to the peak and sum of squares as it
+    # comes out. the mean of a field comes straight from its
+    # stars (each adds its kernel's sum). stars are drawn straight into bins (uniform positions
+    # binned as histogram2d does are uniform over the bins) by a Generator: rng itself if it is
+    # one, otherwise seeded from rng (a RandomState) or the global np.random state
+    from scipy import sparse
     bins_h = int(height * 60. / 8.)
     bins_w = int(width * 60. / 8.)
     sig = ((bins_w/width)*fwhm)/2.355
-    valsLP = []
-    for i in range(samples) :
-        random_ra = width*np.random.random_sample((n,))
-        random_dec = height*np.random.random_sample((n,))
-        random_xy = list(zip(random_ra,random_dec))
-        grid_r, xedges_r, yedges_r = np.histogram2d(random_dec, random_ra, bins=[bins_h,bins_w], range=[[0,height],[0,width]])
-        hist_points_r = list(zip(xedges_r,yedges_r))
-        grid_gaus_r = ndimage.filters.gaussian_filter(grid_r, sig, mode='constant', cval=0)
-        S_r = np.array(grid_gaus_r*0)
-
-        grid_mean_r = np.mean(grid_gaus_r)
-        grid_sigma_r = np.std(grid_gaus_r)
-        S_r = (grid_gaus_r-grid_mean_r)/grid_sigma_r
+    npix = bins_h*bins_w
+    gauss_h, gauss_w = smoothing.gauss_matrix(bins_h, sig), smoothing.gauss_matrix(bins_w, sig)
+    kern_sum = np.outer(gauss_h.sum(axis=0), gauss_w.sum(axis=0)).ravel()
+    r = np.count_nonzero(gauss_h[0]) - 1
+    blocks_h, blocks_w = _band_blocks(bins_h, r, 3*null_block), _band_blocks(bins_w, r, null_block)
+    gauss_h, gauss_w = gauss_h.astype(np.float32), gauss_w.astype(np.float32)
+    if not isinstance(rng, np.random.Generator):
+        rng = np.random.default_rng((np.random if rng is None else rng).randint(2**31))
+    
+    valsLP = np.empty(samples)
+    # buffers kept across batches (fresh arrays this size cost a page fault per page)
+    block_buf = np.empty(null_block*min(batch, samples)*bins_h, dtype=np.float32)
+    if n >= null_dense*npix:
+        cube_buf, grid_buf = np.zeros(min(batch, samples)*npix, dtype=np.float32), np.empty(min(batch, samples)*npix, dtype=np.float32)
+    for k in range(0, samples, batch):
+        m = min(batch, samples-k)
+        cell = rng.integers(0, npix, (m,n), dtype=np.int32)
+        bin_y, bin_x = np.divmod(cell, bins_w)
+        mean = kern_sum[cell].sum(axis=1)/npix
+        
+        rows = (bin_x*m + np.arange(m)[:,None]).ravel()
+        if n < null_dense*npix:
+            cube = sparse.csr_matrix((np.ones(m*n, dtype=np.float32), (rows, bin_y.ravel())), shape=(bins_w*m, bins_h))
+            grid_y = cube.dot(gauss_h)
+        else:
+            # counts go into the kept buffer and are cleared back out after
+            cube, grid_y = cube_buf[:m*npix].reshape(bins_w*m, bins_h), grid_buf[:m*npix].reshape(bins_w*m, bins_h)
+            idx = rows*bins_h + bin_y.ravel()
+            np.add.at(cube.ravel(), idx, np.float32(1))
+            for o0, o1, i0, i1 in blocks_h:
+                np.matmul(cube[:,i0:i1], gauss_h[i0:i1,o0:o1], out=grid_y[:,o0:o1])
+            cube.ravel()[idx] = 0
         
-        x_cent_r, y_cent_r = np.unravel_index(grid_gaus_r.argmax(),grid_gaus_r.shape)
-        valsLP.append(S_r[x_cent_r][y_cent_r])
+        grid_y = grid_y.reshape(bins_w, m*bins_h)
+        peak, sumsq = np.full(m, -np.inf), np.zeros(m)
+        for o0, o1, i0, i1 in blocks_w:
+            grid_gaus_r = np.dot(gauss_w[o0:o1,i0:i1], grid_y[i0:i1], out=block_buf[:(o1-o0)*m*bins_h].reshape(o1-o0, m*bins_h)).reshape(o1-o0, m, bins_h)
+            peak = np.maximum(peak, grid_gaus_r.max(axis=0).max(axis=1))
+            grid_gaus_r -= mean[None,:,None].astype(np.float32)
+            sumsq += np.einsum('imj,imj->m', grid_gaus_r, grid_gaus_r)
+        # S at the peak of each smoothed field
+        valsLP[k:k+m] = (peak-mean)/np.sqrt(sumsq/npix)
+    return valsLP
 
-    x = np.linspace(2, 22, 4000)
+def null_fit(n, width, height, fwhm, samples=1000, cache=True, batch=20, rng=None):
+    # lognormal fit (al, loc, beta) to the Monte Carlo peak distribution for n stars, plus the
+    # histogram of the simulated peaks over [2,22]
+    from scipy.stats import lognorm
+    
+    # the null distribution only depends on n and the field geometry, so reuse it if we've seen it
+    fit = nullcache.lookup(n, width, height, fwhm, samples) if cache else None
+    if fit is not None:
+        return fit
+    valsLP = null_peaks(n, width, height, fwhm, samples, batch=batch, rng=rng)
 
-    bins, edges = np.histogram(valsLP, bins=400, range=[2,22], normed=True)
-    centers = (edges[:-1] + edges[1:])/2.
+    bins, edges = np.histogram(valsLP, bins=400, range=[2,22], density=True)
 
     al,loc,beta=lognorm.fit(valsLP)
-    pct = 100.0*lognorm.cdf(dists, al, loc=loc, scale=beta)
+    if cache:
+        nullcache.store(n, width, height, fwhm, samples, valsLP, al, loc, beta, bins)
+    return al, loc, beta, bins
+
+_profiles = {}
+
+def _edge_profile(bins_h, bins_w, sig):
+    # the smoothed map of a uniform field is lam*E, with noise variance lam*Q in each pixel
+    # (E, Q fall off towards the zero-padded edges). both are separable, so they only take a
+    # few hundred distinct values: keep those with their pixel counts, and the grid averages
+    key = (bins_h, bins_w, sig)
+    if key not in _profiles:
+        axes = []
+        for npix in (bins_h, bins_w):
+            gmat = smoothing.gauss_matrix(npix, sig)
+            eq = np.round(np.column_stack((gmat.sum(axis=1), (gmat**2).sum(axis=1))), 12)
+            vals, counts = np.unique(eq, axis=0, return_counts=True)
+            axes.append((vals[:,0], vals[:,1], counts, eq[:,0].mean(), (eq[:,0]**2).mean(), eq[:,1].mean()))
+        (eh, qh, ch, meh, mehh, mqh), (ew, qw, cw, mew, meww, mqw) = axes
+        E, Q, weight = np.outer(eh, ew).ravel(), np.outer(qh, qw).ravel(), np.outer(ch, cw).ravel()
+        _profiles[key] = (E, Q, weight, meh*mew, mehh*meww-(meh*mew)**2, mqh*mqw)
+    return _profiles[key]
+
+def analytic_pct(n, dists, width, height, fwhm):
+    # significance (%) of a peak S for n uniformly scattered stars without simulating: the expected
+    # Euler characteristic of the excursion set of the smoothed field above the peak value, summed
+    # over the pixels (gaussian random field theory, 2d term plus the single-pixel term), with the
+    # per-pixel tail probability taken from the Poisson count under the kernel (continuity corrected)
+    # rather than a gaussian, so small n work too. vectorised over dists; see calibrate_significance
+    from scipy.special import gammainc, ndtr, ndtri
+    
+    bins_h = int(height * 60. / 8.)
+    bins_w = int(width * 60. / 8.)
+    fwhm_pix = (bins_w/width)*fwhm
+    E, Q, weight, mean_E, var_E, mean_Q = _edge_profile(bins_h, bins_w, fwhm_pix/2.355)
+    dists = np.asarray(dists, dtype=float)
+    if n < 1:
+        return np.zeros(dists.shape)
+    lam = float(n)/(bins_h*bins_w)
+    
+    # peak value of the smoothed map that gives S = dists, then the gaussian-equivalent height
+    # of that value in every pixel
+    peak = lam*mean_E + dists[...,None]*np.sqrt(lam**2*var_E + lam*mean_Q)
+    z = -ndtri(np.clip(gammainc(peak/Q + 0.5, lam*E/Q), 1e-300, 1.0))
+    rho2 = 4.*np.log(2.)/(2.*np.pi)**1.5 * z*np.exp(-z**2/2.)
+    ec = ndtr(-z).max(axis=-1) + np.dot(rho2, weight)/fwhm_pix**2
+    return 100.0*(1.0 - np.clip(ec, 0.0, 1.0))
+
+def sequential_peaks(n, dists, width, height, fwhm, samples, batch=20, rng=None):
+    # null_peaks in steps of sequential_batch, stopping as soon as the confidence interval on the
+    # fraction of random fields with a lower peak than dists puts it clearly above or below each of
+    # sequential_levels, or after samples fields. returns the peaks simulated so far
+    vals = []
+    drawn, below = 0, 0
+    z2 = sequential_z**2
+    while drawn < samples:
+        step = null_peaks(n, width, height, fwhm, min(sequential_batch, samples-drawn), batch=batch, rng=rng)
+        vals.append(step)
+        drawn += len(step)
+        below += int(np.sum(step < dists))
+        # Wilson score interval on below/drawn
+        p = float(below)/drawn
+        centre = (p + z2/(2.*drawn))/(1. + z2/drawn)
+        half = sequential_z*np.sqrt(p*(1.-p)/drawn + z2/(4.*drawn**2))/(1. + z2/drawn)
+        if all(centre-half > level/100. or centre+half < level/100. for level in sequential_levels):
+            break
+    return np.concatenate(vals)
+
+def null_rng(seed, n, width, height, fwhm, samples):
+    # the generator for the null draws of n stars in a field: the same for every dm step (and
+    # worker) that needs them, so a cached entry doesn't depend on which one stored it first
+    return np.random.default_rng([seed, n, int(round(width*100.)), int(round(height*100.)), int(round(fwhm*100.)), samples])
+
+def distfit(n,dists,title,width,height,fwhm,dm,samples=1000,cache=True,batch=20,rng=None,method='mc',seed=None):
+    # with seed, the null draws come from null_rng(seed, n, ...) rather than rng. 'analytic' is
+    # only used from the n a calibration found it good from (analytic_from), it's 'mc' below that
+    from scipy.stats import lognorm
+    if method not in significance_methods:
+        raise ValueError('unknown significance method {:s} (one of {:s})'.format(repr(method), ', '.join(significance_methods)))
+
+    x = np.linspace(2, 22, 4000)
+    centers = np.linspace(2, 22, 401)
+    centers = (centers[:-1] + centers[1:])/2.
+    
+    if method == 'analytic' and n < analytic_from.get(_analytic_key(width, height, fwhm), np.inf):
+        method = 'mc'
+    if method == 'analytic':
+        # no simulation: the binned distribution is the derivative of the analytic cdf (which is
+        # smooth, so it's worked out every 0.25 and interpolated onto the 0.05 bins)
+        cdf = np.maximum.accumulate(analytic_pct(n, np.linspace(2, 22, 81), width, height, fwhm)/100.0)
+        cdf = np.interp(np.linspace(2, 22, 401), np.linspace(2, 22, 81), cdf)
+        return float(analytic_pct(n, dists, width, height, fwhm)), np.diff(cdf)/0.05, centers
+    
+    # the null distribution: cached for this n, mixed from the cached n either side, or simulated
+    if seed is not None:
+        rng = null_rng(seed, n, width, height, fwhm, samples)
+    fit = nullcache.lookup(n, width, height, fwhm, samples) if cache else None
+    mix = [(1.0, fit)] if fit is not None else (nullcache.bracket(n, width, height, fwhm, samples) if cache else None)
+    if mix is None and method == 'sequential':
+        # only simulate until it's clear which side of the thresholds the peak is on; a run that
+        # stops early has fewer than samples fields, so it isn't cached
+        valsLP = sequential_peaks(n, dists, width, height, fwhm, samples, batch=batch, rng=rng)
+        bins, edges = np.histogram(valsLP, bins=400, range=[2,22], density=True)
+        al,loc,beta = lognorm.fit(valsLP)
+        if cache and len(valsLP) == samples:
+            nullcache.store(n, width, height, fwhm, samples, valsLP, al, loc, beta, bins)
+        mix = [(1.0, (al, loc, beta, bins))]
+    elif mix is None:
+        mix = [(1.0, null_fit(n, width, height, fwhm, samples=samples, cache=cache, batch=batch, rng=rng))]
+    
+    # percentile of the peak under the (mixed) lognormal fits, so an n between two cached ones
+    # always lands between their percentiles
+    pct = 100.0*sum(w*lognorm.cdf(dists, al, loc=loc, scale=beta) for w, (al, loc, beta, b) in mix)
+    bins = sum(w*b for w, (al, loc, beta, b) in mix)
     # print 'Significance of detection:','{0:6.3f}%'.format(pct)
 
     if samples > 10001 and pct > 95.:
         plt.clf()
         plt.figure(figsize=(9,4))
-        plt.plot(x, lognorm.pdf(x, al, loc=loc, scale=beta),'r-', lw=2, alpha=0.6, label='lognormal distribution')
+        plt.plot(x, sum(w*lognorm.pdf(x, al, loc=loc, scale=beta) for w, (al, loc, beta, b) in mix),'r-', lw=2, alpha=0.6, label='lognormal distribution')
         plt.scatter(centers, bins, edgecolors='none', label='histogram of $\sigma$ from '+repr(samples)+' \nuniform random samples')
         ax = plt.subplot(111)
         plt.plot([dists,dists],[-1.0,2.0],'k--', lw=2, alpha=1.0, label='best '+title+' detection') 
@@ -597,6 +784,57 @@ def distfit(n,dists,title,width,height,fwhm,dm,samples=1000):
         
     return pct, bins, centers
 
+def _analytic_key(width, height, fwhm):
+    return tuple(round(float(v), 2) for v in (width, height, fwhm))
+
+def read_calibration(report_file):
+    # the n each smoothing scale of a calibrate_significance report is good from, into analytic_from
+    # (a scale that was never within tolerance stays on the Monte Carlo)
+    with open(report_file) as f:
+        for line in f:
+            if line.startswith('# analytic vs Monte Carlo'):
+                field = line.split(',')[-1].split()
+                width, height = float(field[0]), float(field[2])
+            elif line.startswith('# fwhm ') and line.split()[2].endswith(':'):
+                words = line.split()
+                analytic_from[_analytic_key(width, height, float(words[2].rstrip(':')))] = int(words[-1]) if 'n >=' in line else np.inf
+    return analytic_from
+
+def calibrate_significance(width, height, fwhm, ns, samples=2000, rng=None, out_file=None, tol=0.5):
+    # compare analytic_pct with the Monte Carlo lognormal fit at the peaks S the fit puts at
+    # the 90, 99 and 99.9% levels, for each n in ns (and each smoothing scale). a row is 'ok'
+    # when the analytic tail probabilities are all within tol (as a fraction) of the fitted ones,
+    # and distfit uses the analytic significance from the n where every larger n is ok (analytic_from)
+    from scipy.stats import lognorm
+    levels = np.array([90.0, 99.0, 99.9])
+    if out_file is None:
+        out_file = 'significance_calibration_{:s}.txt'.format(fwhm_label(fwhm))
+    with open(out_file, 'w+') as report:
+        print('# analytic vs Monte Carlo ({:d} samples) peak significance, {:5.2f} x {:5.2f} arcmin field'.format(samples, width, height), file=report)
+        print('# fwhm       n   S(90)  S(99) S(99.9)  pct_an(90) pct_an(99) pct_an(99.9)  ok', file=report)
+        for f in np.atleast_1d(fwhm):
+            safe_from = None
+            for n in ns:
+                al, loc, beta, bins = null_fit(int(n), width, height, f, samples=samples, rng=rng)
+                S = lognorm.ppf(levels/100.0, al, loc=loc, scale=beta)
+                pct = analytic_pct(int(n), S, width, height, f)
+                ok = np.all(np.abs((100.0-pct) - (100.0-levels)) <= tol*(100.0-levels))
+                if not ok:
+                    safe_from = None
+                elif safe_from is None:
+                    safe_from = int(n)
+                print('{:4.1f} {:7d} {:7.3f} {:6.3f} {:7.3f}  {:10.2f} {:10.2f} {:12.3f}  {:s}'.format(f, int(n), S[0], S[1], S[2], pct[0], pct[1], pct[2], 'ok' if ok else '--'), file=report)
+            if safe_from is None:
+                print('# fwhm {:3.1f}: analytic significance not within tolerance at the largest n'.format(f), file=report)
+            else:
+                print('# fwhm {:3.1f}: analytic significance within tolerance for n >= {:d}'.format(f, safe_from), file=report)
+            analytic_from[_analytic_key(width, height, f)] = np.inf if safe_from is None else safe_from
+    return out_file
+
+def fwhm_label(fwhm):
+    # smoothing scale(s) for file names: 2.0, or 2.0-3.0 for a multi-scale search
+    return '-'.join('{:3.1f}'.format(f) for f in np.atleast_1d(fwhm))
+
 def dm_sigplot(dms, sig_bins, sig_max, fwhm, title_string):    
         plt.clf()
         plt.figure(figsize=(9,4))
@@ -614,7 +852,7 @@ def dm_sigplot(dms, sig_bins, sig_max, fwhm, title_string):
         plt.ylim(2,6.5)
         # plt.clim(0,1.5)
         
-        plt.savefig('significance_{:s}_{:3.1f}.pdf'.format(title_string,fwhm))
+        plt.savefig('significance_{:s}_{:s}.pdf'.format(title_string,fwhm_label(fwhm)))
     
 # def association(ra, dec, a, b, phi):
 #     from scipy.stats import multivariate_normal
@@ -640,7 +878,247 @@ def dm_sigplot(dms, sig_bins, sig_max, fwhm, title_string):
 #     
 #     return pct
     
-def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=0.0):
+_scan = {}
+
+def _scan_init(state):
+    # pool initializer: each worker gets the read-only star arrays once, not once per task,
+    # and mixes only the null cache entries that existed when the scan started
+    _scan.clear()
+    _scan.update(state)
+    analytic_from.update(state.get('analytic_from', {}))
+    nullcache.freeze(state.get('nullcache'))
+
+def scan_step(dm):
+    # the part of a dm step that only depends on the star arrays: filter, smooth, and fit.
+    # the Monte Carlo for n stars is seeded from (seed, n, geometry) (see null_rng), and the null
+    # cache only mixes entries from before the scan (see nullcache.freeze), so results don't
+    # depend on how steps are farmed out
+    # (with significance 'analytic' there is no Monte Carlo from the n calibrated for it, see analytic_from; with 'sequential' it
+    # stops once the step is clearly above or below the thresholds, see sequential_peaks).
+    # with several smoothing scales (fwhm a list) every scale is fitted and the most significant
+    # one (highest pct, then highest peak S) is returned, with its fwhm
+    s = _scan
+    if s['f_intervals'] is not None:
+        stars_f = sweep_mask(s['f_intervals'], len(s['i_mag']), dm)
+    else:
+        cm_filter, gi_iso, i_m_iso = make_filter(dm, s['filter_file'])
+        stars_f = np.asarray(filter_sources(s['i_mag'], s['i_ierr'], s['gmi'], s['gmi_err'], cm_filter, filter_sig = 1, legacy_bars = s['legacy_bars']), dtype=bool)
+    
+    if s.get('incremental'):
+        # consecutive steps (in this process) only move a few stars in or out of the filter
+        if 'smooth' not in s:
+            s['smooth'] = smooth_init(s['i_ra'], s['i_dec'], s['fwhm'], s['width'], s['height'])
+        smoothed = grid_smooth_update(s['smooth'], stars_f)
+    else:
+        smoothed = grid_smooth(s['i_ra'][stars_f], s['i_dec'][stars_f], s['fwhm'], s['width'], s['height'])
+    if np.ndim(s['fwhm']) == 0:
+        xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl = smoothed
+        fit = distfit(int(stars_f.sum()),S[x_cent_S][y_cent_S],s['title_string'],s['width'],s['height'],s['fwhm'],dm,method=s['significance'],seed=s['seed'])
+        return dm, np.nonzero(stars_f)[0], smoothed, fit, s['fwhm']
+    
+    best = None
+    for fwhm, sm in zip(s['fwhm'], smoothed):
+        xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl = sm
+        fit = distfit(int(stars_f.sum()),S[x_cent_S][y_cent_S],s['title_string'],s['width'],s['height'],fwhm,dm,method=s['significance'],seed=s['seed'])
+        rank = (fit[0], S[x_cent_S][y_cent_S])
+        if best is None or rank > best[0]:
+            best = (rank, sm, fit, fwhm)
+    return dm, np.nonzero(stars_f)[0], best[1], best[2], best[3]
+
+def scan_dms(dms, state, jobs=1):
+    # run scan_step over the dm grid, in a process pool if jobs > 1; results come back in dm order
+    state = dict(state, nullcache=nullcache.snapshot())
+    try:
+        if jobs > 1 and len(dms) > 1:
+            from multiprocessing import Pool
+            pool = Pool(jobs, initializer=_scan_init, initargs=(state,))
+            try:
+                for result in pool.imap(scan_step, dms, chunksize=max(1, len(dms)//(4*jobs))):
+                    yield result
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _scan_init(state)
+            for dm in dms:
+                yield scan_step(dm)
+    finally:
+        nullcache.thaw()
+
+_report = {}
+
+def _report_init(state):
+    # pool initializer for render_reports, like _scan_init
+    _report.clear()
+    _report.update(state)
+
+def _circle(x0, y0, r):
+    # outline of a circle of radius r around (x0, y0), for plotting
+    t = np.deg2rad(np.arange(0,359,1))
+    return x0 + r*np.cos(t), y0 + r*np.sin(t)
+
+def write_regions(rec, state):
+    # region and list files for one candidate step
+    cat = state['cat']
+    fwhm_string, filter_string, title_string = state['fwhm_string'], state['filter_string'], state['title_string']
+    dm_string = '{:5.2f}'.format(rec['dm']).replace('.','_')
+    mark_file = 'f_list_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
+    filter_reg = 'f_reg_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
+    circ_file = 'c_list_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
+    ds9_file = 'circles_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
+    circles_file = 'region_coords.dat'
+    
+    index_f = rec['index_f']
+    stars_f = np.zeros(len(cat), dtype=bool)
+    stars_f[index_f] = True
+    stars_circ = select_within(state['sky_tree'], (rec['yedges'][rec['y_cent']], rec['xedges'][rec['x_cent']]), 3.0)
+    i_mag_f, g_mag_f, gmi_f, i_rad_f, i_decd_f, i_x_f, i_y_f, fwhm_sf = select(cat, index_f, 'i_mag', 'g_mag', 'gmi', 'i_rad', 'i_decd', 'ix', 'iy', 'fwhm_s')
+    i_mag_c, gmi_c, i_rad_c, i_decd_c, i_x_c, i_y_c, fwhm_sc = select(cat, stars_circ, 'i_mag', 'gmi', 'i_rad', 'i_decd', 'ix', 'iy', 'fwhm_s')
+    
+    with open(ds9_file,'w+') as ds9:
+        print("fk5;circle({:f},{:f},2') # color=yellow width=2 label=ref".format(state['ra_cr'], state['dec_cr']), file=ds9)
+        print("fk5;circle({:f},{:f},2') # color=magenta width=2 label=detection".format(rec['ra_c'], rec['dec_c']), file=ds9)
+        print("fk5;circle({:f},{:f},0.5') # color=black width=2 label=HI".format(state['hi_c'][0], state['hi_c'][1]), file=ds9)
+    
+    with open(filter_reg, 'w+') as f1:
+        for i in range(len(i_x_f)) :
+            print('image;circle({0:8.2f},{1:8.2f},10) # color=green width=2 edit=0 move=0 delete=0 highlite=0'.format(i_x_f[i],i_y_f[i]), file=f1)
+        
+    with open(mark_file, 'w+') as f1:
+        for i in range(len(i_x_f)) :
+            print('{0:8.2f} {1:8.2f} {2:12.8f} {3:12.8f} {4:8.2f} {5:8.2f} {6:8.2f} {7:7.3f}'.format(i_x_f[i],i_y_f[i],i_rad_f[i],i_decd_f[i],i_mag_f[i],g_mag_f[i],gmi_f[i],fwhm_sf[i]), file=f1)
+    
+    with open(circ_file, 'w+') as f2:
+        for i in range(len(i_x_c)) :
+            print('{0:8.2f} {1:8.2f} {2:12.8f} {3:12.8f} {4:8.2f} {5:8.2f} {6:8.2f} {7:7.3f}'.format(i_x_c[i],i_y_c[i],i_rad_c[i],i_decd_c[i],i_mag_c[i],i_mag_c[i]+gmi_c[i],gmi_c[i],fwhm_sc[i]), file=f2)
+    
+    with open(circles_file,'w+') as f4:
+        print(rec['circ_pix'][0], rec['circ_pix'][1], file=f4)
+
+def report_plot(rec):
+    # the four-panel figure for one candidate step (sky, cmd, smoothed map, detection/reference cmds)
+    state = _report
+    cat = state['cat']
+    i_ra, i_dec, i_mag, gmi = columns(cat, 'i_ra', 'i_dec', 'i_mag', 'gmi')
+    dm, mpc = rec['dm'], rec['mpc']
+    xedges, yedges, S = rec['xedges'], rec['yedges'], rec['S']
+    dm_string = '{:5.2f}'.format(dm).replace('.','_')
+    out_file = state['filter_string'] + '_' + state['fwhm_string'] + '_' + dm_string + '_' + state['title_string'] + '.pdf'
+    
+    index_f = rec['index_f']
+    stars_f = np.zeros(len(cat), dtype=bool)
+    stars_f[index_f] = True
+    center = (yedges[rec['y_cent']], xedges[rec['x_cent']])
+    stars_circ = select_within(state['sky_tree'], center, 3.0)
+    stars_circr = select_within(state['sky_tree'], state['rCent'], 3.0)
+    i_mag_f, gmi_f, i_ra_f, i_dec_f = select(cat, index_f, 'i_mag', 'gmi', 'i_ra', 'i_dec')
+    i_mag_c, gmi_c = select(cat, stars_circ, 'i_mag', 'gmi')
+    i_mag_cr, gmi_cr = select(cat, stars_circr, 'i_mag', 'gmi')
+    i_mag_fc, gmi_fc = select(cat, stars_circ[stars_f[stars_circ]], 'i_mag', 'gmi')
+    i_mag_fcr, gmi_fcr = select(cat, stars_circr[stars_f[stars_circr]], 'i_mag', 'gmi')
+    x_circ, y_circ = _circle(center[0], center[1], 3.0)
+    x_circr, y_circr = _circle(state['rCent'][0], state['rCent'][1], 3.0)
+    hi_x_circ, hi_y_circ = state['hi_x_circ'], state['hi_y_circ']
+    
+    # setup the pdf output
+    pp = PdfPages('f_'+ out_file)
+    plt.clf()
+    fig = plt.figure(figsize=(8,6))
+    # plot
+    # print "Plotting for m-M = ",dm
+    ax0 = plt.subplot(2,2,1)
+    plt.scatter(i_ra, i_dec,  color='black', marker='o', s=1, edgecolors='none')
+    plt.plot(x_circ,y_circ,linestyle='-', color='magenta')
+    plt.plot(x_circr,y_circr,linestyle='-', color='gold')
+    plt.plot(hi_x_circ,hi_y_circ,linestyle='-', color='limegreen')
+    plt.scatter(i_ra_f, i_dec_f,  c='red', marker='o', s=10, edgecolors='none')
+    plt.ylabel('Dec (arcmin)')
+    plt.xlim(0,max(i_ra))
+    plt.ylim(0,max(i_dec))
+    plt.title('sky positions')
+    ax0.set_aspect('equal')
+
+    ax1 = plt.subplot(2,2,2)
+    
+    for gmiCompl, iCompl, color in state['compl']:
+        plt.plot(gmiCompl,iCompl, linestyle='--', color=color)
+    
+    plt.plot(rec['gi_iso'],rec['i_m_iso'],linestyle='-', color='blue')
+    plt.scatter(gmi, i_mag,  color='black', marker='o', s=1, edgecolors='none')
+    plt.scatter(gmi_f, i_mag_f,  color='red', marker='o', s=15, edgecolors='none')
+    plt.errorbar(state['bxvals'], state['bcenters'], xerr=state['i_ierrAVG'], yerr=state['gmi_errAVG'], linestyle='None', color='black', capsize=0, ms=0)
+    plt.tick_params(axis='y',left='on',right='off',labelleft='on',labelright='off')
+    ax1.yaxis.set_label_position('left')
+    plt.ylabel('$i_0$')
+    plt.xlabel('$(g-i)_0$')
+    plt.ylim(25,15)
+    plt.xlim(-1,4)
+    plt.title('m-M = ' + '{:5.2f}'.format(dm) + ' (' + '{0:4.2f}'.format(mpc) +  ' Mpc)')
+    ax1.set_aspect(0.5)
+
+    ax2 = plt.subplot(2,2,3)
+
+    extent = [yedges[0], yedges[-1], xedges[-1], xedges[0]]
+    plt.imshow(S, extent=extent, interpolation='nearest',cmap=cm.gray)
+    cbar_S = plt.colorbar()
+    cbar_S.set_label('$\sigma$ from local mean')
+    plt.plot(x_circ,y_circ,linestyle='-', color='magenta')
+    plt.plot(x_circr,y_circr,linestyle='-', color='gold')
+    plt.plot(hi_x_circ,hi_y_circ,linestyle='-', color='limegreen')
+    plt.xlabel('RA (arcmin)')
+    plt.ylabel('Dec (arcmin)')
+    plt.title('smoothed stellar density')
+    plt.xlim(0,max(i_ra))
+    plt.ylim(0,max(i_dec))
+    ax2.set_aspect('equal')
+
+    ax3 = plt.subplot2grid((2,4), (1,2))
+    plt.scatter(gmi_c, i_mag_c,  color='black', marker='o', s=3, edgecolors='none')
+    plt.scatter(gmi_fc, i_mag_fc,  color='red', marker='o', s=15, edgecolors='none')    
+    plt.tick_params(axis='y',left='on',right='on',labelleft='off',labelright='off')
+    ax0.yaxis.set_label_position('left')
+    plt.title('detection')
+    plt.xlabel('$(g-i)_0$')
+    plt.ylabel('$i_0$')
+    plt.ylim(25,15)
+    plt.xlim(-1,4)
+
+    ax4 = plt.subplot2grid((2,4), (1,3), sharey=ax3)
+    plt.scatter(gmi_cr, i_mag_cr,  color='black', marker='o', s=3, edgecolors='none')
+    plt.scatter(gmi_fcr, i_mag_fcr,  color='red', marker='o', s=15, edgecolors='none')    
+    plt.tick_params(axis='y',left='on',right='on',labelleft='off',labelright='on')
+    plt.title('reference')
+    ax0.yaxis.set_label_position('left')
+    plt.xlabel('$(g-i)_0$')
+    plt.ylim(25,15)
+    plt.xlim(-1,4)
+    plt.tight_layout()
+
+    pp.savefig()
+    pp.close()
+    plt.close(fig)
+    return out_file
+
+def render_reports(records, state, jobs=1):
+    # write the region files for the candidate records (in order, in this process, so files
+    # shared between steps end up as the last record's), then draw their figures, in a
+    # process pool if jobs > 1
+    for rec in records:
+        write_regions(rec, state)
+    if jobs > 1 and len(records) > 1:
+        from multiprocessing import Pool
+        pool = Pool(min(jobs, len(records)), initializer=_report_init, initargs=(state,))
+        try:
+            pool.map(report_plot, records, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _report_init(state)
+        for rec in records:
+            report_plot(rec)
+
+def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=0.0, jobs=1, seed=0, incremental=True, top=None, significance='mc', legacy_bars=True):
     # print "Getting fits files..."
     # Load the FITS header using astropy.io.fits
     for file_ in os.listdir("./"):
@@ -669,36 +1147,21 @@ def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=
     # gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8),unpack=True)
     if daophot == True:
         mag_file = "AGC249525_phot.dat.20190220"
-    	idr,rar,decr,ixr,iyr,am_g,g_ir,g_ierrr,am_i,i_ir,i_ierrr,g_magr,i_magr,gmir,chi,sharp,ebv = np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16),unpack=True)
-        fwhm_sr = np.zeros(len(idr)) #create a bogus array to prevent breaking in later parts
+        cat = read_catalog(mag_file, daophot_cols, fwhm=0.0) #bogus fwhm column to prevent breaking in later parts
     else:
         mag_file = 'calibrated_mags.dat'
-	gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8),unpack=True)
-        fwhm_sr = np.ones_like(gxr)
-    gxr, gyr = ixr, iyr
-    # print len(gxr), "total stars"
-    # fwhm_sr = np.ones_like(gxr)
+        cat = read_catalog(mag_file, calibrated_cols)
+    # print len(cat), "total stars"
     # filter out the things with crappy color errors
     mag_error_cut = 0.2 #Limit on the error for the filter; Originally set at 0.2
-    color_error_cut = np.sqrt(2.0)*mag_error_cut
-    
-    
-    gmi_errr = [np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr))]
-    gx = [gxr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    gy = [gyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    g_mag = [g_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    g_ierr = [g_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    ix = [ixr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    iy = [iyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    i_mag = [i_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    i_ierr = np.array([i_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-    gmi = [gmir[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    fwhm_s = [fwhm_sr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    gmi_err = np.array([np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-    cutleft = [i for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
+    
+    good = error_cut(cat, mag_error_cut)
+    cutleft = np.flatnonzero(good)
     with open('cutleft.txt', 'w+') as spud:
         for i,item in enumerate(cutleft):
             print(item, file=spud)
+    cat = cat[good]
+    g_mag, g_ierr, ix, iy, i_mag, i_ierr, gmi, gmi_err, fwhm_s = columns(cat, 'g_mag', 'g_ierr', 'ix', 'iy', 'i_mag', 'i_ierr', 'gmi', 'gmi_err', 'fwhm_s')
     
     i_ierrAVG, bedges, binid = ss.binned_statistic(i_mag,i_ierr,statistic='median',bins=10,range=[15,25])
     gmi_errAVG, bedges, binid = ss.binned_statistic(i_mag,gmi_err,statistic='median',bins=10,range=[15,25])
@@ -710,7 +1173,6 @@ def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=
     # print gmi_errAVG
     # print len(gx), "after color+mag error cut"
     # nid = np.loadtxt(mag_file,usecols=(0,),dtype=int,unpack=True)
-    pixcrd = list(zip(ix,iy))
     
     
     # print "Reading WCS info from image header..."
@@ -737,8 +1199,7 @@ def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=
     # Convert pixel coordinates to world coordinates
     # The second argument is "origin" -- in this case we're declaring we
     # have 1-based (Fortran-like) coordinates.
-    world = w.all_pix2world(pixcrd, 1)
-    ra_corner, dec_corner = w.all_pix2world(0,0,1)
+    world, ra_corner, dec_corner = project(ix, iy, fits_i[0].header, mag_file)
     ra_c_d,dec_c_d = deg2HMS(ra=ra_corner, dec=dec_corner, round=True)
     # print 'Corner RA:',ra_c_d,':: Corner Dec:',dec_c_d
         
@@ -750,20 +1211,13 @@ def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=
     fits_i.close()
     # fits_g.close()
     
-    # split the ra and dec out into individual arrays and transform to arcmin from the corner
-    i_ra = [abs((world[i,0]-ra_corner)*60) for i in range(len(world[:,0]))]
-    i_dec = [abs((world[i,1]-dec_corner)*60) for i in range(len(world[:,1]))]
-    # also preserve the decimal degrees for reference
-    i_rad = [world[i,0] for i in range(len(world[:,0]))]
-    i_decd = [world[i,1] for i in range(len(world[:,1]))]
+    # transform to arcmin from the corner, and also preserve the decimal degrees for reference
+    add_sky(cat, world, ra_corner, dec_corner)
+    i_ra, i_dec, i_rad, i_decd = columns(cat, 'i_ra', 'i_dec', 'i_rad', 'i_decd')
+    sky_tree = sky_index(cat)
     
     
-    i_magBright = [i_mag[i] for i in range(len(i_mag)) if (i_mag[i] < 22.75)]
-    g_magBright = [g_mag[i] for i in range(len(i_mag)) if (i_mag[i] < 22.75)]
-    ixBright = [ix[i] for i in range(len(i_mag)) if (i_mag[i] < 22.75)]
-    iyBright = [iy[i] for i in range(len(i_mag)) if (i_mag[i] < 22.75)]
-    i_radBright = [i_rad[i] for i in range(len(i_mag)) if (i_mag[i] < 22.75)]
-    i_decdBright = [i_decd[i] for i in range(len(i_mag)) if (i_mag[i] < 22.75)]
+    i_magBright, g_magBright, ixBright, iyBright, i_radBright, i_decdBright = select(cat, i_mag < 22.75, 'i_mag', 'g_mag', 'ix', 'iy', 'i_rad', 'i_decd')
     
     if not os.path.isfile('brightStars2275.reg'):
         f1 = open('brightStars2275.reg', 'w+')
@@ -771,12 +1225,7 @@ def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=
             print('{0:12.4f} {1:12.4f} {2:10.5f} {3:9.5f} {4:8.2f} {5:8.2f} {6:8.2f}'.format(ixBright[i],iyBright[i], i_radBright[i], i_decdBright[i], g_magBright[i], i_magBright[i], g_magBright[i]-i_magBright[i]), file=f1)
         f1.close()
     
-    i_magRed = [i_mag[i] for i in range(len(i_mag)) if (gmi[i] > 1.75)]
-    g_magRed = [g_mag[i] for i in range(len(i_mag)) if (gmi[i] > 1.75)]
-    ixRed = [ix[i] for i in range(len(i_mag)) if (gmi[i] > 1.75)]
-    iyRed = [iy[i] for i in range(len(i_mag)) if (gmi[i] > 1.75)]
-    i_radRed = [i_rad[i] for i in range(len(i_mag)) if (gmi[i] > 1.75)]
-    i_decdRed = [i_decd[i] for i in range(len(i_mag)) if (gmi[i] > 1.75)]
+    i_magRed, g_magRed, ixRed, iyRed, i_radRed, i_decdRed = select(cat, gmi > 1.75, 'i_mag', 'g_mag', 'ix', 'iy', 'i_rad', 'i_decd')
     
     if not os.path.isfile('redStars175.reg'):
         f1 = open('redStars175.reg', 'w+')
@@ -784,9 +1233,24 @@ def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=
             print('{0:12.4f} {1:12.4f} {2:10.5f} {3:9.5f} {4:8.2f} {5:8.2f} {6:8.2f}'.format(ixRed[i],iyRed[i], i_radRed[i], i_decdRed[i], g_magRed[i], i_magRed[i], g_magRed[i]-i_magRed[i]), file=f1)
         f1.close()
     
+    if significance == 'calibrate':
+        # how far the analytic significance can be trusted for this field and smoothing scale,
+        # from a few stars up to the whole catalog
+        ns = np.unique(np.round(np.logspace(1, np.log10(max(len(cat), 20)), 12)).astype(int))
+        print('wrote', calibrate_significance(width, height, fwhm, ns, rng=np.random.RandomState(seed)))
+        return
+    if significance == 'analytic':
+        # the analytic significance only stands in for the Monte Carlo where a calibration run on
+        # this field (--significance=calibrate) found it good
+        calibration = 'significance_calibration_{:s}.txt'.format(fwhm_label(fwhm))
+        if os.path.isfile(calibration):
+            read_calibration(calibration)
+        else:
+            print('no', calibration, '(run with --significance=calibrate first): using the Monte Carlo at every n')
+    
     if dm2 > 0.0 and filter_string != 'none':
         dms = np.arange(dm,dm2,0.01)
-        search = open('search_{:3.1f}.txt'.format(fwhm),'w+')
+        search = open('search_{:s}.txt'.format(fwhm_label(fwhm)),'w+')
     else:
         dms = [dm]
         search = open('spud.txt'.format(fwhm),'w+')
@@ -795,356 +1259,129 @@ def magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=
     sig_cens = []
     sig_max = []
     
-    for dm in dms:
+    f_intervals = None
+    if len(dms) > 1:
+        # the filter only slides along i with dm, so find each star's dm ranges once for the whole scan
+        cm_filter0, gi_iso0, i_iso0 = make_filter(0.0, filter_file)
+        f_intervals = filter_intervals(gmi, i_mag, errorbar_lengths(gmi_err, legacy_bars=legacy_bars), errorbar_lengths(i_ierr, legacy_bars=legacy_bars), cm_filter0)
+    
+    # everything a dm step reads; workers get it once when the pool starts
+    scan_state = {'i_mag':i_mag, 'i_ierr':i_ierr, 'gmi':gmi, 'gmi_err':gmi_err,
+                  'i_ra':i_ra, 'i_dec':i_dec, 'filter_file':filter_file, 'f_intervals':f_intervals,
+                  'fwhm':fwhm, 'width':width, 'height':height, 'title_string':title_string, 'seed':seed, 'significance':significance, 'legacy_bars':legacy_bars,
+                  'incremental':incremental and len(dms) > 1, 'analytic_from':dict(analytic_from)}
+    
+    # things that are the same for every step: the HI ellipse, and a random reference
+    # circle to compare the detection cmd to
+    hi_x_circ, hi_y_circ = getHIellipse(title_string, ra_corner, dec_corner)
+    hi_c_ra, hi_c_dec = getHIellipse(title_string, ra_corner, dec_corner, centroid=True)        
+    if not os.path.isfile('refCircle.center'):
+        rCentx = 16.0*np.random.random()+2.0
+        rCenty = 16.0*np.random.random()+2.0
+        with open('refCircle.center','w+') as rc:
+            print('{:8.4f} {:8.4f}'.format(rCentx, rCenty), file=rc)
+    else :
+        rCentx, rCenty = np.loadtxt('refCircle.center', usecols=(0,1), unpack=True)
+    rcirc_c_x = ra_corner-(rCentx/60.)
+    rcirc_c_y = (rCenty/60.)+dec_corner
+    rcirc_pix_x, rcirc_pix_y = w.wcs_world2pix(rcirc_c_x,rcirc_c_y,1)
+    ra_cr, dec_cr = w.all_pix2world(rcirc_pix_x, rcirc_pix_y,1)
+    
+    # steps above the plotting threshold are kept as small records and reported after the scan
+    # (only the top ones if top is set, ranked by pct then peak S)
+    candidates = []
+    
+    for dm, index_f, smoothed, (pct, d_bins, d_cens), fwhm_k in scan_dms(dms, scan_state, jobs=jobs):
         mpc = pow(10,((dm + 5.)/5.))/1000000.
-        dm_string = '{:5.2f}'.format(dm).replace('.','_')
-        
-        out_file = filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.pdf'
-        mark_file = 'f_list_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
-        filter_reg = 'f_reg_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
-        circ_file = 'c_list_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
-        fcirc_file = 'fc_list_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
-        ds9_file = 'circles_' + filter_string + '_' + fwhm_string + '_' + dm_string + '_' + title_string + '.reg'
-        circles_file = 'region_coords.dat'
-        
-        cm_filter, gi_iso, i_m_iso = make_filter(dm, filter_file)
-        stars_f = filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, filter_sig = 1)
-        
-        xy_points = list(zip(i_ra,i_dec))
-        
-        # make new vectors containing only the filtered points
         
-        i_mag_f = [i_mag[i] for i in range(len(i_mag)) if (stars_f[i])]
-        g_mag_f = [g_mag[i] for i in range(len(i_mag)) if (stars_f[i])]
-        gmi_f = [gmi[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_ra_f = [i_ra[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_dec_f = [i_dec[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_rad_f = [i_rad[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_decd_f = [i_decd[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_x_f = [ix[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_y_f = [iy[i] for i in range(len(i_mag)) if (stars_f[i])]
-        #fwhm_sf = [fwhm_s[i] for i in range(len(i_mag)) if (stars_f[i])]
-        n_in_filter = len(i_mag_f)
+        if len(dms) > 1:
+            gi_iso, i_m_iso = gi_iso0, i_iso0 + dm
+        else:
+            cm_filter, gi_iso, i_m_iso = make_filter(dm, filter_file)
+        n_in_filter = len(index_f)
         
         # xedgesg, x_centg, yedgesg, y_centg, Sg, x_cent_Sg, y_cent_Sg, pltsigg, tblg = galaxyMap(fits_file_i, fwhm, dm, filter_file)
         
-        xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl = grid_smooth(i_ra_f, i_dec_f, fwhm, width, height)
+        xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl = smoothed
         # corr = signal.correlate2d(S, Sg, boundary='fill', mode='full')
         # print corr
         
-        pct, d_bins, d_cens = distfit(n_in_filter,S[x_cent_S][y_cent_S],title_string,width,height,fwhm,dm)
-        pct_hi = 0.0 #getHIcoincidence(x_cent_S, y_cent_S, title_string, ra_corner, dec_corner, width, height, dm)
-        
         sig_bins.append(d_bins)
         sig_cens.append(d_cens)
         sig_max.append(S[x_cent_S][y_cent_S])
         
         if pct > 100 :
-            pct, bj,cj = distfit(n_in_filter,S[x_cent_S][y_cent_S],title_string,width,height,fwhm,dm, samples=25000)
-        
-        # make a circle to highlight a certain region
-        cosd = lambda x : np.cos(np.deg2rad(x))
-        sind = lambda x : np.sin(np.deg2rad(x))
-        x_circ = [yedges[y_cent] + 3.0*cosd(t) for t in range(0,359,1)]
-        y_circ = [xedges[x_cent] + 3.0*sind(t) for t in range(0,359,1)]
-        
-        verts_circ = list(zip(x_circ,y_circ))
-        circ_filter = Path(verts_circ)
-        
-        stars_circ = circ_filter.contains_points(xy_points)    
-        
-        i_mag_c = [i_mag[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        gmi_c = [gmi[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        i_ra_c = [i_ra[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        i_dec_c = [i_dec[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        i_rad_c = [i_rad[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        i_decd_c = [i_decd[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        i_x_c = [ix[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        i_y_c = [iy[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        #fwhm_sc = [fwhm_s[i] for i in range(len(i_mag)) if (stars_circ[i])]
-        
-        # make a random reference cmd to compare to
-        if not os.path.isfile('refCircle.center'):
-            rCentx = 16.0*np.random.random()+2.0
-            rCenty = 16.0*np.random.random()+2.0
-            with open('refCircle.center','w+') as rc:
-                print('{:8.4f} {:8.4f}'.format(rCentx, rCenty), file=rc)
-        else :
-            rCentx, rCenty = np.loadtxt('refCircle.center', usecols=(0,1), unpack=True)
-                
-        x_circr = [rCentx + 3.0*cosd(t) for t in range(0,359,1)]
-        y_circr = [rCenty + 3.0*sind(t) for t in range(0,359,1)]
-        
-        verts_circr = list(zip(x_circr,y_circr))
-        rcirc_filter = Path(verts_circr)
-        
-        stars_circr = rcirc_filter.contains_points(xy_points)    
-        
-        i_mag_cr = [i_mag[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        gmi_cr = [gmi[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        i_ra_cr = [i_ra[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        i_dec_cr = [i_dec[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        i_rad_cr = [i_rad[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        i_decd_cr = [i_decd[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        i_x_cr = [ix[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        i_y_cr = [iy[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        fwhm_scr = [fwhm_s[i] for i in range(len(i_mag)) if (stars_circr[i])]
-        
-        i_mag_fc = [i_mag[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        i_ierr_fc = [i_ierr[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        g_ierr_fc = [g_ierr[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        g_mag_fc = [i_mag[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        gmi_fc = [gmi[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        i_ra_fc = [i_ra[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        i_dec_fc = [i_dec[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        i_rad_fc = [i_rad[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        i_decd_fc = [i_decd[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        i_x_fc = [ix[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        i_y_fc = [iy[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        fwhm_sfc = [fwhm_s[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        index_fc = [i for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-        with open('index_fc.txt', 'w+') as spud1:
-            for i,item in enumerate(index_fc):
-                print(item, file=spud1)
-        
-        # print len(i_mag_fc), 'filter stars in circle'
-        
-        # print 'max i mag in circle = ', min(i_mag_fc)
-        
-        rs = np.array([51, 77, 90, 180])
-        for r in rs:
-            x_circ = [yedges[y_cent] + r/60.*cosd(t) for t in range(0,359,1)]
-            y_circ = [xedges[x_cent] + r/60.*sind(t) for t in range(0,359,1)]
-
-            verts_circ = list(zip(x_circ,y_circ))
-            circ_filter = Path(verts_circ)
-
-            stars_circ = circ_filter.contains_points(xy_points)
-            i_x_fc = [ix[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-            i_y_fc = [iy[i] for i in range(len(i_mag)) if (stars_circ[i] and stars_f[i])]
-
-            fcirc_file = 'circle'+repr(r)+'.txt'
-            with open(fcirc_file,'w+') as f3:
-                for i,x in enumerate(i_x_fc):
-                    print(i_x_fc[i], i_y_fc[i], file=f3)
-        
-        i_mag_fcr = [i_mag[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        i_ierr_fcr = [i_ierr[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        g_ierr_fcr = [g_ierr[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        g_mag_fcr = [i_mag[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        gmi_fcr = [gmi[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        i_ra_fcr = [i_ra[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        i_dec_fcr = [i_dec[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        i_rad_fcr = [i_rad[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        i_decd_fcr = [i_decd[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        i_x_fcr = [ix[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        i_y_fcr = [iy[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        fwhm_sfcr = [fwhm_s[i] for i in range(len(i_mag)) if (stars_circr[i] and stars_f[i])]
-        # print len(i_mag_fcr), 'filter stars in ref. circle'
-        
-        # 
-        # print "{0:3d} stars in filter, {1:3d} stars in circle, {2:3d} stars in both.".format(len(i_mag_f),len(i_mag_c),len(i_mag_fc))
-        # for i in range(len(i_x_fc)) :
-        #     print (i_x_fc[i],i_y_fc[i])
-        
-        rcirc_c_x = ra_corner-(rCentx/60.)
-        rcirc_c_y = (rCenty/60.)+dec_corner
-        rcirc_pix_x, rcirc_pix_y = w.wcs_world2pix(rcirc_c_x,rcirc_c_y,1)
-        ra_cr, dec_cr = w.all_pix2world(rcirc_pix_x, rcirc_pix_y,1)
-        ra_cr_d,dec_cr_d = deg2HMS(ra=ra_cr, dec=dec_cr, round=False)
+            pct, bj,cj = distfit(n_in_filter,S[x_cent_S][y_cent_S],title_string,width,height,fwhm_k,dm, samples=25000)
         
+        # the peak through the HI map, the WCS, the sexagesimal formatting and the HI separation,
+        # and its row of the table, written as the step comes in so an interrupted scan keeps its rows
+        pct_hi = getHIcoincidence(x_cent_S, y_cent_S, title_string, ra_corner, dec_corner, height, width, dm, plot=False)
         circ_c_x = ra_corner-(yedges[y_cent]/60.)
         circ_c_y = (xedges[x_cent]/60.)+dec_corner
         circ_pix_x, circ_pix_y = w.wcs_world2pix(circ_c_x,circ_c_y,1)
         ra_c, dec_c = w.all_pix2world(circ_pix_x, circ_pix_y,1)
         ra_c_d,dec_c_d = deg2HMS(ra=ra_c, dec=dec_c, round=False)
         # print 'Peak RA:',ra_c_d,':: Peak Dec:',dec_c_d
+        sep, sep3d = dist2HIcentroid(ra_c, dec_c, hi_c_ra, hi_c_dec, mpc)
         
-        hi_x_circ, hi_y_circ = getHIellipse(title_string, ra_corner, dec_corner)
-        hi_c_ra, hi_c_dec = getHIellipse(title_string, ra_corner, dec_corner, centroid=True)        
-        hi_pix_x,hi_pix_y = w.wcs_world2pix(hi_c_ra,hi_c_dec,1)
-        
-        sep, sep3d = dist2HIcentroid(ra_c_d, dec_c_d, hi_c_ra, hi_c_dec, mpc)
-        # print hi_pix_x, hi_pix_y
-        # print ra_cr, dec_cr
-        # print ra_c, dec_c
-        # print hi_c_ra, hi_c_dec
+        if np.ndim(fwhm) == 0:
+            print("m-M = {:5.2f} | d = {:4.2f} Mpc | α = {:s}, δ = {:s}, Δʜɪ = {:5.1f}' | N = {:4d} | σ = {:6.3f} | ξ = {:6.3f}% | η = {:6.3f}%".format(dm, mpc, ra_c_d, dec_c_d, sep/60., n_in_filter, S[x_cent_S][y_cent_S], pct, pct_hi*100.))
+            print('{:5.2f} {:4.2f} {:s} {:s} {:5.1f} {:4d} {:6.3f} {:6.3f} {:6.3f}'.format(dm, mpc, ra_c_d, dec_c_d, sep/60., n_in_filter, S[x_cent_S][y_cent_S], pct, pct_hi*100.), file=search)        
+        else:
+            # multi-scale scans also say which smoothing scale won
+            print("m-M = {:5.2f} | d = {:4.2f} Mpc | α = {:s}, δ = {:s}, Δʜɪ = {:5.1f}' | N = {:4d} | σ = {:6.3f} | ξ = {:6.3f}% | η = {:6.3f}% | fwhm = {:3.1f}'".format(dm, mpc, ra_c_d, dec_c_d, sep/60., n_in_filter, S[x_cent_S][y_cent_S], pct, pct_hi*100., fwhm_k))
+            print('{:5.2f} {:4.2f} {:s} {:s} {:5.1f} {:4d} {:6.3f} {:6.3f} {:6.3f} {:3.1f}'.format(dm, mpc, ra_c_d, dec_c_d, sep/60., n_in_filter, S[x_cent_S][y_cent_S], pct, pct_hi*100., fwhm_k), file=search)        
+        search.flush()
         
-        print("m-M = {:5.2f} | d = {:4.2f} Mpc | α = {:s}, δ = {:s}, Δʜɪ = {:5.1f}' | N = {:4d} | σ = {:6.3f} | ξ = {:6.3f}% | η = {:6.3f}%".format(dm, mpc, ra_c_d, dec_c_d, sep/60., n_in_filter, S[x_cent_S][y_cent_S], pct, pct_hi*100.))
-        print('{:5.2f} {:4.2f} {:s} {:s} {:5.1f} {:4d} {:6.3f} {:6.3f} {:6.3f}'.format(dm, mpc, ra_c_d, dec_c_d, sep/60., n_in_filter, S[x_cent_S][y_cent_S], pct, pct_hi*100.), file=search)        
-
         #iraf.imutil.hedit(images=fits_g, fields='PV*', delete='yes', verify='no')
         #iraf.imutil.hedit(images=fits_i, fields='PV*', delete='yes', verify='no') 
         if pct > 90.:
-            with open(ds9_file,'w+') as ds9:
-                print("fk5;circle({:f},{:f},2') # color=yellow width=2 label=ref".format(ra_cr, dec_cr), file=ds9)
-                print("fk5;circle({:f},{:f},2') # color=magenta width=2 label=detection".format(ra_c, dec_c), file=ds9)
-                print("fk5;circle({:f},{:f},0.5') # color=black width=2 label=HI".format(hi_c_ra, hi_c_dec), file=ds9)
-            
-            f1 = open(filter_reg, 'w+')
-            for i in range(len(i_x_f)) :
-                print('image;circle({0:8.2f},{1:8.2f},10) # color=green width=2 edit=0 move=0 delete=0 highlite=0'.format(i_x_f[i],i_y_f[i]), file=f1)
-            f1.close()
-                
-            f1 = open(mark_file, 'w+')
-            for i in range(len(i_x_f)) :
-                print('{0:8.2f} {1:8.2f} {2:12.8f} {3:12.8f} {4:8.2f} {5:8.2f} {6:8.2f} {7:7.3f}'.format(i_x_f[i],i_y_f[i],i_rad_f[i],i_decd_f[i],i_mag_f[i],g_mag_f[i],gmi_f[i],fwhm_sf[i]), file=f1)
-            f1.close()
-            
-            f2 = open(circ_file, 'w+')
-            for i in range(len(i_x_c)) :
-                print('{0:8.2f} {1:8.2f} {2:12.8f} {3:12.8f} {4:8.2f} {5:8.2f} {6:8.2f} {7:7.3f}'.format(i_x_c[i],i_y_c[i],i_rad_c[i],i_decd_c[i],i_mag_c[i],i_mag_c[i]+gmi_c[i],gmi_c[i],fwhm_sc[i]), file=f2)
-            f2.close()
-            
-            with open(fcirc_file,'w+') as f3:
-                for i,x in enumerate(i_x_fc):
-                    print(i_x_fc[i], i_y_fc[i], fwhm_sfc[i], file=f3)
-                    
-            with open(circles_file,'w+') as f4:
-                print(circ_pix_x, circ_pix_y, file=f4)
-            
-            # center_file = 'im_cens_'+dm_string+'_'+fwhm_string+'.dat'
-            # im_cens = open(center_file,'w+')
-            # for k,xp in enumerate(tbl):
-            #     circ_c_x = (yedges[tbl['maxval_xpos'][k]]/60.)+ra_corner
-            #     circ_c_y = (xedges[tbl['maxval_ypos'][k]]/60.)+dec_corner
-            #     circ_pix_x, circ_pix_y = w.wcs_world2pix(circ_c_x,circ_c_y,1)
-            #     # ra_c, dec_c = w.all_pix2world(circ_pix_x, circ_pix_y,1)
-            #     # print circ_c_x, circ_c_y
-            #     print >> im_cens, -circ_pix_x, circ_pix_y, 'circle_center'+repr(k)
-            # print >> im_cens, hi_pix_x, hi_pix_y, 'HI_centroid'
-            # im_cens.close()
-            
-            mark_radius = int(pltsig*60/0.11)
-            ann_inn = int(np.ceil(pltsig*60/0.11/100.0))*100
-            ann_out = int(np.ceil(pltsig*60/0.11/100.0))*100+100
-            mark_radii = str(repr(mark_radius-2)+','+repr(mark_radius-1)+','+repr(mark_radius)+','+repr(mark_radius+1)+','+repr(mark_radius+2))
-            anni_radii = str(repr(ann_inn-2)+','+repr(ann_inn-1)+','+repr(ann_inn)+','+repr(ann_inn+1)+','+repr(ann_inn+2))
-            anno_radii = str(repr(ann_out-2)+','+repr(ann_out-1)+','+repr(ann_out)+','+repr(ann_out+1)+','+repr(ann_out+2))
-            # print mark_radius, ann_inn, ann_out
-            
-            # if disp_flag :
-            #     from pyraf import iraf
-            #     iraf.tv(_doprint=0)
-            #     iraf.unlearn(iraf.tv.tvmark)
-            #     iraf.tv.tvmark.setParam('label',"no")
-            #     iraf.tv.tvmark.setParam('pointsize',7)
-            #     iraf.tv.tvmark.setParam('mark',"circle")
-            #     # iraf.tv.display(image=fits_file_g, frame=1)
-            #     iraf.tv.display(image=fits_file_i, frame=1)
-            #     iraf.tv.tvmark(frame=1, coords=mark_file, radii="14,15,16", color=207)
-            #     iraf.tv.tvmark(frame=1, coords=circ_file, radii="20,21,22", color=209)
-            #     iraf.tv.tvmark(frame=1, coords='brightStars22.reg', radii="26,27,28", color=205)
-            #     iraf.tv.tvmark(frame=1, coords='redStars175.reg', radii="32,33,34", color=204)
-            #     iraf.tv.tvmark(frame=1, coords=center_file, txsize=4, mark="plus", color=208, label="yes")
-            #     iraf.tv.tvmark(frame=1, coords=center_file, radii=mark_radii, color=208)
-            #     iraf.tv.tvmark(frame=1, coords=center_file, radii=anni_radii, color=208)
-            #     iraf.tv.tvmark(frame=1, coords=center_file, radii=anno_radii, color=208)
-            #     # iraf.tv.tvmark(frame=2, coords=mark_file, radii="14,15,16", color=207, label="yes")
-            #     # iraf.tv.tvmark(frame=2, coords=circ_file, radii="20,21,22", color=209)
-            #     # iraf.tv.tvmark(frame=2, coords=center_file, txsize=4, mark="plus", color=208, label="yes")
-            #     # iraf.tv.tvmark(frame=2, coords=center_file, radii=mark_radii, color=208)
-        
-            # setup the pdf output
-            pp = PdfPages('f_'+ out_file)
-            plt.clf()
-            plt.figure(figsize=(8,6))
-            # plot
-            # print "Plotting for m-M = ",dm
-            ax0 = plt.subplot(2,2,1)
-            plt.scatter(i_ra, i_dec,  color='black', marker='o', s=1, edgecolors='none')
-            plt.plot(x_circ,y_circ,linestyle='-', color='magenta')
-            plt.plot(x_circr,y_circr,linestyle='-', color='gold')
-            plt.plot(hi_x_circ,hi_y_circ,linestyle='-', color='limegreen')
-            # plt.scatter(i_ra_c, i_dec_c,  color='red', marker='o', s=3, edgecolors='none')
-            plt.scatter(i_ra_f, i_dec_f,  c='red', marker='o', s=10, edgecolors='none')
-            # plt.clim(0,2)
-            # plt.colorbar()
-            plt.ylabel('Dec (arcmin)')
-            plt.xlim(0,max(i_ra))
-            plt.ylim(0,max(i_dec))
-            plt.title('sky positions')
-            ax0.set_aspect('equal')
-        
-            ax1 = plt.subplot(2,2,2)
-            
-            if os.path.isfile('i_gmi_compl.gr.out'):
-                gmiCompl, iCompl = np.loadtxt('i_gmi_compl.gr.out',usecols=(0,1),unpack=True)
-                plt.plot(gmiCompl,iCompl, linestyle='--', color='green')
-            if os.path.isfile('i_gmi_compl.gr2.out'):
-                gmiCompl, iCompl = np.loadtxt('i_gmi_compl.gr2.out',usecols=(0,1),unpack=True)
-                plt.plot(gmiCompl,iCompl, linestyle='--', color='red')
-            if os.path.isfile('i_gmi_compl2.out'):
-                iCompl,gmiCompl = np.loadtxt('i_gmi_compl2.out',usecols=(0,1),unpack=True)
-                plt.plot(gmiCompl,iCompl, linestyle='--', color='blue')
-            
-            plt.plot(gi_iso,i_m_iso,linestyle='-', color='blue')
-            plt.scatter(gmi, i_mag,  color='black', marker='o', s=1, edgecolors='none')
-            plt.scatter(gmi_f, i_mag_f,  color='red', marker='o', s=15, edgecolors='none')
-
-            # plt.scatter(gmi_c, i_mag_c,  color='red', marker='o', s=3, edgecolors='none')
-            plt.errorbar(bxvals, bcenters, xerr=i_ierrAVG, yerr=gmi_errAVG, linestyle='None', color='black', capsize=0, ms=0)
-            plt.tick_params(axis='y',left='on',right='off',labelleft='on',labelright='off')
-            ax1.yaxis.set_label_position('left')
-            plt.ylabel('$i_0$')
-            plt.xlabel('$(g-i)_0$')
-            plt.ylim(25,15)
-            plt.xlim(-1,4)
-            plt.title('m-M = ' + '{:5.2f}'.format(dm) + ' (' + '{0:4.2f}'.format(mpc) +  ' Mpc)')
-            ax1.set_aspect(0.5)
-        
-            ax2 = plt.subplot(2,2,3)
-        
-            extent = [yedges[0], yedges[-1], xedges[-1], xedges[0]]
-            plt.imshow(S, extent=extent, interpolation='nearest',cmap=cm.gray)
-            # plt.imshow(segm, extent=extent, cmap=rand_cmap, alpha=0.5)
-            cbar_S = plt.colorbar()
-            cbar_S.set_label('$\sigma$ from local mean')
-            # cbar_S.tick_params(labelsize=10)
-            plt.plot(x_circ,y_circ,linestyle='-', color='magenta')
-            plt.plot(x_circr,y_circr,linestyle='-', color='gold')
-            plt.plot(hi_x_circ,hi_y_circ,linestyle='-', color='limegreen')
-            # X, Y = np.meshgrid(xedges,yedges)
-            # ax3.pcolormesh(X,Y,grid_gaus)
-            plt.xlabel('RA (arcmin)')
-            plt.ylabel('Dec (arcmin)')
-            plt.title('smoothed stellar density')
-            # plt.ylabel('Dec (arcmin)')
-            plt.xlim(0,max(i_ra))
-            plt.ylim(0,max(i_dec))
-            ax2.set_aspect('equal')
-        
-            # ax3 = plt.subplot(2,2,4)
-            ax3 = plt.subplot2grid((2,4), (1,2))
-            plt.scatter(gmi_c, i_mag_c,  color='black', marker='o', s=3, edgecolors='none')
-            plt.scatter(gmi_fc, i_mag_fc,  color='red', marker='o', s=15, edgecolors='none')    
-            plt.tick_params(axis='y',left='on',right='on',labelleft='off',labelright='off')
-            ax0.yaxis.set_label_position('left')
-            plt.title('detection')
-            plt.xlabel('$(g-i)_0$')
-            plt.ylabel('$i_0$')
-            plt.ylim(25,15)
-            plt.xlim(-1,4)
-            # ax3.set_aspect(0.5)    
-        
-            ax4 = plt.subplot2grid((2,4), (1,3), sharey=ax3)
-            plt.scatter(gmi_cr, i_mag_cr,  color='black', marker='o', s=3, edgecolors='none')
-            plt.scatter(gmi_fcr, i_mag_fcr,  color='red', marker='o', s=15, edgecolors='none')    
-            plt.tick_params(axis='y',left='on',right='on',labelleft='off',labelright='on')
-            plt.title('reference')
-            ax0.yaxis.set_label_position('left')
-            plt.xlabel('$(g-i)_0$')
-            plt.ylim(25,15)
-            plt.xlim(-1,4)
-            # ax3.set _aspect(0.5)
-            plt.tight_layout()
-            # plt.suptitle(title_string+ ' -- ' + fwhm_string + ' arcmin smoothing')
-            plt.show
-        
-            pp.savefig()
-            pp.close()
-        # else :
-            # print 'detection at dm='+repr(dm)+' not significant enough to look at plots'
+            rec = {'dm':dm, 'mpc':mpc, 'pct':pct, 'index_f':index_f, 'S':S, 'xedges':xedges, 'yedges':yedges,
+                   'x_cent':x_cent, 'y_cent':y_cent, 'pltsig':pltsig, 'gi_iso':gi_iso, 'i_m_iso':i_m_iso,
+                   'ra_c':float(ra_c), 'dec_c':float(dec_c), 'circ_pix':(float(circ_pix_x), float(circ_pix_y))}
+            candidates.append(((pct, S[x_cent_S][y_cent_S], dm), rec))
+            if top is not None and len(candidates) > top:
+                candidates.remove(min(candidates, key=lambda c: c[0]))
+    
+    # stars of the last step in circles around its peak (overwritten every step before, so
+    # only the last step's ever survived)
+    stars_f = np.zeros(len(i_mag), dtype=bool)
+    stars_f[index_f] = True
+    stars_circ = select_within(sky_tree, (yedges[y_cent], xedges[x_cent]), 3.0)
+    index_fc = stars_circ[stars_f[stars_circ]]
+    with open('index_fc.txt', 'w+') as spud1:
+        for i,item in enumerate(index_fc):
+            print(item, file=spud1)
+    
+    rs = np.array([51, 77, 90, 180])
+    for r in rs:
+        stars_circ = select_within(sky_tree, (yedges[y_cent], xedges[x_cent]), r/60.)
+        i_x_fc, i_y_fc = select(cat, stars_circ[stars_f[stars_circ]], 'ix', 'iy')
+
+        fcirc_file = 'circle'+repr(r)+'.txt'
+        with open(fcirc_file,'w+') as f3:
+            for i,x in enumerate(i_x_fc):
+                print(i_x_fc[i], i_y_fc[i], file=f3)
+    if pct > 90.:
+        # and the last step's report rewrote the 3' one (circle180.txt, that maglimit2 photometers)
+        # with the stars' fwhm as well
+        fwhm_sfc, = select(cat, stars_circ[stars_f[stars_circ]], 'fwhm_s')
+        with open(fcirc_file,'w+') as f3:
+            for i,x in enumerate(i_x_fc):
+                print(i_x_fc[i], i_y_fc[i], fwhm_sfc[i], file=f3)
+    
+    # report stage: region files and figures for the candidates, in dm order
+    compl = []
+    for compl_file, cols, color in [('i_gmi_compl.gr.out', (0,1), 'green'), ('i_gmi_compl.gr2.out', (0,1), 'red'), ('i_gmi_compl2.out', (1,0), 'blue')]:
+        if os.path.isfile(compl_file):
+            gmiCompl, iCompl = np.loadtxt(compl_file,usecols=cols,unpack=True)
+            compl.append((gmiCompl, iCompl, color))
+    report_state = {'cat':cat, 'sky_tree':sky_tree, 'filter_string':filter_string, 'fwhm_string':fwhm_string, 'title_string':title_string,
+                    'bxvals':bxvals, 'bcenters':bcenters, 'i_ierrAVG':i_ierrAVG, 'gmi_errAVG':gmi_errAVG, 'compl':compl,
+                    'hi_x_circ':hi_x_circ, 'hi_y_circ':hi_y_circ, 'hi_c':(hi_c_ra, hi_c_dec),
+                    'rCent':(rCentx, rCenty), 'ra_cr':float(ra_cr), 'dec_cr':float(dec_cr)}
+    records = [rec for key, rec in sorted(candidates, key=lambda c: c[1]['dm'])]
+    render_reports(records, report_state, jobs=jobs)
     search.close()   
     
     # make the overall significance plot
@@ -1171,24 +1408,42 @@ def main(argv):
     filter_file = os.path.dirname(os.path.abspath(__file__))+'/filter.txt'
     filter_string = 'old'
     dm2 = 0.0
+    jobs = 1
+    seed = 0
+    top = None
+    significance = 'mc'
+    legacy_bars = True
 
     try:
-        opts, args = getopt.getopt(argv,"h",["fwhm=","dm=","dm2="])
+        opts, args = getopt.getopt(argv,"h",["fwhm=","dm=","dm2=","jobs=","seed=","top=","significance=","bars="])
     except getopt.GetoptError:
-        print('magfilter.py --fwhm=<fwhm in arcmin> --dm=<DM in mag> --dm=<DM in mag>')
+        print('magfilter.py --fwhm=<fwhm in arcmin, or a comma-separated list> --dm=<DM in mag> --dm2=<DM in mag> --jobs=<processes> --seed=<MC seed> --top=<figures to make> --significance=<mc, sequential, analytic or calibrate> --bars=<legacy or sigma>')
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
-            print('magfilter.py --fwhm=<fwhm in arcmin> --dm=<DM in mag> --dm=<DM in mag>')
+            print('magfilter.py --fwhm=<fwhm in arcmin, or a comma-separated list> --dm=<DM in mag> --dm2=<DM in mag> --jobs=<processes> --seed=<MC seed> --top=<figures to make> --significance=<mc, sequential, analytic or calibrate> --bars=<legacy or sigma>')
             sys.exit()
         elif opt in ("--fwhm"):
-            fwhm = float(arg)        # in arcmin (7.5 pixels = 1 arcmin)
-            fwhm_string = arg        # this is the smoothing scale, not a stellar profile
+            fwhm = float(arg) if ',' not in arg else [float(f) for f in arg.split(',')]        # in arcmin (7.5 pixels = 1 arcmin)
+            fwhm_string = arg.replace(',','-')        # this is the smoothing scale, not a stellar profile; a list of scales is searched together
         elif opt in ("--dm"):
             dm = float(arg)        # in mag
             dm_string = arg
         elif opt in ("--dm2"):
             dm2 = float(arg)
+        elif opt in ("--jobs"):
+            jobs = int(arg)        # dm steps run in this many processes
+        elif opt in ("--seed"):
+            seed = int(arg)        # base seed for the Monte Carlo null draws (see null_rng)
+        elif opt in ("--top"):
+            top = int(arg)        # only report the most significant steps
+        elif opt in ("--significance"):
+            significance = arg        # mc (simulate), sequential (simulate until decided), analytic (no simulation), or calibrate (compare and stop)
+            if significance not in significance_methods + ('calibrate',):
+                print('magfilter.py --fwhm=<fwhm in arcmin, or a comma-separated list> --dm=<DM in mag> --dm2=<DM in mag> --jobs=<processes> --seed=<MC seed> --top=<figures to make> --significance=<mc, sequential, analytic or calibrate> --bars=<legacy or sigma>')
+                sys.exit(2)
+        elif opt in ("--bars"):
+            legacy_bars = (arg != 'sigma')        # legacy (the old sampled bars, ~10*err**2 long) or sigma (true 1-sigma bars)
         elif opt in ("--imexam"):
             imexam_flag = True
         elif opt in ("--disp"):
@@ -1210,7 +1465,7 @@ def main(argv):
                 filter_string = 'iso'
 
     fwhm_string = fwhm_string.replace('.','_')
-    magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=dm2)
+    magfilter(fwhm, fwhm_string, dm, dm_string, filter_file, filter_string, dm2=dm2, jobs=jobs, seed=seed, top=top, significance=significance, legacy_bars=legacy_bars)
 
 if __name__ == "__main__":
     main(sys.argv[1:])    
@@ -2,8 +2,10 @@
 import os, sys
 import numpy as np
 from pyraf import iraf
-from odi_calibrate import download_sdss, js_calibrate
+from odi_calibrate import download_sdss, js_calibrate, apply_calibration
 from sdss_fit import getVabs
+import hicatalog
+import aphot
 from collections import OrderedDict
 
 iraf.images(_doprint=0)
@@ -17,15 +19,13 @@ iraf.imutil(_doprint=0)
 
 def getHImass(object, dm):
     # print object, mpc
-    uchvcdb = os.path.dirname(os.path.abspath(__file__))+'/predblist.sort.csv'
-    name, mass = np.loadtxt(uchvcdb, usecols=(1,6), dtype=str, delimiter=',', unpack=True)
-    # find the right row
-    coord = [i for i,this in enumerate(mass) if object.upper() in name[i]][0]
-    # print 'the HI mass of', name[coord], 'is', mass[coord], 'at 1 Mpc'
+    # find the right row (the catalog is only read once)
+    hi = hicatalog.lookup(object)
+    # print 'the HI mass of', hi['altname'], 'is', hi['m_hi'], 'at 1 Mpc'
     
     # mpc = mpc/1000.
     mpc = pow(10,((dm + 5.)/5.))/1000000.
-    logm = float(mass[coord])
+    logm = hi['m_hi']
     mass = mpc*mpc*10**logm  # make sure to scale by the distance in Mpc^2
     
     print '{:3.1f}'.format(np.log10(mass))
@@ -150,46 +150,17 @@ def main():
     # iraf.tv.tvmark.setParam('mark',"circle")
     # iraf.tv.tvmark(frame=1, coords=coords_file, radii="1633,1634,1635,1636,1637,1638,1639,1697,1698,1699,1700,1701,1702,1703,1797,1798,1799,1800,1801,1802,1803", color=208)
     # 
-    iraf.unlearn(iraf.apphot.phot, iraf.datapars, iraf.photpars, iraf.centerpars, iraf.fitskypars)
-    iraf.apphot.phot.setParam('interactive',"no")
-    iraf.apphot.phot.setParam('verify',"no")
-    iraf.datapars.setParam('datamin',0.)
-    iraf.datapars.setParam('datamax',50000.)
-    iraf.datapars.setParam('gain',"gain")
-    iraf.datapars.setParam('ccdread',"rdnoise")
-    iraf.datapars.setParam('exposure',"exptime")
-    iraf.datapars.setParam('airmass',"airmass")
-    iraf.datapars.setParam('filter',"filter")
-    iraf.datapars.setParam('obstime',"time-obs")
-    iraf.datapars.setParam('sigma',"INDEF")
-    iraf.photpars.setParam('zmag',0.)
-    iraf.centerpars.setParam('calgorithm',"none")
-    iraf.centerpars.setParam('cbox',9.)
-    iraf.centerpars.setParam('maxshift',3.)
-    iraf.fitskypars.setParam('salgorithm',"median")
-    iraf.fitskypars.setParam('dannulus',100.)
-    iraf.datapars.setParam('fwhmpsf',6.197) 
-    iraf.photpars.setParam('apertures','409,500,591,682,773,818') 
-    iraf.fitskypars.setParam('annulus',450.)
-    #
-    iraf.apphot.phot(image=title_string+"_i_masked.fits", coords=coords_file, output="mag_est_i.dat")
-
-    txdump_out = open('phot_region_i.txdump','w+')
-    iraf.ptools.txdump(textfiles='mag_est_i.dat', fields="id,sum,msky,stdev,nsky", expr='yes', headers='no', Stdout=txdump_out)
-    txdump_out.close()
-
-    iraf.datapars.setParam('fwhmpsf',6.197)
+    # the region sums with aphot, at the input positions (no centering), median sky in a
+    # 100 pixel annulus from 450 pixels, good data between 0 and 50000
+    region_aps = [409., 500., 591., 682., 773., 818.]
+    ph = aphot.phot(title_string+"_i_masked.fits", coords_file, region_aps, 450., dannulus=100., centroid=False, datamin=0., datamax=50000.)
+    aphot.write_txdump('phot_region_i.txdump', ph, ['id','sum','msky','stdev','nsky'])
 
-    iraf.apphot.phot(image=title_string+"_g_masked.fits", coords=coords_file, output="mag_est_g.dat")
+    ph = aphot.phot(title_string+"_g_masked.fits", coords_file, region_aps, 450., dannulus=100., centroid=False, datamin=0., datamax=50000.)
+    aphot.write_txdump('phot_region_g.txdump', ph, ['id','sum','msky','stdev','nsky'])
 
-    txdump_out = open('phot_region_g.txdump','w+')
-    iraf.ptools.txdump(textfiles='mag_est_g.dat', fields="id,sum,msky,stdev,nsky", expr='yes', headers='no', Stdout=txdump_out)
-    txdump_out.close()
-
-    iraf.apphot.phot(image="ones_mask.fits", coords=coords_file, output="mag_area.dat")
-    txdump_out = open('area.txdump','w+')
-    iraf.ptools.txdump(textfiles='mag_area.dat', fields="id,sum", expr='yes', headers='no', Stdout=txdump_out)
-    txdump_out.close()
+    ph = aphot.phot("ones_mask.fits", coords_file, region_aps, 450., dannulus=100., centroid=False, datamin=0., datamax=50000.)
+    aphot.write_txdump('area.txdump', ph, ['id','sum'])
 
     # calculate the magnitude cf. apphot.phot, but *manually* subtract the area determined by the ones mask
     areas = np.loadtxt('area.txdump', usecols=(1,2,3,4,5,6), unpack=True)
@@ -216,25 +187,11 @@ def main():
     for r in rs:
         fcirc_file = 'circle'+repr(r)+'.txt'
 
-        iraf.fitskypars.setParam('dannulus',10.)
-        iraf.datapars.setParam('fwhmpsf',6.197) 
-        iraf.photpars.setParam('apertures',7.) 
-        iraf.fitskypars.setParam('annulus',10.)
-        #
-        iraf.apphot.phot(image=title_string+"_g.fits", coords=fcirc_file, output="mag_min_g_{:2d}.dat".format(r))
-        txdump_out = open('phot_indiv_g.txdump','w+')
-        iraf.ptools.txdump(textfiles="mag_min_g_{:2d}.dat".format(r), fields="id,mag,merr,flux,area,stdev,nsky", expr='yes', headers='no', Stdout=txdump_out)
-        txdump_out.close()
-
-        iraf.fitskypars.setParam('dannulus',10.)
-        iraf.datapars.setParam('fwhmpsf',6.197) 
-        iraf.photpars.setParam('apertures',7.) 
-        iraf.fitskypars.setParam('annulus',10.)
-        #
-        iraf.apphot.phot(image=title_string+"_i.fits", coords=fcirc_file, output="mag_min_i_{:2d}.dat".format(r))
-        txdump_out = open('phot_indiv_i.txdump','w+')
-        iraf.ptools.txdump(textfiles="mag_min_i_{:2d}.dat".format(r), fields="id,mag,merr,flux,area,stdev,nsky", expr='yes', headers='no', Stdout=txdump_out)
-        txdump_out.close()
+        ph = aphot.phot(title_string+"_g.fits", fcirc_file, 7., 10., dannulus=10., centroid=False, datamin=0., datamax=50000.)
+        aphot.write_txdump('phot_indiv_g.txdump', ph, ['id','mag','merr','flux','area','stdev','nsky'])
+
+        ph = aphot.phot(title_string+"_i.fits", fcirc_file, 7., 10., dannulus=10., centroid=False, datamin=0., datamax=50000.)
+        aphot.write_txdump('phot_indiv_i.txdump', ph, ['id','mag','merr','flux','area','stdev','nsky'])
 
         fluxes_i, areas_i, stdevs_i, nskys_i = np.loadtxt('phot_indiv_i.txdump',usecols=(3,4,5,6),unpack=True)
         fluxes_g, areas_g, stdevs_g, nskys_g = np.loadtxt('phot_indiv_g.txdump',usecols=(3,4,5,6),unpack=True)
@@ -308,10 +265,9 @@ def main():
 
     print 'Reddening correction :: g = {0:7.4f} : i = {1:7.4f}'.format(cal_A_g,cal_A_i)
 
-    tolerance = 0.0001
-
     g_0 = mags_g - kg*amg
     i_0 = mags_i - ki*ami
+    g_cals, i_cals = apply_calibration(g_0, i_0, eps_g, zp_g, eps_i, zp_i)
 
     i_sun = 4.58
     m_hi = getHImass(title_string, dm)
@@ -356,19 +312,8 @@ def main():
         print '# ap     g   ge     i   ie  g-i Eg-i    Mg    Mi    MV  M/L L*      MHI   M*  Hi/*'
         print >> opt, '# ap     g   ge     i   ie  g-i Eg-i    Mg    Mi    MV  M/L L*      MHI   M*  Hi/*'
         for i,r in enumerate(rs):
-            color_guess = 0.0
-            color_diff = 1.0
-            while abs(color_diff) > tolerance:
-                g_cal = g_0[i] + eps_g*color_guess + zp_g
-                i_cal = i_0[i] + eps_i*color_guess + zp_i
-    
-                color_new = g_cal - i_cal
-                color_diff = color_guess-color_new
-                color_guess = color_new
-                # print g_0[i], g_cal, i_0[i], i_cal, color_new
-    
-            g_mag = g_cal - cal_A_g
-            i_mag = i_cal - cal_A_i
+            g_mag = g_cals[i] - cal_A_g
+            i_mag = i_cals[i] - cal_A_i
             gmi = g_mag - i_mag
             e_gmi = np.sqrt(me_g[i]**2 + me_i[i]**2)
             g_abs = g_mag-dm
@@ -10,6 +10,7 @@ import matplotlib.cm as cm
 from matplotlib.path import Path
 import scipy.stats as ss
 from collections import OrderedDict
+from catalog import read_catalog, error_cut, project, add_sky, columns, select, calibrated_cols
 from magfilter import deg2HMS, grid_smooth, getHIellipse, dist2HIcentroid, make_filter, make_youngpop, filter_sources
 
 def main():
@@ -39,25 +40,12 @@ def main():
         
         # read in magnitudes, colors, and positions(x,y)
         # gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir,fwhm_sr= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8,11),unpack=True)
-        gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8),unpack=True)
-        # print len(gxr), "total stars"
-        fwhm_sr = np.ones_like(gxr)
+        cat = read_catalog(mag_file, calibrated_cols)
+        # print len(cat), "total stars"
         # filter out the things with crappy color errors
-        color_error_cut = np.sqrt(2.0)*0.2
         mag_error_cut = 0.2
-        
-        gmi_errr = [np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr))]
-        gx = [gxr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        gy = [gyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        g_mag = [g_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        g_ierr = [g_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        ix = [ixr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        iy = [iyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        i_mag = [i_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        i_ierr = np.array([i_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
-        gmi = [gmir[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        fwhm_s = [fwhm_sr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-        gmi_err = np.array([np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))])
+        cat = cat[error_cut(cat, mag_error_cut)]
+        g_mag, g_ierr, ix, iy, i_mag, i_ierr, gmi, gmi_err, fwhm_s = columns(cat, 'g_mag', 'g_ierr', 'ix', 'iy', 'i_mag', 'i_ierr', 'gmi', 'gmi_err', 'fwhm_s')
         
         i_ierrAVG, bedges, binid = ss.binned_statistic(i_mag,i_ierr,statistic='median',bins=10,range=[15,25])
         gmi_errAVG, bedges, binid = ss.binned_statistic(i_mag,gmi_err,statistic='median',bins=10,range=[15,25])
@@ -69,7 +57,6 @@ def main():
         # print gmi_errAVG
         # print len(gx), "after color+mag error cut"
         # nid = np.loadtxt(mag_file,usecols=(0,),dtype=int,unpack=True)
-        pixcrd = list(zip(ix,iy))
         
         
         # print "Reading WCS info from image header..."
@@ -96,38 +83,25 @@ def main():
         # Convert pixel coordinates to world coordinates
         # The second argument is "origin" -- in this case we're declaring we
         # have 1-based (Fortran-like) coordinates.
-        world = w.all_pix2world(pixcrd, 1)
-        ra_corner, dec_corner = w.all_pix2world(0,0,1)
+        world, ra_corner, dec_corner = project(ix, iy, fits_i[0].header, mag_file)
         ra_c_d,dec_c_d = deg2HMS(ra=ra_corner, dec=dec_corner, round=True)
         # print 'Corner RA:',ra_c_d,':: Corner Dec:',dec_c_d
         
         fits_i.close()
         
-        # split the ra and dec out into individual arrays and transform to arcmin from the corner
-        i_ra = [abs((world[i,0]-ra_corner)*60) for i in range(len(world[:,0]))]
-        i_dec = [abs((world[i,1]-dec_corner)*60) for i in range(len(world[:,1]))]
-        # also preserve the decimal degrees for reference
-        i_rad = [world[i,0] for i in range(len(world[:,0]))]
-        i_decd = [world[i,1] for i in range(len(world[:,1]))]
+        # transform to arcmin from the corner, and also preserve the decimal degrees for reference
+        add_sky(cat, world, ra_corner, dec_corner)
+        i_ra, i_dec, i_rad, i_decd = columns(cat, 'i_ra', 'i_dec', 'i_rad', 'i_decd')
         
         cm_filter, gi_iso, i_m_iso = make_filter(dm, filter_file)
         gi_young, i_m_young = make_youngpop(dm, young_file)
         stars_f = filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, filter_sig = 1)
         
-        xy_points = list(zip(i_ra,i_dec))
+        xy_points = np.column_stack((i_ra,i_dec))
         
         # make new vectors containing only the filtered points
         
-        i_mag_f = [i_mag[i] for i in range(len(i_mag)) if (stars_f[i])]
-        g_mag_f = [g_mag[i] for i in range(len(i_mag)) if (stars_f[i])]
-        gmi_f = [gmi[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_ra_f = [i_ra[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_dec_f = [i_dec[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_rad_f = [i_rad[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_decd_f = [i_decd[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_x_f = [ix[i] for i in range(len(i_mag)) if (stars_f[i])]
-        i_y_f = [iy[i] for i in range(len(i_mag)) if (stars_f[i])]
-        fwhm_sf = [fwhm_s[i] for i in range(len(i_mag)) if (stars_f[i])]
+        i_mag_f, g_mag_f, gmi_f, i_ra_f, i_dec_f, i_rad_f, i_decd_f, i_x_f, i_y_f, fwhm_sf = select(cat, stars_f, 'i_mag', 'g_mag', 'gmi', 'i_ra', 'i_dec', 'i_rad', 'i_decd', 'ix', 'iy', 'fwhm_s')
         n_in_filter = len(i_mag_f)
         
         xedges, x_cent, yedges, y_cent, S, x_cent_S, y_cent_S, pltsig, tbl = grid_smooth(i_ra_f, i_dec_f, sm, width, height)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the Monte Carlo null distributions used by magfilter.distfit
+
+The random-field peak distribution only depends on the number of stars and the
+field/smoothing geometry, so the lognormal fit (plus the raw peak values and their
+histogram) is kept per (n, width, height, fwhm, samples) and reused by later
+DM steps, later scans, and other targets with a similar field.
+
+Entries live in one directory per geometry, one .npz per n. lookup() only returns
+an entry for exactly that n. For an n that isn't cached, bracket() returns the
+nearest cached n on either side (if they are close enough) with interpolation
+weights, and the caller mixes their distributions: the percentile of a peak is
+the weighted mean of the two percentiles. The lognormal parameters themselves
+are strongly correlated, so they are never averaged. The least recently used
+entries are dropped once the cache holds more than max_entries.
+
+A DM scan seeds the null draws for each n from (seed, n, geometry), so an entry is
+the same whichever worker or step writes it, and lookup() sees entries stored
+during the scan. Whether a neighbouring n has been stored yet does depend on the
+order steps finish in, so while a scan runs (freeze/thaw) bracket() only mixes the
+entries that were there when it started, and results don't depend on --jobs.
+"""
+import os
+import glob
+import numpy as np
+
+cache_dir = os.environ.get('UCHVC_NULLCACHE', os.path.join(os.environ.get('HOME', '.'), '.uchvc_nullcache'))
+max_entries = 20000     # LRU limit on the number of cached n values (all geometries)
+n_frac = 0.05           # interpolate only between cached n that are within this fraction of n
+n_min_gap = 2           # ...or at most this many stars apart
+_replace = getattr(os, 'replace', os.rename)
+
+_count = None           # entries on disk, counted lazily
+_frozen = None          # while frozen: {geometry directory: set of n} bracket() can mix
+
+def _geom_dir(width, height, fwhm, samples):
+    return os.path.join(cache_dir, '{:.2f}_{:.2f}_{:.2f}_{:d}'.format(width, height, fwhm, samples))
+
+def _entry(geom, n):
+    return os.path.join(geom, '{:07d}.npz'.format(n))
+
+def _read(path):
+    # load an entry and mark it as recently used
+    with np.load(path) as d:
+        fit = (float(d['al']), float(d['loc']), float(d['beta']), d['bins'].copy())
+    os.utime(path, None)
+    return fit
+
+def _cached_ns(geom):
+    # the n cached for a geometry (only those in the snapshot while frozen)
+    if _frozen is not None:
+        return np.array(sorted(_frozen.get(os.path.basename(geom), ())), dtype=int)
+    return np.array(sorted(int(os.path.basename(f)[:-4]) for f in glob.glob(os.path.join(geom, '*.npz'))), dtype=int)
+
+def snapshot():
+    # the entries on disk now, as {geometry directory: set of n}
+    snap = {}
+    for f in glob.glob(os.path.join(cache_dir, '*', '*.npz')):
+        snap.setdefault(os.path.basename(os.path.dirname(f)), set()).add(int(os.path.basename(f)[:-4]))
+    return snap
+
+def freeze(snap=None):
+    # until thaw(), bracket only the entries in snap (default: what's on disk now) and don't
+    # evict; returns the snapshot, to hand to worker processes
+    global _frozen
+    _frozen = snapshot() if snap is None else snap
+    return _frozen
+
+def thaw():
+    # back to seeing every entry, and catch up on eviction
+    global _frozen
+    _frozen = None
+    if _count is not None and _count > max_entries:
+        evict()
+
+def lookup(n, width, height, fwhm, samples):
+    # return (al, loc, beta, bins) cached for exactly this n and field, or None
+    geom = _geom_dir(width, height, fwhm, samples)
+    path = _entry(geom, n)
+    if not os.path.isfile(path):
+        return None
+    try:
+        return _read(path)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+def bracket(n, width, height, fwhm, samples):
+    # for an n that isn't cached, the entries of the closest cached n either side as
+    # [(weight, (al, loc, beta, bins)), (weight, (...))] with weights linear in n, or None
+    # if there isn't one on both sides within n_frac (or n_min_gap)
+    geom = _geom_dir(width, height, fwhm, samples)
+    ns = _cached_ns(geom)
+    lower, upper = ns[ns < n], ns[ns > n]
+    if len(lower) == 0 or len(upper) == 0:
+        return None
+    n_lo, n_hi = lower[-1], upper[0]
+    if n_hi - n_lo > max(n_min_gap, n_frac*n):
+        return None
+    try:
+        lo, hi = _read(_entry(geom, n_lo)), _read(_entry(geom, n_hi))
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    t = float(n - n_lo)/float(n_hi - n_lo)
+    return [(1.0-t, lo), (t, hi)]
+
+def store(n, width, height, fwhm, samples, vals, al, loc, beta, bins):
+    # write an entry atomically (temp file + rename) so parallel scans never see half a file
+    global _count
+    geom = _geom_dir(width, height, fwhm, samples)
+    if not os.path.isdir(geom):
+        try:
+            os.makedirs(geom)
+        except OSError:
+            pass
+    path = _entry(geom, n)
+    tmp = '{:s}.{:d}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        np.savez(f, vals=np.asarray(vals, dtype=np.float32), al=al, loc=loc, beta=beta, bins=bins)
+    new = not os.path.isfile(path)
+    _replace(tmp, path)
+
+    if _count is None:
+        _count = len(glob.glob(os.path.join(cache_dir, '*', '*.npz')))
+    elif new:
+        _count += 1
+    if _count > max_entries and _frozen is None:
+        evict()
+
+def evict(keep=None):
+    # drop the least recently used entries until at most keep (default 90% of max_entries) remain
+    global _count
+    if keep is None:
+        keep = int(0.9*max_entries)
+    files = glob.glob(os.path.join(cache_dir, '*', '*.npz'))
+    files.sort(key=lambda f: os.path.getmtime(f))
+    for f in files[:max(0, len(files)-keep)]:
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+    _count = min(len(files), keep)
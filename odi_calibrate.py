@@ -12,7 +12,11 @@ Also uses code from an SDSS provided SQL query script
 
 import os
 import sys
+import io
 import numpy as np
+import sdssquery
+import aphot
+from sdssquery import filtercomment     # still imported from here by magfilter
 
 formats = ['csv','xml','html']
 
@@ -29,20 +33,9 @@ def usage(status, msg=''):
         print('-- ERROR: %s' % msg)
     sys.exit(status)
 
-def filtercomment(sql):
-    "Get rid of comments starting with --"
-    import os
-    fsql = ''
-    for line in sql.split('\n'):
-        fsql += line.split('--')[0] + ' ' + os.linesep;
-    return fsql
-
 def query(sql,url=default_url,fmt=default_fmt):
-    "Run query and return file object"
-    import urllib.request, urllib.parse, urllib.error
-    fsql = filtercomment(sql)
-    params = urllib.parse.urlencode({'cmd': fsql, 'format': fmt})
-    return urllib.request.urlopen(url+'?%s' % params)    
+    "Run query (or find it in the SDSS response cache) and return file object"
+    return io.StringIO(sdssquery.fetch(sql, url, fmt))
 
 def write_header(ofp,pre,url,qry):
     import  time
@@ -52,143 +45,130 @@ def write_header(ofp,pre,url,qry):
     for l in qry.split('\n'):
         ofp.write('%s   %s\n' % (pre,l))
 
-def download_sdss(img1, img2, gmaglim = 21, gmagbrlim = 16):
-    try: 
-        import sys
-        import numpy as np
-        from astropy.io import fits
-        from astropy import wcs
-        import os
-        import string
-    except ImportError:
-        print("You should 'pip install astropy' before you try to run this program") 
+# columns of the combined SDSS query: PSF magnitudes and probPSF first (the layout of the old
+# .sdss files), then the model magnitudes
+sdss_cols = ['ra', 'dec', 'psfMag_u', 'psfMagErr_u', 'psfMag_g', 'psfMagErr_g', 'psfMag_r', 'psfMagErr_r',
+             'psfMag_i', 'psfMagErr_i', 'psfMag_z', 'psfMagErr_z', 'probPSF',
+             'u', 'err_u', 'g', 'err_g', 'r', 'err_r', 'i', 'err_i', 'z', 'err_z']
 
-    print('fetching SDSS data from \n--> '+public_url)
-    
-    image = img1
-    
-    # read in the image header and save it to a variable for non-destructive editing
+_fields = {}
+
+def _field_wcs(image):
+    # the image header without the PV keywords (they don't work with astropy.wcs, and steven
+    # thinks they are redundant anyway), and its WCS
+    from astropy.io import fits
+    from astropy import wcs
     hdulist = fits.open(image)
     hdr = hdulist[0].header
     hdulist.close()
-    # get the image dimensions
-    xdim = hdr['NAXIS1']
-    ydim = hdr['NAXIS2']
-
-    # and find the image center
-    xc = xdim/2.0
-    yc = ydim/2.0
-
-    # get the CD matrix keywords
-    cd11 = hdr['CD1_1']
-    cd22 = hdr['CD2_2']
-    # try to load cd12 and cd21, if they don't exist, set them to zero
-    try :
-        cd12 = hdr['CD1_2']
-    except:
-        cd12 = 0.0
-    try :
-        cd21 = hdr['CD2_1']
-    except:
-        cd21 = 0.0
-
-    # get rid of keywords starting with PV, they don't work with astropy.wcs
-    # and steven thinks they are redundant anyway
     pvlist = hdr['PV*']
     for pv in pvlist:
         hdr.remove(pv)
-        
-    
-    # open the second fits image
-    hdulist = fits.open(img2)
-    hdr_r = hdulist[0].header
-    hdulist.close()
-    
-    pvlist = hdr_r['PV*']
-    for pv in pvlist:
-        hdr_r.remove(pv)
-    
-    # Parse the WCS keywords in the primary HDU
-    w = wcs.WCS(hdr)
-    w_r = wcs.WCS(hdr_r)
-
-    # Some pixel coordinates of interest (these are the image centers)
-    pixcrd = np.array([[xc,yc]], np.float_)
+    return hdr, wcs.WCS(hdr)
+
+def fetch_field(img1, img2):
+    # all SDSS objects in the cone covering img1, stars and galaxies, with PSF and model magnitudes,
+    # from one query, and projected onto both images (x, y on img1, x_r, y_r on img2). returns
+    # (catalog, xdim, ydim) with the catalog a structured array (sdss_cols plus the positions).
+    # the result is kept in img1's .sdss.npz (and in memory), valid while the query and both
+    # headers are the same; the raw response also goes to img1's .sdss as before
+    import hashlib
+    hdr, w = _field_wcs(img1)
+    hdr_r, w_r = _field_wcs(img2)
+    # get the image dimensions
+    xdim = hdr['NAXIS1']
+    ydim = hdr['NAXIS2']
 
-    # Convert pixel coordinates to world coordinates
+    # find the image center in world coordinates
     # The second argument is "origin" -- in this case we're declaring we
     # have 1-based (Fortran-like) coordinates.
-    world = w.wcs_pix2world(pixcrd, 1)
-    # print(world)    
+    world = w.wcs_pix2world(np.array([[xdim/2.0, ydim/2.0]], float), 1)
     rac = world[0][0]
     decc = world[0][1]
 
     # get the biggest radius of the image in arcminutes
-    pixscal1 = 3600*abs(cd11)
-    pixscal2 = 3600*abs(cd22)
-    xas = pixscal1 * xdim # in arcseconds
-    yas = pixscal2 * ydim
-    xam = xas/60    # to arcminutes
-    yam = yas/60
-    #print(xam,yam)
+    xam = 3600*abs(hdr['CD1_1']) * xdim / 60    # arcseconds to arcminutes
+    yam = 3600*abs(hdr['CD2_2']) * ydim / 60
     #radius for query: sqrt2 = 1.414
     sizeam = 1.414*(xam+yam)/4
-    # print sizeam
 
-    if not os.path.isfile(image[:-5]+'.sdss'):
-        # build the SDSS query
-        qry = "select O.ra, O.dec, O.psfMag_u, O.psfMagErr_u, O.psfMag_g, \nO.psfMagErr_g, O.psfMag_r, O.psfMagErr_r, O.psfMag_i, \nO.psfMagErr_i, O.psfMag_z, O.psfMagErr_z, O.probPSF \nfrom \ndbo.fGetNearbyObjEq("+repr(rac)+","+repr(decc)+","+repr(sizeam)+") \nas N inner join PhotoObjAll as O on O.objID = N.objID order by N.distance"
-    
-        # print it to the terminal
-        print('with query\n-->', qry)
-        url = default_url
-        fmt = default_fmt
-        writefirst = 1
-        verbose = 0
-    
-        # actually do the query
-
-        ofp = open(image[:-5]+'.sdss','w+')
-        if verbose:
-            write_header(ofp,'#',url,qry)
-        file_ = query(qry,url,fmt)
-        # Output line by line (in case it's big)
-        line = file_.readline()
-        if line.startswith("ERROR"): # SQL Statement Error -> stderr
-            ofp = sys.stderr
-        if writefirst:
-            ofp.write(string.rstrip(line)+os.linesep)
-        line = file_.readline()
-        while line:
-            ofp.write(string.rstrip(line)+os.linesep)
-            line = file_.readline()
-        ofp.close()
-    
-    # read in the results
-    ras,decs,psfMag_u,psfMagErr_u,psfMag_g,psfMagErr_g,psfMag_r,psfMagErr_r,psfMag_i,psfMagErr_i,psfMag_z,psfMagErr_z = np.loadtxt(image[:-5]+'.sdss',usecols=(0,1,2,3,4,5,6,7,8,9,10,11), unpack=True, delimiter=',', skiprows=2)
-    probPSF = np.loadtxt(image[:-5]+'.sdss', usecols=(12,), dtype=int, unpack=True, delimiter=',', skiprows=2)
+    # build the SDSS query
+    qry = "select O.ra, O.dec, O.psfMag_u, O.psfMagErr_u, O.psfMag_g, \nO.psfMagErr_g, O.psfMag_r, O.psfMagErr_r, O.psfMag_i, \nO.psfMagErr_i, O.psfMag_z, O.psfMagErr_z, O.probPSF, \nO.u, O.err_u, O.g, O.err_g, O.r, O.err_r, O.i, O.err_i, O.z, O.err_z \nfrom \ndbo.fGetNearbyObjEq("+repr(rac)+","+repr(decc)+","+repr(sizeam)+") \nas N inner join PhotoObjAll as O on O.objID = N.objID order by N.distance"
+    h = hashlib.sha1(sdssquery.cache_key(qry, default_url, default_fmt).encode('ascii'))
+    for header in (hdr, hdr_r):
+        h.update(header.tostring().encode('ascii'))
+    key = h.hexdigest()
+    if key in _fields:
+        return _fields[key]
+    cache_file = img1[:-5]+'.sdss.npz'
+    if os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as d:
+                if str(d['key']) == key:
+                    _fields[key] = (d['cat'], xdim, ydim)
+                    return _fields[key]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    print('fetching SDSS data from \n--> '+default_url)
+    # print it to the terminal
+    print('with query\n-->', qry)
+    # actually do the query (only the first time this exact query is run, after that
+    # the response comes from the cache)
+    sdssquery.fetch_to(img1[:-5]+'.sdss', qry, default_url, default_fmt)
+    data = np.loadtxt(img1[:-5]+'.sdss', delimiter=',', skiprows=2, ndmin=2)
+
+    cat = np.zeros(len(data), dtype=[(c, int if c == 'probPSF' else float) for c in sdss_cols + ['x', 'y', 'x_r', 'y_r']])
+    for k, c in enumerate(sdss_cols):
+        cat[c] = data[:,k]
+    # one projection of the whole catalog onto each image
+    radec = np.column_stack((cat['ra'], cat['dec']))
+    pixcrd2 = w.wcs_world2pix(radec, 1)
+    pixcrd2_r = w_r.wcs_world2pix(radec, 1)
+    cat['x'], cat['y'] = pixcrd2[:,0], pixcrd2[:,1]
+    cat['x_r'], cat['y_r'] = pixcrd2_r[:,0], pixcrd2_r[:,1]
 
-    coords2 = list(zip(ras,decs))
-    pixcrd2 = w.wcs_world2pix(coords2, 1)
-    pixcrd2_r = w_r.wcs_world2pix(coords2, 1)
+    try:
+        tmp = '{:s}.{:d}.tmp'.format(cache_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, key=key, cat=cat)
+        os.replace(tmp, cache_file)
+    except (IOError, OSError):
+        pass
+    _fields[key] = (cat, xdim, ydim)
+    return _fields[key]
+
+def _write_xy(out_file, cat, xcol, ycol, header, psf):
+    # x, y on one image, ra, dec, then ugriz and their errors (PSF or model magnitudes)
+    cols = [xcol, ycol, 'ra', 'dec']
+    for band in 'ugriz':
+        cols += ['psfMag_'+band, 'psfMagErr_'+band] if psf else [band, 'err_'+band]
+    np.savetxt(out_file, np.column_stack([cat[c] for c in cols]), fmt='%s', header=header)
+
+def download_sdss(img1, img2, gmaglim = 21, gmagbrlim = 16):
+    # SDSS stars (PSF magnitudes) on each image, for the calibration, to the .sdssxy files
+    cat, xdim, ydim = fetch_field(img1, img2)
 
     # keep things that are actually stars (defined as being psf's) and with the right magnitude range (arbitrary)
+    keep_stars = ((cat['probPSF'] == 1) & (cat['psfMag_g'] < gmaglim) & (cat['psfMagErr_g'] <0.1) & (cat['psfMag_g'] > gmagbrlim))
+    print('keeping', np.count_nonzero(keep_stars), 'stars of', len(cat), 'sources')
 
-    keep_stars = ((probPSF == 1) & (psfMag_g < gmaglim) & (psfMagErr_g <0.1) & (psfMag_g > gmagbrlim))
-    print('keeping', len(np.where(keep_stars)[0]), 'stars of', len(psfMag_g), 'sources')
-    
     # then write out separate files for g and i
-    with open(image[:-5]+'.sdssxy','w+') as f1:
-        print("# x_g y_g ra dec u uerr g gerr r rerr i ierr z zerr (all psfmags)", file=f1)
-        for i,id in enumerate(np.where(keep_stars)[0]):
-            if 100.0 < pixcrd2[id][0] < xdim-100.0 and 100.0 < pixcrd2[id][1] < ydim-100.0:
-                print(pixcrd2[id][0], pixcrd2[id][1], ras[id], decs[id], psfMag_u[id], psfMagErr_u[id], psfMag_g[id], psfMagErr_g[id], psfMag_r[id], psfMagErr_r[id], psfMag_i[id], psfMagErr_i[id], psfMag_z[id], psfMagErr_z[id], file=f1)
-            
-    with open(img2[:-5]+'.sdssxy','w+') as f1:
-        print("# x_r y_r ra dec u uerr g gerr r rerr i ierr z zerr (all psfmags)", file=f1)
-        for i,id in enumerate(np.where(keep_stars)[0]):
-            if 100.0 < pixcrd2_r[id][0] < xdim-100.0 and 100.0 < pixcrd2_r[id][1] < ydim-100.0:
-                print(pixcrd2_r[id][0], pixcrd2_r[id][1], ras[id], decs[id], psfMag_u[id], psfMagErr_u[id], psfMag_g[id], psfMagErr_g[id], psfMag_r[id], psfMagErr_r[id], psfMag_i[id], psfMagErr_i[id], psfMag_z[id], psfMagErr_z[id], file=f1)
+    inside = keep_stars & (100.0 < cat['x']) & (cat['x'] < xdim-100.0) & (100.0 < cat['y']) & (cat['y'] < ydim-100.0)
+    _write_xy(img1[:-5]+'.sdssxy', cat[inside], 'x', 'y', "x_g y_g ra dec u uerr g gerr r rerr i ierr z zerr (all psfmags)", True)
+    inside = keep_stars & (100.0 < cat['x_r']) & (cat['x_r'] < xdim-100.0) & (100.0 < cat['y_r']) & (cat['y_r'] < ydim-100.0)
+    _write_xy(img2[:-5]+'.sdssxy', cat[inside], 'x_r', 'y_r', "x_r y_r ra dec u uerr g gerr r rerr i ierr z zerr (all psfmags)", True)
+
+def download_sdss_gal(img1, img2):
+    # SDSS galaxies (model magnitudes) on each image, to the .galxy files, from the same query as download_sdss
+    cat, xdim, ydim = fetch_field(img1, img2)
+
+    keep_gals = (cat['probPSF'] == 0)
+    print('keeping', np.count_nonzero(keep_gals), 'galaxies of', len(cat), 'sources')
+
+    # then write out separate files for g and i
+    _write_xy(img1[:-5]+'.galxy', cat[keep_gals], 'x', 'y', "x_g y_g ra dec u uerr g gerr r rerr i ierr z zerr (all modelmags)", False)
+    _write_xy(img2[:-5]+'.galxy', cat[keep_gals], 'x_r', 'y_r', "x_r y_r ra dec u uerr g gerr r rerr i ierr z zerr (all modelmags)", False)
 
 # def linear(x, m, b):
 #     y = m*x + b
@@ -196,38 +176,20 @@ def download_sdss(img1, img2, gmaglim = 21, gmagbrlim = 16):
 
 def getfwhm(image, radius=4.0, buff=7.0, width=5.0, rplot=15.0, center='yes'):
     '''
-    Get a fwhm estimate for the image using the SDSS catalog stars and IRAF imexam (SLOW, but works)
+    Get a fwhm estimate for the image using the SDSS catalog stars and imexam-style gaussian profile fits (aphot.radprof)
     Adapted from Kathy's getfwhm script (this implementation is simpler in practice)
     '''
-    from pyraf import iraf
     import numpy as np
     import os
     
     outputfile = image[:-5]+'_fwhmCAL.log'
     coords = image[:-5]+'.sdssxy'
     
-    iraf.tv.rimexam.setParam('radius',radius)
-    iraf.tv.rimexam.setParam('buffer',buff)
-    iraf.tv.rimexam.setParam('width',width)
-    iraf.tv.rimexam.setParam('rplot',rplot)
-    iraf.tv.rimexam.setParam('center',center)
     # fit a gaussian, rather than a moffat profile (it's more robust for faint sources)
-    iraf.tv.rimexam.setParam('fittype','gaussian')
-    iraf.tv.rimexam.setParam('iterati',1)
-    
+    # unmeasured values are written as 999, as the old imexam log cleanup did
     if not os.path.isfile(outputfile):
-        iraf.tv.imexamine(image, frame=10, logfile = outputfile, keeplog = 'yes', defkey = "a", nframes=0, imagecur = coords, wcs = "logical", use_display='no',  StdoutG='/dev/null',mode='h')
-    outputfile_clean = open(outputfile.replace('.log','_clean.log'),"w")
-    for line in open(outputfile,"r"):
-        if not 'INDEF' in line:
-            outputfile_clean.write(line)
-        if 'INDEF' in line:
-            outputfile_clean.write(line.replace('INDEF','999'))
-    outputfile_clean.close()
-    os.rename(outputfile.replace('.log','_clean.log'),outputfile)
-    #
-    # # unfortunately we have to toss the first measured fwhm value from the median because of the file format
-    # # gfwhm = np.genfromtxt(outputfile, usecols=(3,), skip_header=4, skip_footer=3, unpack=True)
+        prof = aphot.radprof(image, coords, radius=radius, buff=buff, width=width, rplot=rplot, center=(center == 'yes'), fittype='gaussian')
+        aphot.write_log(outputfile, prof, layout='calibrate', indef='999')
     gfwhm = np.loadtxt(outputfile, usecols=(10,), unpack=True)
     # hdulist = ast.io.fits.open(image)
     # seeing = hdulist[0].header['FWHMSTAR']
@@ -255,7 +217,6 @@ def ota_zp(x, y, gi, di, x_ota, y_ota):
     
 def calibrate(img1 = None, img2 = None, podicut = 0.03, sdsscut = 0.03):
     try:
-        from pyraf import iraf
         from astropy.io import fits
         import numpy as np
         from scipy import stats
@@ -306,45 +267,18 @@ def calibrate(img1 = None, img2 = None, podicut = 0.03, sdsscut = 0.03):
         #     # fwhm1 = getfwhm(img1)
         #     # fwhm2 = getfwhm(img2)
 
-    # alas, we must use IRAF apphot to do the measuring
-    # first set common parameters (these shouldn't change if you're using ODI)
-    iraf.unlearn(iraf.phot,iraf.datapars,iraf.photpars,iraf.centerpars,iraf.fitskypars)
-    iraf.apphot.phot.setParam('interactive',"no")
-    iraf.apphot.phot.setParam('verify',"no")
-    iraf.datapars.setParam('datamax',50000.)
-    iraf.datapars.setParam('gain',"gain")
-    iraf.datapars.setParam('ccdread',"rdnoise") # swarped images don't have this
-    iraf.datapars.setParam('exposure',"exptime")
-    iraf.datapars.setParam('airmass',"airmass") # swarped images don't have this
-    iraf.datapars.setParam('filter',"filter")
-    iraf.datapars.setParam('obstime',"time-obs")
-    iraf.datapars.setParam('sigma',"INDEF")
-    iraf.photpars.setParam('zmag',0.)
-    iraf.centerpars.setParam('cbox',9.)
-    iraf.centerpars.setParam('maxshift',3.)
-    iraf.fitskypars.setParam('salgorithm',"median")
-    iraf.fitskypars.setParam('dannulus',10.)
-
-    # print 'pyraf thinks its in', os.getcwd()
-    # now phot each image with the individual params
-    # use txdump to put things in a nicer format for reading in
+    # measure with aphot (same centering/sky/aperture recipe as IRAF apphot.phot with
+    # cbox=9, maxshift=3, median sky in a 10 pixel annulus, datamax=50000, zmag=0)
+    # and write the txdump columns the rest of this reads back in
     if not os.path.isfile(img1[0:-5]+'_cal.sdssphot'): # only do this once
-        print('phot-ing the g image, this might take a while...')
-        iraf.datapars.setParam('fwhmpsf',fwhm1)
-        iraf.photpars.setParam('apertures',5.*fwhm1) # use a big aperture for this
-        iraf.fitskypars.setParam('annulus',6.*fwhm1)
-        iraf.apphot.phot(image=img1, coords=img1[0:-5]+'.sdssxy', output=img1[0:-5]+'_cal.phot.1')
-        with open(img1[0:-5]+'_cal.sdssphot','w+') as txdump_out :
-            iraf.ptools.txdump(textfiles=img1[0:-5]+'_cal.phot.1', fields="id,mag,merr,msky,stdev,rapert,xcen,ycen,ifilter,xairmass,image", expr='MAG != INDEF && MERR != INDEF', headers='no', Stdout=txdump_out)
+        print('phot-ing the g image...')
+        ph = aphot.phot(img1, img1[0:-5]+'.sdssxy', 5.*fwhm1, 6.*fwhm1, dannulus=10., datamax=50000.) # use a big aperture for this
+        aphot.write_txdump(img1[0:-5]+'_cal.sdssphot', ph, aphot.txdump_fields, require=('mag','merr'))
 
     if not os.path.isfile(img2[0:-5]+'_cal.sdssphot'):
-        print('phot-ing the r/i image, this might take a while...')
-        iraf.datapars.setParam('fwhmpsf',fwhm2)
-        iraf.photpars.setParam('apertures',5.*fwhm2) # use a big aperture for this
-        iraf.fitskypars.setParam('annulus',6.*fwhm2)
-        iraf.apphot.phot(image=img2, coords=img2[0:-5]+'.sdssxy', output=img2[0:-5]+'_cal.phot.1')
-        with open(img2[0:-5]+'_cal.sdssphot','w+') as txdump_out :
-            iraf.ptools.txdump(textfiles=img2[0:-5]+'_cal.phot.1', fields="id,mag,merr,msky,stdev,rapert,xcen,ycen,ifilter,xairmass,image", expr='MAG != INDEF && MERR != INDEF', headers='no', Stdout=txdump_out)
+        print('phot-ing the r/i image...')
+        ph = aphot.phot(img2, img2[0:-5]+'.sdssxy', 5.*fwhm2, 6.*fwhm2, dannulus=10., datamax=50000.)
+        aphot.write_txdump(img2[0:-5]+'_cal.sdssphot', ph, aphot.txdump_fields, require=('mag','merr'))
 
     # read in getfwhm logs
     col1, line1, rmag1, flux1, sky1, n1, rmom1, ellip1, pa1, peak1, gfwhm1 = np.loadtxt(img1[0:-5]+'_fwhmCAL.log', usecols=(0,1,2,3,4,5,6,7,8,9,10), dtype=float, unpack=True)
@@ -661,7 +595,6 @@ def calibrate(img1 = None, img2 = None, podicut = 0.03, sdsscut = 0.03):
 
 def js_calibrate(img1 = None, img2 = None, podicut = 0.03, sdsscut = 0.03, verbose=False):
     try:
-        from pyraf import iraf
         from astropy.io import fits
         import astropy as ast
         from astropy.wcs import WCS
@@ -681,8 +614,6 @@ def js_calibrate(img1 = None, img2 = None, podicut = 0.03, sdsscut = 0.03, verbo
     kr = 0.12
     ki = 0.058
 
-    iraf.ptools(_doprint=0)
-
     # you're going to need the average stellar fwhm to compute a aperture size
     # ralf or steven probably write one to the image header during QR/etc
     # just use that value here
@@ -717,45 +648,18 @@ def js_calibrate(img1 = None, img2 = None, podicut = 0.03, sdsscut = 0.03, verbo
         #     # fwhm1 = getfwhm(img1)
         #     # fwhm2 = getfwhm(img2)
     
-    # alas, we must use IRAF apphot to do the measuring
-    # first set common parameters (these shouldn't change if you're using ODI)
-    iraf.unlearn(iraf.phot,iraf.datapars,iraf.photpars,iraf.centerpars,iraf.fitskypars)
-    iraf.apphot.phot.setParam('interactive',"no")
-    iraf.apphot.phot.setParam('verify',"no")
-    iraf.datapars.setParam('datamax',50000.)
-    iraf.datapars.setParam('gain',"gain")
-    iraf.datapars.setParam('ccdread',"rdnoise") # swarped images don't have this
-    iraf.datapars.setParam('exposure',"exptime")
-    iraf.datapars.setParam('airmass',"airmass") # swarped images don't have this
-    iraf.datapars.setParam('filter',"filter")
-    iraf.datapars.setParam('obstime',"time-obs")
-    iraf.datapars.setParam('sigma',"INDEF")
-    iraf.photpars.setParam('zmag',0.)
-    iraf.centerpars.setParam('cbox',9.)
-    iraf.centerpars.setParam('maxshift',3.)
-    iraf.fitskypars.setParam('salgorithm',"median")
-    iraf.fitskypars.setParam('dannulus',10.)
-    
-    # print 'pyraf thinks its in', os.getcwd()
-    # now phot each image with the individual params
-    # use txdump to put things in a nicer format for reading in
+    # measure with aphot (same centering/sky/aperture recipe as IRAF apphot.phot with
+    # cbox=9, maxshift=3, median sky in a 10 pixel annulus, datamax=50000, zmag=0)
+    # and write the txdump columns the rest of this reads back in
     if not os.path.isfile(img1[0:-5]+'_cal_js.sdssphot'): # only do this once
-        print('phot-ing the g image, this might take a while...')
-        iraf.datapars.setParam('fwhmpsf',fwhm1)
-        iraf.photpars.setParam('apertures',5.*fwhm1) # use a big aperture for this
-        iraf.fitskypars.setParam('annulus',6.*fwhm1)
-        iraf.apphot.phot(image=img1, coords=img1[0:-5]+'.sdssxy', output=img1[0:-5]+'_cal_js.phot.1')
-        with open(img1[0:-5]+'_cal_js.sdssphot','w+') as txdump_out :
-            iraf.ptools.txdump(textfiles=img1[0:-5]+'_cal_js.phot.1', fields="id,mag,merr,msky,stdev,rapert,xcen,ycen,ifilter,xairmass,image", expr='MAG != INDEF && MERR != INDEF', headers='no', Stdout=txdump_out)
-    
+        print('phot-ing the g image...')
+        ph = aphot.phot(img1, img1[0:-5]+'.sdssxy', 5.*fwhm1, 6.*fwhm1, dannulus=10., datamax=50000.) # use a big aperture for this
+        aphot.write_txdump(img1[0:-5]+'_cal_js.sdssphot', ph, aphot.txdump_fields, require=('mag','merr'))
+
     if not os.path.isfile(img2[0:-5]+'_cal_js.sdssphot'):
-        print('phot-ing the r/i image, this might take a while...')
-        iraf.datapars.setParam('fwhmpsf',fwhm2)
-        iraf.photpars.setParam('apertures',5.*fwhm2) # use a big aperture for this
-        iraf.fitskypars.setParam('annulus',6.*fwhm2)
-        iraf.apphot.phot(image=img2, coords=img2[0:-5]+'.sdssxy', output=img2[0:-5]+'_cal_js.phot.1')
-        with open(img2[0:-5]+'_cal_js.sdssphot','w+') as txdump_out :
-            iraf.ptools.txdump(textfiles=img2[0:-5]+'_cal_js.phot.1', fields="id,mag,merr,msky,stdev,rapert,xcen,ycen,ifilter,xairmass,image", expr='MAG != INDEF && MERR != INDEF', headers='no', Stdout=txdump_out)
+        print('phot-ing the r/i image...')
+        ph = aphot.phot(img2, img2[0:-5]+'.sdssxy', 5.*fwhm2, 6.*fwhm2, dannulus=10., datamax=50000.)
+        aphot.write_txdump(img2[0:-5]+'_cal_js.sdssphot', ph, aphot.txdump_fields, require=('mag','merr'))
     
     # read in getfwhm logs
     col1, line1, rmag1, flux1, sky1, n1, rmom1, ellip1, pa1, peak1, gfwhm1 = np.loadtxt(img1[0:-5]+'_fwhmCAL.log', usecols=(0,1,2,3,4,5,6,7,8,9,10), dtype=float, unpack=True)
@@ -1112,6 +1016,35 @@ def get_calibration():
     photcalFile.close()
     return eps_g, std_eps_g, zp_g, std_zp_g, eps_i, std_eps_i, zp_i, std_zp_i
 
+def apply_calibration(g0, i0, eps_g, zp_g, eps_i, zp_i, tolerance=0.0001, maxiter=100):
+    # calibrated g and i magnitudes from the extinction-corrected instrumental ones, solving
+    #   g = g0 + eps_g*(g-i) + zp_g,   i = i0 + eps_i*(g-i) + zp_i
+    # for whole arrays at once. With constant color terms this is linear in the color, so
+    #   g-i = (g0-i0+zp_g-zp_i)/(1-eps_g+eps_i)
+    # directly. A color term may instead be a function of the color (returning the term itself,
+    # e.g. a np.poly1d); then the color is iterated from 0 until it changes by less than
+    # tolerance, as the old per-star loops did, and stars that don't converge get nan.
+    g0, i0 = np.asarray(g0, dtype=float), np.asarray(i0, dtype=float)
+    c0 = g0 - i0 + zp_g - zp_i
+    if not (callable(eps_g) or callable(eps_i)):
+        color = c0/(1. - eps_g + eps_i)
+        return g0 + eps_g*color + zp_g, i0 + eps_i*color + zp_i
+    term_g = eps_g if callable(eps_g) else (lambda c: eps_g*c)
+    term_i = eps_i if callable(eps_i) else (lambda c: eps_i*c)
+    c0 = c0.reshape(-1)
+    color = np.where(np.isfinite(c0), 0., np.nan)
+    active = np.isfinite(c0)
+    for k in range(maxiter):
+        if not active.any():
+            break
+        c = color[active]
+        new = c0[active] + term_g(c) - term_i(c)
+        color[active] = new
+        active[active] = ~(np.abs(new - c) <= tolerance)
+    color[active] = np.nan
+    color = color.reshape(g0.shape)
+    return g0 + term_g(color) + zp_g, i0 + term_i(color) + zp_i
+
 def main():
     # ask user input on which files to run on
     print('This is a program to do SDSS-based photometric calibration on QR-ed pODI images.')
@@ -3,11 +3,12 @@ import os, sys, getopt, warnings
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
-from matplotlib.path import Path
 from matplotlib import cm
 from astropy import wcs
 from astropy.io import fits
 from pyraf import iraf
+from catalog import read_catalog, error_cut, project, add_sky, columns, select, sky_index, select_within, daophot_fwhm_cols
+import smoothing
 from magfilter import galaxyMap, downloadSDSSgal
 try :
     from scipy import ndimage
@@ -47,31 +48,18 @@ def main():
     circ_file = 'c_list_' + filter_string + '_' + fwhm_string + '_' + title_string + '.reg'
 
     mag_file = "AGC249525_daophot.dat.cut"
-    idr,rar,decr,ixr,iyr,am_g,g_ir,g_ierrr,am_i,i_ir,i_ierrr,g_magr,i_magr,gmir,chi,sharp,ebv,gfwhmr,fwhm_sr = np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18),unpack=True)
-    gxr, gyr = ixr, iyr
+    cat = read_catalog(mag_file, daophot_fwhm_cols)
     # read in magnitudes, colors, and positions(x,y)
     # mag_file = 'calibrated_mags.dat'
-    # gxr,gyr,g_magr,g_ierrr,ixr,iyr,i_magr,i_ierrr,gmir= np.loadtxt(mag_file,usecols=(0,1,2,3,4,5,6,7,8),unpack=True)
-    print(len(gxr), "total stars")
+    # cat = read_catalog(mag_file, calibrated_cols)
+    print(len(cat), "total stars")
 
     # filter out the things with crappy color errors
     mag_error_cut = 0.99
-    color_error_cut = np.sqrt(2.0)*mag_error_cut
-
-    gmi_errr = [np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr))]
-    gx = [gxr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    gy = [gyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    g_mag = [g_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    g_ierr = [g_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    ix = [ixr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    iy = [iyr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    i_mag = [i_magr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    i_ierr = [i_ierrr[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    gmi = [gmir[i] for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
-    gmi_err = [np.sqrt(g_ierrr[i]**2 + i_ierrr[i]**2) for i in range(len(gxr)) if (abs(gmi_errr[i] < color_error_cut and i_ierrr[i] < mag_error_cut))]
+    cat = cat[error_cut(cat, mag_error_cut)]
+    g_mag, g_ierr, ix, iy, i_mag, i_ierr, gmi, gmi_err = columns(cat, 'g_mag', 'g_ierr', 'ix', 'iy', 'i_mag', 'i_ierr', 'gmi', 'gmi_err')
 
     # nid = np.loadtxt(mag_file,usecols=(0,),dtype=int,unpack=True)
-    pixcrd = list(zip(ix,iy))
 
 
     # print "Reading WCS info from image header..."
@@ -88,8 +76,7 @@ def main():
     # Convert pixel coordinates to world coordinates
     # The second argument is "origin" -- in this case we're declaring we
     # have 1-based (Fortran-like) coordinates.
-    world = w.all_pix2world(pixcrd, 1)
-    ra_corner, dec_corner = w.all_pix2world(0,0,1)
+    world, ra_corner, dec_corner = project(ix, iy, fits_i[0].header, mag_file)
     ra_c_d,dec_c_d = deg2HMS(ra=ra_corner, dec=dec_corner, round=True)
     print('Corner RA:',ra_c_d,':: Corner Dec:',dec_c_d)
 
@@ -101,12 +88,9 @@ def main():
     fits_i.close()
     fits_g.close()
 
-    # split the ra and dec out into individual arrays and transform to arcmin from the corner
-    i_ra = [abs((world[i,0]-ra_corner)*60) for i in range(len(world[:,0]))]
-    i_dec = [abs((world[i,1]-dec_corner)*60) for i in range(len(world[:,1]))]
-    # also preserve the decimal degrees for reference
-    i_rad = [world[i,0] for i in range(len(world[:,0]))]
-    i_decd = [world[i,1] for i in range(len(world[:,1]))]
+    # transform to arcmin from the corner, and also preserve the decimal degrees for reference
+    add_sky(cat, world, ra_corner, dec_corner)
+    i_ra, i_dec, i_rad, i_decd = columns(cat, 'i_ra', 'i_dec', 'i_rad', 'i_decd')
 
     # bin the filtered stars into a grid with pixel size XXX
     # print "Binning for m-M =",dm
@@ -123,7 +107,7 @@ def main():
 
     # convolve the grid with a gaussian
     # print "Convolving for m-M =",dm
-    grid_gaus = ndimage.filters.gaussian_filter(grid, sig, mode='constant', cval=0)
+    grid_gaus = smoothing.smooth(grid, sig)
     S = np.array(grid_gaus*0)
     S_th = 3.0
 
@@ -163,9 +147,6 @@ def main():
     sind = lambda x : np.sin(np.deg2rad(x))
     x_circ = [yedges[y_cent] + 3.0*cosd(t) for t in range(0,359,1)]
     y_circ = [xedges[x_cent] + 3.0*sind(t) for t in range(0,359,1)]
-    xy_points = list(zip(i_ra,i_dec))
-    verts_circ = list(zip(x_circ,y_circ))
-    circ_filter = Path(verts_circ)
     circ_c_x = ra_corner-(yedges[y_cent]/60.)
     circ_c_y = (xedges[x_cent]/60.)+dec_corner
     circ_pix_x, circ_pix_y = w.wcs_world2pix(circ_c_x,circ_c_y,1)
@@ -176,16 +157,9 @@ def main():
     # with open(ds9_file,'w+') as ds9:
     #     print >> ds9, "fk5;circle({:f},{:f},2') # color=cyan width=2 label=psmap".format(ra_c, dec_c)
 
-    stars_circ = circ_filter.contains_points(xy_points)    
+    stars_circ = select_within(sky_index(cat), (yedges[y_cent], xedges[x_cent]), 3.0)
 
-    i_mag_c = [i_mag[i] for i in range(len(i_mag)) if (stars_circ[i])]
-    gmi_c = [gmi[i] for i in range(len(i_mag)) if (stars_circ[i])]
-    i_ra_c = [i_ra[i] for i in range(len(i_mag)) if (stars_circ[i])]
-    i_dec_c = [i_dec[i] for i in range(len(i_mag)) if (stars_circ[i])]
-    i_rad_c = [i_rad[i] for i in range(len(i_mag)) if (stars_circ[i])]
-    i_decd_c = [i_decd[i] for i in range(len(i_mag)) if (stars_circ[i])]
-    i_x_c = [ix[i] for i in range(len(i_mag)) if (stars_circ[i])]
-    i_y_c = [iy[i] for i in range(len(i_mag)) if (stars_circ[i])]
+    i_mag_c, gmi_c, i_ra_c, i_dec_c, i_rad_c, i_decd_c, i_x_c, i_y_c = select(cat, stars_circ, 'i_mag', 'gmi', 'i_ra', 'i_dec', 'i_rad', 'i_decd', 'ix', 'iy')
 
     # f2 = open(circ_file, 'w+')
     # for i in range(len(i_x_c)) :
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Masked regions (bright stars, galaxies, ...) from mask.reg, and the sources that fall in them (uchvc, completeness)
+
+    boxes = read_regions('mask.reg')                    # parsed once into arrays
+    keep = ~in_boxes(boxes, x, y)                       # one pass over the whole catalog
+    select_apphot('AGC249525_g.fits.mag.1', 'AGC249525_g.fits.mag.1a', boxes)
+
+A region file is read by one of the parsers in parsers, picked from its contents:
+IRAF PROS exports ("box x y width height angle" lines, what the scripts ask for) or
+ds9's own format ("box(x,y,width,height,angle)" in image coordinates). Both give the
+boxes as integer pixel limits x1, x2, y1, y2, truncated the way the old pselect
+expressions truncated them, so a source is masked if x1 <= x <= x2 and y1 <= y <= y2.
+Box angles are ignored, as they were.
+
+in_boxes() looks the sources up in a boolean raster of the boxes on the grid of their
+distinct edges, so the cost is a binary search per source whatever the number of boxes.
+
+select_apphot() does what the pselect passes did for an apphot/daophot text database
+(.mag.1, .art): it keeps the header, drops records with INDEF in the required fields
+and records centred in a box, and writes the rest out unchanged.
+"""
+import os
+import re
+import numpy as np
+
+_replace = getattr(os, 'replace', os.rename)
+_number = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eEdD][-+]?\d+)?'
+
+def _box_limits(xc, yc, w, h):
+    # the integer limits the old pselect expressions used: repr(int(xc - w/2.)) etc.
+    xc, yc, w, h = [np.asarray(a, dtype=float) for a in (xc, yc, w, h)]
+    lims = [np.trunc(v) for v in (xc - w/2., xc + w/2., yc - h/2., yc + h/2.)]
+    return np.array(lims).reshape(4, -1)
+
+def parse_pros(lines):
+    # IRAF PROS boxes: [coordsys;] box x y width height [angle]
+    rows = []
+    for line in lines:
+        tok = line.replace(';', ' ; ').split()
+        if 'box' in tok:
+            k = tok.index('box')
+            rows.append([float(v) for v in tok[k+1:k+5]])
+    return rows
+
+def parse_ds9(lines):
+    # ds9 boxes in image coordinates: box(x,y,width,height[,angle]); exclusions (-box) too
+    rows = []
+    for line in lines:
+        for m in re.finditer(r'box\s*\(([^)]*)\)', line.split('#')[0]):
+            vals = re.findall(_number, m.group(1))
+            if len(vals) >= 4:
+                rows.append([float(v) for v in vals[:4]])
+    return rows
+
+parsers = {'pros':parse_pros, 'ds9':parse_ds9}
+
+def region_format(lines):
+    # 'ds9' for ds9's own format, 'pros' otherwise
+    text = '\n'.join(lines)
+    if 'Region file format: DS9' in text or re.search(r'box\s*\(', text):
+        return 'ds9'
+    return 'pros'
+
+def read_regions(path, fmt=None):
+    # the boxes in a region file as an array of integer limits (4, nbox): x1, x2, y1, y2
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if fmt is None:
+        fmt = region_format(lines)
+    rows = np.array(parsers[fmt](lines), dtype=float).reshape(-1, 4)
+    return _box_limits(rows[:,0], rows[:,1], rows[:,2], rows[:,3])
+
+def in_boxes(boxes, x, y):
+    # mask of the sources (x, y) that fall in any box (limits inclusive)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    x1, x2, y1, y2 = boxes
+    if len(x1) == 0:
+        return np.zeros(x.shape, dtype=bool)
+    # box i covers the half-open cells [x1, next float above x2) on the edge grids
+    x2o, y2o = np.nextafter(x2, np.inf), np.nextafter(y2, np.inf)
+    ex, ey = np.unique(np.concatenate((x1, x2o))), np.unique(np.concatenate((y1, y2o)))
+    raster = np.zeros((len(ey), len(ex)), dtype=bool)
+    for i0, i1, j0, j1 in zip(np.searchsorted(ex, x1), np.searchsorted(ex, x2o), np.searchsorted(ey, y1), np.searchsorted(ey, y2o)):
+        raster[j0:j1, i0:i1] = True
+    ix = np.searchsorted(ex, x, side='right') - 1
+    iy = np.searchsorted(ey, y, side='right') - 1
+    inside = (ix >= 0) & (iy >= 0) & np.isfinite(x) & np.isfinite(y)
+    out = np.zeros(x.shape, dtype=bool)
+    out[inside] = raster[iy[inside], ix[inside]]
+    return out
+
+def read_textdb(path):
+    # an IRAF text database (apphot/daophot output): the header lines, the fields, and the
+    # records, each a list of its raw lines (a record runs on while lines end in \).
+    # each #N/#U/#F group of the header describes one line of a record, so a field is
+    # (name, line, start, end): its columns on that line, added up from the #F widths
+    # (the continuation indent is part of the first width). values are found by column
+    # as pselect found them, since a name that fills its width runs into the next field;
+    # without #F widths start is the field's word on the line and end is None
+    header, groups, records, current = [], [], [], []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                header.append(line)
+                if line.startswith('#N'):
+                    groups.append((line[2:].replace('\\', ' ').split(), []))
+                elif line.startswith('#F') and groups:
+                    groups[-1][1][:] = [int(w) for w in re.findall(r'%-?(\d+)', line)]
+                continue
+            if not line.strip():
+                continue
+            current.append(line)
+            if not line.rstrip().endswith('\\'):
+                records.append(current)
+                current = []
+    if current:
+        records.append(current)
+    fields = []
+    for k, (names, widths) in enumerate(groups):
+        if len(widths) == len(names):
+            ends = np.cumsum(widths)
+            fields += [(n, k, int(e - w), int(e)) for n, w, e in zip(names, widths, ends)]
+        else:
+            fields += [(n, k, j, None) for j, n in enumerate(names)]
+    return header, fields, records
+
+def _field(fields, name):
+    # a field, by full name or unique abbreviation (XCE -> XCENTER) as pselect allows
+    name = name.upper()
+    names = [f[0] for f in fields]
+    if name in names:
+        return fields[names.index(name)]
+    match = [f for f in fields if f[0].startswith(name)]
+    if not match:
+        raise KeyError('no field {:s} in {:s}'.format(name, ' '.join(names)))
+    return match[0]
+
+def textdb_columns(fields, records, *names):
+    # the named fields of every record as float arrays (INDEF -> nan); with several apertures
+    # the per-aperture fields are those of the first aperture, as MAG means MAG[1] to pselect
+    idx = [_field(fields, n) for n in names]
+    cols = [np.full(len(records), np.nan) for n in names]
+    for r, rec in enumerate(records):
+        for c, (name, line, start, end) in zip(cols, idx):
+            if line >= len(rec):
+                continue
+            if end is None:
+                val = rec[line].replace('\\', ' ').split()[start:start+1]
+            else:
+                val = [rec[line][start:end]]
+            try:
+                c[r] = float(val[0])
+            except (ValueError, IndexError):
+                pass
+    return cols
+
+def select_apphot(in_file, out_file, boxes=None, require=('MAG',), xfield='XCENTER', yfield='YCENTER'):
+    # copy the records of in_file whose require fields aren't INDEF and whose centre isn't
+    # in any of the boxes to out_file (written atomically); returns the number kept
+    header, fields, records = read_textdb(in_file)
+    keep = np.ones(len(records), dtype=bool)
+    for col in textdb_columns(fields, records, *require):
+        keep &= np.isfinite(col)
+    if boxes is not None:
+        x, y = textdb_columns(fields, records, xfield, yfield)
+        keep &= ~in_boxes(boxes, x, y)
+    tmp = '{:s}.{:d}.tmp'.format(out_file, os.getpid())
+    with open(tmp, 'w') as f:
+        f.writelines(header)
+        for rec, k in zip(records, keep):
+            if k:
+                f.writelines(rec)
+    _replace(tmp, out_file)
+    return int(keep.sum())
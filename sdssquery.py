@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+SDSS SkyServer SQL queries with an on-disk response cache (download_sdss, downloadSDSSgal)
+
+    text = fetch(qry)                       # the csv response, from the cache if we've run qry before
+    fetch_to('AGC249525_g.sdss', qry)       # ...or written to a file, one line per row
+
+Responses are kept gzipped in cache_dir, one file per (SQL, URL, format), named by
+the sha1 of the three, so asking the same question again (re-running the calibration
+on a field, the star and galaxy catalogs of the same image, ...) never goes back to
+the server. Responses stream straight into the cache and land there with an atomic
+rename, so an interrupted download or a parallel run never leaves half a file.
+
+Requests time out after timeout seconds and are retried up to retries times, waiting
+backoff, 2*backoff, 4*backoff... seconds in between. Error responses from the server
+("ERROR..." on the first line) are reported and not cached.
+
+The network request itself goes through the transport function
+transport(url, params, timeout) -> binary file object, so a local stand-in server
+(just a different url) or a directory of saved responses (directory_transport) can
+take the place of SkyServer.
+"""
+import os
+import sys
+import time
+import gzip
+import hashlib
+
+public_url = 'http://skyserver.sdss3.org/public/en/tools/search/x_sql.aspx'
+default_url = public_url
+default_fmt = 'csv'
+
+cache_dir = os.environ.get('UCHVC_SDSSCACHE', os.path.join(os.environ.get('HOME', '.'), '.uchvc_sdsscache'))
+timeout = 60.0          # seconds per request
+retries = 4             # further attempts after the first one fails
+backoff = 2.0           # seconds before the first retry, doubling after that
+chunk = 1<<16           # bytes streamed into the cache at a time
+
+_replace = getattr(os, 'replace', os.rename)
+
+def filtercomment(sql):
+    "Get rid of comments starting with --"
+    fsql = ''
+    for line in sql.split('\n'):
+        fsql += line.split('--')[0] + ' ' + os.linesep;
+    return fsql
+
+def cache_key(sql, url=default_url, fmt=default_fmt):
+    # sha1 of what gets sent: the query (without comments), the server, and the format
+    return _key(filtercomment(sql), url, fmt)
+
+def _key(fsql, url, fmt):
+    h = hashlib.sha1()
+    for part in (fsql, url, fmt):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def http_transport(url, params, timeout):
+    # the default transport: a GET to the SkyServer SQL search page
+    import urllib.request, urllib.parse
+    return urllib.request.urlopen(url+'?%s' % urllib.parse.urlencode(params), timeout=timeout)
+
+def directory_transport(directory):
+    # a transport that answers from saved responses, <directory>/<cache_key>.<format>
+    # (plain or .gz), instead of the network, e.g. for tests or offline reruns
+    def transport(url, params, timeout):
+        name = os.path.join(directory, '{:s}.{:s}'.format(_key(params['cmd'], url, params['format']), params['format']))
+        if os.path.isfile(name + '.gz'):
+            return gzip.open(name + '.gz', 'rb')
+        if not os.path.isfile(name):
+            # like a 404, so it isn't retried
+            err = IOError('no saved response {:s}'.format(name))
+            err.code = 404
+            raise err
+        return open(name, 'rb')
+    return transport
+
+transport = http_transport
+
+def _cache_file(key):
+    return os.path.join(cache_dir, key[:2], key + '.gz')
+
+def _download(sql, url, fmt, path):
+    # stream the response into path (gzipped) through a temporary file; True if it was a
+    # result, False if the server answered with an error (which goes to stderr instead)
+    if not os.path.isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+    tmp = '{:s}.{:d}.tmp'.format(path, os.getpid())
+    response = transport(url, {'cmd': filtercomment(sql), 'format': fmt}, timeout)
+    try:
+        first = response.read(chunk)
+        if first.lstrip().startswith(b'ERROR'): # SQL Statement Error -> stderr
+            sys.stderr.write((first + response.read()).decode('utf-8', 'replace'))
+            return False
+        with gzip.open(tmp, 'wb') as out:
+            data = first
+            while data:
+                out.write(data)
+                data = response.read(chunk)
+        _replace(tmp, path)
+    finally:
+        response.close()
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+    return True
+
+def fetch(sql, url=default_url, fmt=default_fmt, refresh=False):
+    # the response to sql as text, from the cache unless refresh or it isn't there yet.
+    # raises IOError if the server reports an error or can't be reached after the retries
+    path = _cache_file(cache_key(sql, url, fmt))
+    if refresh or not os.path.isfile(path):
+        for attempt in range(retries+1):
+            try:
+                result = _download(sql, url, fmt, path)
+            except (IOError, OSError) as e:
+                # timeouts, dropped connections and server errors are worth another go; HTTP
+                # errors below 500 (a bad request etc.) won't get better
+                if attempt == retries or getattr(e, 'code', 500) < 500:
+                    raise
+                print('SDSS query failed ({:s}), retrying in {:3.0f} s'.format(str(e), backoff*2**attempt))
+                time.sleep(backoff*2**attempt)
+                continue
+            if not result:
+                raise IOError('SDSS query returned an error (see above)')
+            break
+    with gzip.open(path, 'rb') as f:
+        return f.read().decode('utf-8')
+
+def fetch_to(out_file, sql, url=default_url, fmt=default_fmt, refresh=False):
+    # write the response to out_file, one line per row (written atomically, so out_file
+    # only ever exists complete); returns out_file
+    text = fetch(sql, url, fmt, refresh=refresh)
+    tmp = '{:s}.{:d}.tmp'.format(out_file, os.getpid())
+    with open(tmp, 'w') as ofp:
+        for line in text.splitlines():
+            ofp.write(line.rstrip()+os.linesep)
+    _replace(tmp, out_file)
+    return out_file
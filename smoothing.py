@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Gaussian smoothing of the star-count grids (grid_smooth, the distfit Monte Carlo, psmap...)
+
+smooth(grid, sigma) gives the same result as
+ndimage.gaussian_filter(grid, sigma, mode='constant', cval=0), with the same normalised
+kernel cut off at truncate*sigma, from one of several engines:
+
+    direct  ndimage.gaussian_filter itself (separable 1d passes)
+    matrix  the 1d passes as products with banded smoothing matrices (BLAS)
+    fft     zero-padded FFT convolution; the kernel transform is kept per grid shape and
+            sigma, so repeated maps of the same size only transform the grid
+    auto    time the engines on the first grid of each shape/sigma/batch and keep the fastest
+
+The engine is picked with the module setting engine (or the UCHVC_SMOOTH environment
+variable), and truncate sets where the kernel is cut off for all of them. grid can also be
+a stack of grids (..., h, w), which is smoothed along the last two axes in one go. Run this
+file to time the engines on typical grid sizes.
+"""
+import os
+import time
+import numpy as np
+try :
+    from scipy import ndimage
+except ImportError :
+    from stsci import ndimage
+try :
+    from scipy import fft as _fft
+except ImportError :
+    from numpy import fft as _fft
+
+engine = os.environ.get('UCHVC_SMOOTH', 'auto')
+truncate = 4.0          # kernel cut off at truncate*sigma, as in gaussian_filter
+engines = ['direct', 'matrix', 'fft']
+
+_matrices = {}          # (npix, sigma, truncate) -> smoothing matrix
+_kernels = {}           # (shape, sigma, truncate) -> (fft shape, kernel transform)
+_best = {}              # (stack?, grid shape, sigma, truncate) -> fastest engine
+
+def _kernel1d(sig, trunc):
+    # gaussian_filter's kernel: normalised, out to int(truncate*sigma + 0.5) pixels
+    r = int(trunc*sig + 0.5)
+    kern = np.exp(-0.5*(np.arange(-r,r+1)/float(sig))**2)
+    return kern/kern.sum(), r
+
+def gauss_matrix(npix, sig, trunc=None):
+    # 1d smoothing along an axis of length npix as a matrix, with zero-padded edges
+    if trunc is None:
+        trunc = truncate
+    key = (npix, sig, trunc)
+    if key not in _matrices:
+        kern, r = _kernel1d(sig, trunc)
+        off = np.arange(npix)[None,:] - np.arange(npix)[:,None]
+        near = np.abs(off) <= r
+        gmat = np.zeros((npix,npix))
+        gmat[near] = kern[off[near]+r]
+        _matrices[key] = gmat
+    return _matrices[key]
+
+def _direct(grid, sy, sx, trunc):
+    sigma = (0,)*(grid.ndim-2) + (sy, sx)
+    return ndimage.gaussian_filter(grid, sigma, mode='constant', cval=0, truncate=trunc)
+
+def _matrix(grid, sy, sx, trunc):
+    h, w = grid.shape[-2:]
+    return np.matmul(np.matmul(gauss_matrix(h, sy, trunc), grid), gauss_matrix(w, sx, trunc).T)
+
+def _fft_conv(grid, sy, sx, trunc):
+    h, w = grid.shape[-2:]
+    key = ((h, w), (sy, sx), trunc)
+    if key not in _kernels:
+        ky, ry = _kernel1d(sy, trunc)
+        kx, rx = _kernel1d(sx, trunc)
+        # circular convolution of length >= n+r only wraps onto the padding, never onto the grid.
+        # the kernel goes in centred on pixel 0 (negative offsets wrap to the end)
+        shape = (_next_fast_len(h+ry), _next_fast_len(w+rx))
+        kern = np.zeros(shape)
+        kern[np.arange(-ry,ry+1)[:,None] % shape[0], np.arange(-rx,rx+1)[None,:] % shape[1]] = np.outer(ky, kx)
+        _kernels[key] = (shape, _fft.rfft2(kern))
+    shape, kern_f = _kernels[key]
+    return _fft.irfft2(_fft.rfft2(grid, s=shape)*kern_f, s=shape)[..., :h, :w]
+
+def _next_fast_len(n):
+    if hasattr(_fft, 'next_fast_len'):
+        return _fft.next_fast_len(n)
+    # numpy.fft: round up to 2^a 3^b 5^c
+    best = 2*n
+    p2 = 1
+    while p2 < best:
+        p3 = p2
+        while p3 < best:
+            p5 = p3
+            while p5 < n:
+                p5 *= 5
+            best = min(best, p5)
+            p3 *= 3
+        p2 *= 2
+    return best
+
+_run = {'direct':_direct, 'matrix':_matrix, 'fft':_fft_conv}
+
+def pick_engine(shape, sigma, trunc=None, repeat=3):
+    # micro-benchmark: time every engine on a random grid of this shape, keep the fastest.
+    # stacks are timed on (up to) 8 grids, and share the choice whatever their length
+    if trunc is None:
+        trunc = truncate
+    sy, sx = (sigma, sigma) if np.ndim(sigma) == 0 else sigma
+    stack = len(shape) > 2
+    key = (stack, tuple(shape[-2:]), (sy, sx), trunc)
+    if key not in _best:
+        size = ((min(int(np.prod(shape[:-2])), 8),) if stack else ()) + tuple(shape[-2:])
+        grid = np.random.RandomState(0).poisson(1.0, size=size).astype(float)
+        times = {}
+        for name in engines:
+            _run[name](grid, sy, sx, trunc)        # first call builds the cached kernels/matrices
+            t0 = time.time()
+            for i in range(repeat):
+                _run[name](grid, sy, sx, trunc)
+            times[name] = (time.time()-t0)/repeat
+        _best[key] = min(engines, key=lambda name: times[name])
+    return _best[key]
+
+def smooth(grid, sigma, mode='constant', engine=None, trunc=None):
+    # gaussian_filter(grid, sigma, mode='constant', cval=0) over the last two axes of grid.
+    # sigma is one value or (sigma_y, sigma_x); other modes always go to ndimage
+    grid = np.asarray(grid, dtype=float)
+    if trunc is None:
+        trunc = truncate
+    if mode != 'constant':
+        return ndimage.gaussian_filter(grid, sigma, mode=mode, truncate=trunc)
+    sy, sx = (sigma, sigma) if np.ndim(sigma) == 0 else sigma
+    if engine is None:
+        engine = globals()['engine']
+    if engine == 'auto':
+        engine = pick_engine(grid.shape, (sy, sx), trunc)
+    return _run[engine](grid, sy, sx, trunc)
+
+def benchmark(shapes=((150,150),(165,165),(200,150,150)), fwhms=(1.0,2.0,3.0,6.0), width=20., repeat=5):
+    # print the time per smoothing for each engine, grid (or stack) shape and fwhm (arcmin over
+    # a width-arcmin field), and the difference from gaussian_filter
+    for shape in shapes:
+        for fwhm in fwhms:
+            sig = ((shape[-1]/width)*fwhm)/2.355
+            grid = np.random.RandomState(0).poisson(1.0, size=shape).astype(float)
+            ref = _direct(grid, sig, sig, truncate)
+            line = '{:>16s} fwhm={:3.1f} sig={:5.2f}:'.format('x'.join(str(n) for n in shape), fwhm, sig)
+            for name in engines:
+                out = _run[name](grid, sig, sig, truncate)
+                t0 = time.time()
+                for i in range(repeat):
+                    _run[name](grid, sig, sig, truncate)
+                line += ' {:s} {:8.3f} ms ({:.0e})'.format(name, 1000.*(time.time()-t0)/repeat, np.abs(out-ref).max())
+            print(line)
+
+if __name__ == "__main__":
+    benchmark()
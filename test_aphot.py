@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# checks for the numpy aperture photometry in aphot: run with python -m pytest test_aphot.py
+# IRAF isn't installed here, so the expected numbers are worked out by hand from what
+# apphot.phot does (centroid, median sky, fractional pixel apertures, the phot mag/merr
+# formulas) on an image simple enough for that
+import numpy as np
+import pytest
+
+import aphot
+
+size = 61
+x0 = y0 = 31                # star centre, IRAF pixel coordinates
+sky = 100.
+gain, itime, zmag = 2.0, 300., 25.
+annulus, dannulus = 10., 5.
+header = {'gain':gain, 'exptime':itime}
+
+def _image():
+    # a 3x3 star of 4000 counts (1000 in the middle, 500 at the sides, 250 at the corners)
+    # on a flat sky, with 97/100/103 in turn on every pixel further out than the apertures
+    # reach, so the sky annulus has median 100 and a spread small enough to reject nothing
+    yy, xx = np.mgrid[1:size+1, 1:size+1]
+    r = np.hypot(xx - x0, yy - y0)
+    data = np.full((size, size), sky)
+    out = r > 6.5
+    data[out] += 3.*((xx + yy)[out] % 3 - 1)
+    data[y0-2:y0+1, x0-2:x0+1] += [[250., 500., 250.], [500., 1000., 500.], [250., 500., 250.]]
+    return data, r
+
+def _sky_pixels(data, r):
+    return data[(r >= annulus) & (r <= annulus + dannulus)]
+
+def _phot(data, xin=x0 - 0.4, yin=y0 + 0.3, apertures=(0.5, 1.5, 3., 5.5), **kw):
+    return aphot.phot(data, ([xin], [yin]), list(apertures), annulus, dannulus=dannulus, zmag=zmag, header=header, **kw)
+
+def test_centre():
+    # symmetric star: the centroid lands on it from anywhere inside maxshift
+    data, r = _image()
+    for xin, yin in ((x0 - 0.4, y0 + 0.3), (x0 + 1.2, y0 - 0.8)):
+        ph = _phot(data, xin, yin)
+        assert ph['xcen'][0] == pytest.approx(x0, abs=1e-12)
+        assert ph['ycen'][0] == pytest.approx(y0, abs=1e-12)
+        assert ph['cier'][0] == 0
+
+def test_sky():
+    data, r = _image()
+    pix = _sky_pixels(data, r)
+    assert (pix == 97.).sum() < len(pix)/2. and (pix == 103.).sum() < len(pix)/2.
+    ph = _phot(data)
+    assert ph['msky'][0] == 100.
+    assert ph['nsky'][0] == len(pix)
+    assert ph['stdev'][0] == pytest.approx(pix.std(ddof=1), rel=1e-12)
+
+def test_sums_and_areas():
+    # pixels count with max(0, min(1, r_ap - r + 0.5))
+    data, r = _image()
+    ph = _phot(data)
+    diag = 1.5 + 0.5 - np.sqrt(2.)
+    areas = [1., 5. + 4*diag, np.clip(3.5 - r, 0., 1.).sum(), np.clip(6. - r, 0., 1.).sum()]
+    stars = [1000., 1000. + 4*500. + 4*diag*250., 4000., 4000.]
+    assert ph['area'][0] == pytest.approx(areas, rel=1e-12)
+    assert ph['sum'][0] == pytest.approx([s + sky*a for s, a in zip(stars, areas)], rel=1e-12)
+    assert ph['flux'][0] == pytest.approx(stars, rel=1e-12)
+
+def test_mag_and_merr():
+    data, r = _image()
+    ph = _phot(data)
+    stdev = _sky_pixels(data, r).std(ddof=1)
+    nsky = ph['nsky'][0]
+    for j, area in enumerate(ph['area'][0]):
+        flux = ph['flux'][0][j]
+        mag = zmag - 2.5*np.log10(flux) + 2.5*np.log10(itime)
+        merr = 1.0857*np.sqrt(flux/gain + area*stdev**2 + area**2*stdev**2/nsky)/flux
+        assert ph['mag'][0][j] == pytest.approx(mag, abs=1e-10)
+        assert ph['merr'][0][j] == pytest.approx(merr, rel=1e-10)
+    assert ph['mag'][0][3] == pytest.approx(25. - 2.5*np.log10(4000./300.), abs=1e-10)
+
+def test_indef():
+    # saturated pixels and apertures off the image give INDEF in the apertures that reach them
+    data, r = _image()
+    ph = _phot(data, datamax=900.)
+    assert np.isnan(ph['mag'][0]).all() and np.isnan(ph['merr'][0]).all()
+    data[y0-1, x0+4] = 60000.
+    ph = _phot(data)
+    assert np.isfinite(ph['mag'][0][:3]).all() and np.isnan(ph['mag'][0][3])
+    ph = aphot.phot(data, ([3.], [30.]), [5.5], annulus, dannulus=dannulus, zmag=zmag, header=header, centroid=False)
+    assert np.isnan(ph['mag'][0]).all()
+    assert aphot.txdump_rows(ph, require=('mag', 'merr')) == []
+
+def test_matches_direct():
+    # the batched code against the one star at a time reference, on noisy stars
+    rng = np.random.RandomState(4)
+    data = rng.normal(sky, 5., (200, 200))
+    x, y = rng.uniform(20, 180, 25), rng.uniform(20, 180, 25)
+    yy, xx = np.mgrid[1:201, 1:201]
+    for xs, ys in zip(x, y):
+        data += 3000./(2*np.pi*1.5**2)*np.exp(-0.5*((xx - xs)**2 + (yy - ys)**2)/1.5**2)
+    aps = [2., 4.5]
+    ph = aphot.phot(data, (x, y), aps, annulus, dannulus=dannulus, header=header, datamax=None)
+    for k in range(len(x)):
+        xc, yc, med, std, nsk, sums, areas = aphot._direct(data, x[k], y[k], aps, annulus, dannulus, hi_data=None)
+        assert (ph['xcen'][k], ph['ycen'][k]) == pytest.approx((xc, yc), abs=1e-9)
+        assert (ph['msky'][k], ph['stdev'][k], ph['nsky'][k]) == pytest.approx((med, std, nsk), rel=1e-9)
+        assert ph['sum'][k] == pytest.approx(sums, rel=1e-9)
+        assert ph['area'][k] == pytest.approx(areas, rel=1e-9)
+
+def _profile_image():
+    # a gaussian star (sigma 2, peak 1000), a moffat star (alpha 3, beta 3, peak 800) and a
+    # star too close to the edge for the profile out to rplot, on a flat sky of 100
+    yy, xx = np.mgrid[1:151, 1:151]
+    data = np.full((150, 150), sky)
+    r2 = (xx - 40.3)**2 + (yy - 50.6)**2
+    data += 1000.*np.exp(-0.5*r2/2.**2)
+    data += 800.*(1. + ((xx - 100.)**2 + (yy - 90.)**2)/3.**2)**-3.
+    data += 500.*np.exp(-0.5*((xx - 4.)**2 + (yy - 120.)**2)/2.**2)
+    return data, r2
+
+def test_radprof_gaussian():
+    data, r2 = _profile_image()
+    prof = aphot.radprof(data, ([40.3, 100., 4.], [50.6, 90., 120.]))
+    fwhm = 2.*np.sqrt(2.*np.log(2.))*2.
+    assert (prof['xcen'][0], prof['ycen'][0]) == pytest.approx((40.3, 50.6), abs=0.1)
+    assert prof['sky'][0] == pytest.approx(sky, abs=0.5)
+    assert prof['fwhm'][0] == pytest.approx(fwhm, rel=0.01)
+    assert prof['peak'][0] == pytest.approx(1000., rel=0.01)
+    # half the flux inside rplot is at the half width of a gaussian
+    assert prof['enclosed'][0] == pytest.approx(fwhm, abs=0.3)
+    assert prof['mag'][0] == pytest.approx(aphot.magzero - 2.5*np.log10((data - sky)[r2 <= 4.**2].sum()), abs=0.01)
+    assert prof['flag'][0] == 0
+    # off the image out to rplot: no fit
+    assert prof['flag'][2] & 1
+    assert np.isnan([prof['fwhm'][2], prof['peak'][2], prof['enclosed'][2]]).all()
+
+def test_radprof_moffat():
+    data, r2 = _profile_image()
+    prof = aphot.radprof(data, ([100.], [90.]), fittype='moffat')
+    assert prof['beta'][0] == 3.
+    assert prof['fwhm'][0] == pytest.approx(2.*3.*np.sqrt(2.**(1./3.) - 1.), rel=0.02)
+    assert prof['peak'][0] == pytest.approx(800., rel=0.02)
+
+def test_write_log_columns(tmp_path):
+    # the columns the log readers use: uchvc's getfwhm fwhm (13) and the aperture correction and
+    # escut mag/peak/enclosed (5, 8, 12) in 'imexam'; odi_calibrate's getfwhm fwhm (10) in 'calibrate'
+    data, r2 = _profile_image()
+    prof = aphot.radprof(data, ([40.3, 100., 4.], [50.6, 90., 120.]))
+    log = aphot.write_log(str(tmp_path / 'getfwhm.log'), prof, layout='imexam', indef='999')
+    x, y = np.loadtxt(log, usecols=(0,1), unpack=True)
+    mag, peak, enclosed, fwhm = np.loadtxt(log, usecols=(5,8,12,13), unpack=True)
+    assert x == pytest.approx(prof['xcen'], abs=1e-3) and y == pytest.approx(prof['ycen'], abs=1e-3)
+    assert mag[:2] == pytest.approx(prof['mag'][:2], abs=1e-3)
+    assert peak[:2] == pytest.approx(prof['peak'][:2], abs=0.05)
+    assert enclosed[:2] == pytest.approx(prof['enclosed'][:2], abs=0.005)
+    assert fwhm[:2] == pytest.approx(prof['fwhm'][:2], abs=0.005)
+    assert (peak[2], enclosed[2], fwhm[2]) == (999., 999., 999.)
+    log = aphot.write_log(str(tmp_path / 'fwhmCAL.log'), prof, layout='calibrate', indef='999')
+    fwhm = np.loadtxt(log, usecols=(10,), unpack=True)
+    assert fwhm[:2] == pytest.approx(prof['fwhm'][:2], abs=0.005)
+    assert fwhm[2] == 999.
+    assert 'INDEF' not in open(log).read()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# checks for the CMD filter selection in magfilter: run with python -m pytest test_magfilter.py
+import os
+import numpy as np
+import pytest
+
+import magfilter
+
+filter_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filter.txt')
+
+def _stars(n=3000, seed=1):
+    # synthetic stars spread over and around the filter at m-M = 24, errors up to 0.3 mag
+    rng = np.random.RandomState(seed)
+    gmi = rng.uniform(-1.0, 3.0, n)
+    i_mag = rng.uniform(18.0, 29.0, n)
+    gmi_err = rng.uniform(0.0, 0.3, n)
+    i_ierr = rng.uniform(0.0, 0.3, n)
+    return i_mag, i_ierr, gmi, gmi_err
+
+def _old_loop(i_mag, i_ierr, gmi, gmi_err, cm_filter, filter_sig=1):
+    # filter_sources as it was: every error bar sampled as points
+    stars_f = list(gmi)
+    for i in range(len(gmi)) :
+        nsteps_color = int(abs((float(filter_sig)*gmi_err[i])//0.001))
+        nsteps_mag = int(abs((float(filter_sig)*i_ierr[i])//0.001))
+        if nsteps_color == 0 :
+            nsteps_color = 1
+        if nsteps_mag == 0 :
+            nsteps_mag = 1
+        cm_points_l = [(gmi[i]-0.01*j*gmi_err[i],i_mag[i]) for j in range(nsteps_color)]
+        cm_points_r = [(gmi[i]+0.01*j*gmi_err[i],i_mag[i]) for j in range(nsteps_color)]
+        cm_points_u = [(gmi[i],i_mag[i]-0.01*j*i_ierr[i]) for j in range(nsteps_mag)]
+        cm_points_d = [(gmi[i],i_mag[i]+0.01*j*i_ierr[i]) for j in range(nsteps_mag)]
+        stars_f[i] = any(cm_filter.contains_points(cm_points_l)) | any(cm_filter.contains_points(cm_points_r)) | any(cm_filter.contains_points(cm_points_u)) | any(cm_filter.contains_points(cm_points_d))
+    return np.array(stars_f, dtype=bool)
+
+def _sampled(x, y, xerr, yerr, cm_filter, nsamp=4001):
+    # reference for errorbar_mask: both bars sampled finely
+    t = np.linspace(-1.0, 1.0, nsamp)
+    out = np.zeros(len(x), dtype=bool)
+    for k in range(len(x)):
+        pts = np.concatenate((np.column_stack((x[k] + t*xerr[k], np.full(nsamp, y[k]))),
+                              np.column_stack((np.full(nsamp, x[k]), y[k] + t*yerr[k]))))
+        out[k] = cm_filter.contains_points(pts).any()
+    return out
+
+def test_errorbar_mask_matches_sampled_bars():
+    i_mag, i_ierr, gmi, gmi_err = _stars(1000)
+    cm_filter = magfilter.make_filter(24.0, filter_file)[0]
+    exact = magfilter.errorbar_mask(gmi, i_mag, gmi_err, i_ierr, cm_filter)
+    assert np.array_equal(exact, _sampled(gmi, i_mag, gmi_err, i_ierr, cm_filter))
+
+def test_filter_sources_matches_old_loop():
+    i_mag, i_ierr, gmi, gmi_err = _stars()
+    cm_filter = magfilter.make_filter(24.0, filter_file)[0]
+    new = np.asarray(magfilter.filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter), dtype=bool)
+    old = _old_loop(i_mag, i_ierr, gmi, gmi_err, cm_filter)
+    assert old.any() and not old.all()
+    assert np.array_equal(new, old)
+
+def test_sigma_bars_reach_one_sigma():
+    i_mag, i_ierr, gmi, gmi_err = _stars(1000)
+    cm_filter = magfilter.make_filter(24.0, filter_file)[0]
+    new = np.asarray(magfilter.filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, legacy_bars=False), dtype=bool)
+    assert np.array_equal(new, _sampled(gmi, i_mag, gmi_err, i_ierr, cm_filter))
+
+@pytest.mark.parametrize('legacy_bars', [True, False])
+def test_dm_sweep_matches_filter_sources(legacy_bars):
+    i_mag, i_ierr, gmi, gmi_err = _stars()
+    cm_filter0 = magfilter.make_filter(0.0, filter_file)[0]
+    intervals = magfilter.filter_intervals(gmi, i_mag, magfilter.errorbar_lengths(gmi_err, legacy_bars=legacy_bars),
+                                           magfilter.errorbar_lengths(i_ierr, legacy_bars=legacy_bars), cm_filter0)
+    for dm in (22.0, 23.37, 24.0, 25.51):
+        cm_filter = magfilter.make_filter(dm, filter_file)[0]
+        direct = np.asarray(magfilter.filter_sources(i_mag, i_ierr, gmi, gmi_err, cm_filter, legacy_bars=legacy_bars), dtype=bool)
+        assert np.array_equal(magfilter.sweep_mask(intervals, len(i_mag), dm), direct)
+
+class _FixedCells(np.random.Generator):
+    # hands null_peaks a fixed set of star cells in place of its draw
+    def __init__(self, cells):
+        np.random.Generator.__init__(self, np.random.PCG64(0))
+        self.cells = list(cells)
+    def integers(self, low, high, size, dtype=np.int64):
+        return self.cells.pop(0).astype(dtype)
+
+@pytest.mark.parametrize('dense', [False, True])
+@pytest.mark.parametrize('n', [40, 600])
+def test_null_peaks_matches_gaussian_filter(n, dense, monkeypatch):
+    # the banded float32 smoothing against the histogram2d + gaussian_filter fields it replaced,
+    # through the sparse and the count cube first pass, with a short last batch
+    from scipy import ndimage
+    monkeypatch.setattr(magfilter, 'null_dense', 0.0 if dense else 1.0)
+    width, height, fwhm, m, batch = 10.0, 8.0, 1.5, 7, 3
+    bins_h, bins_w = int(height*60./8.), int(width*60./8.)
+    sig = ((bins_w/width)*fwhm)/2.355
+    cells = np.random.default_rng(n).integers(0, bins_h*bins_w, (m, n))
+    vals = magfilter.null_peaks(n, width, height, fwhm, m, batch=batch,
+                                rng=_FixedCells(cells[k:k+batch] for k in range(0, m, batch)))
+    for f in range(m):
+        grid = np.zeros((bins_h, bins_w))
+        np.add.at(grid, np.divmod(cells[f], bins_w), 1)
+        grid_gaus = ndimage.gaussian_filter(grid, sig, mode='constant', cval=0)
+        assert vals[f] == pytest.approx((grid_gaus.max()-grid_gaus.mean())/grid_gaus.std(), rel=1e-5)
+
+@pytest.mark.parametrize('method', ['mc', 'sequential'])
+def test_distfit_runs(method, tmp_path, monkeypatch):
+    # the Monte Carlo paths end to end on a small field, cached and not
+    monkeypatch.setattr(magfilter.nullcache, 'cache_dir', str(tmp_path))
+    for cache in (False, True, True):
+        pct, bins, centers = magfilter.distfit(60, 4.0, 'test', 5.0, 5.0, 1.0, 25.0, samples=300, cache=cache,
+                                               rng=np.random.RandomState(3), method=method)
+        assert 0.0 <= pct <= 100.0
+        assert bins.shape == centers.shape == (400,)
+        assert np.all(bins >= 0.0)
+
+def test_distfit_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        magfilter.distfit(60, 4.0, 'test', 5.0, 5.0, 1.0, 25.0, samples=100, cache=False, method='analytical')
+
+def test_bad_significance_option_exits():
+    with pytest.raises(SystemExit) as exc:
+        magfilter.main(['--significance=analytical'])
+    assert exc.value.code == 2
+
+def test_analytic_only_from_calibrated_n(tmp_path, monkeypatch):
+    # below the n the calibration vouches for (or with no calibration) analytic is the Monte Carlo
+    monkeypatch.setattr(magfilter, 'analytic_from', {})
+    def pct(n, method):
+        return magfilter.distfit(n, 4.0, 'test', 5.0, 5.0, 1.0, 25.0, samples=200, cache=False, method=method, seed=2)[0]
+    assert pct(30, 'analytic') == pct(30, 'mc')
+    report = magfilter.calibrate_significance(5.0, 5.0, 1.0, [20, 60], samples=200, rng=np.random.RandomState(1),
+                                              out_file=str(tmp_path / 'calibration.txt'))
+    found = dict(magfilter.analytic_from)
+    magfilter.analytic_from.clear()
+    assert magfilter.read_calibration(report) == found
+    magfilter.analytic_from[(5.0, 5.0, 1.0)] = 50
+    assert pct(30, 'analytic') == pct(30, 'mc')
+    assert pct(60, 'analytic') == pytest.approx(float(magfilter.analytic_pct(60, 4.0, 5.0, 5.0, 1.0)))
+
+def _old_himap(a, b, pa, hi_c_x, hi_c_y, height, width):
+    # getHIcoincidence's map as it was: one point histogrammed, smoothed and rotated about its pixel
+    from scipy import ndimage
+    bins_h, bins_w = int(height*60./8.), int(width*60./8.)
+    grid = np.histogram2d([hi_c_y], [hi_c_x], bins=[bins_h, bins_w], range=[[0, height], [0, width]])[0]
+    pivot = np.unravel_index(grid.argmax(), grid.shape)
+    grid_gaus = ndimage.gaussian_filter(grid, ((bins_w/width)*a/2.355, (bins_w/width)*b/2.355), mode='nearest')
+    return magfilter.rotateImage(grid_gaus/grid_gaus.max(), -pa, [pivot[-1], pivot[0]])
+
+def _axis_angle(grid):
+    # position angle of the long axis of a map, from its second moments
+    w = np.clip(grid, 0, None)
+    r, c = np.indices(grid.shape)
+    r, c = r - (w*r).sum()/w.sum(), c - (w*c).sum()/w.sum()
+    return np.degrees(0.5*np.arctan2(2*(w*r*c).sum(), (w*r*r).sum() - (w*c*c).sum()))
+
+def _himap(a, b, pa, monkeypatch, height=20.0, width=20.0):
+    # the HI centroid on a pixel centre, so the old map's pivot is the centroid itself
+    pix = height/int(height*60./8.)
+    hi_c_x, hi_c_y = 75.5*pix, 60.5*pix
+    monkeypatch.setattr(magfilter, '_hi_maps', {})
+    monkeypatch.setattr(magfilter.hicatalog, 'lookup', lambda obj: {'ra':hi_c_x/60., 'dec':hi_c_y/60., 'a':a, 'b':b, 'pa':pa})
+    return magfilter.HImap('test', 0.0, 0.0, height, width)[0], _old_himap(a, b, pa, hi_c_x, hi_c_y, height, width)
+
+@pytest.mark.parametrize('b', [1.5, 0.0])
+@pytest.mark.parametrize('pa', [0.0, 30.0, 60.0, 120.0])
+def test_himap_matches_rotated_image(pa, b, monkeypatch):
+    grid_rot, old = _himap(3.0, b, pa, monkeypatch)
+    assert grid_rot[60, 75] == pytest.approx(1.0)
+    assert _axis_angle(grid_rot) == pytest.approx(_axis_angle(old), abs=0.5)
+    if pa % 90.:
+        assert _axis_angle(grid_rot) != pytest.approx(_axis_angle(_himap(3.0, b, -pa, monkeypatch)[1]), abs=10.)
+    if b:
+        assert np.abs(grid_rot - old).max() < 0.1
+
+def test_himap_point_source(monkeypatch):
+    # a and b both 0: 1 at the centroid pixel and 0 everywhere else, as the old map
+    grid_rot, old = _himap(0.0, 0.0, 30.0, monkeypatch)
+    assert np.isfinite(grid_rot).all()
+    assert grid_rot[60, 75] == 1.0 and np.count_nonzero(grid_rot) == 1
+    assert np.unravel_index(old.argmax(), old.shape) == (60, 75)
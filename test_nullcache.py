@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# checks for the distfit null-distribution cache: run with python -m pytest test_nullcache.py
+import numpy as np
+import pytest
+from scipy.stats import lognorm
+
+import nullcache
+import magfilter
+
+geometry = (20.0, 20.0, 2.0, 1000)     # width, height, fwhm, samples
+
+# two neighbouring fits whose parameters average to a distribution unlike either of them
+# (shape and scale trade off against each other, as in real lognormal fits to the peaks)
+fit_lo = (0.05, -10.0, 14.0)
+fit_hi = (0.6, 2.5, 1.5)
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(nullcache, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(nullcache, '_count', None)
+    for n, (al, loc, beta) in ((100, fit_lo), (102, fit_hi)):
+        nullcache.store(n, *geometry, vals=np.zeros(10), al=al, loc=loc, beta=beta, bins=np.full(400, n, dtype=float))
+    return tmp_path
+
+def _pct(n, dists):
+    width, height, fwhm, samples = geometry
+    return magfilter.distfit(n, dists, 'test', width, height, fwhm, 25.0, samples=samples)
+
+def test_exact_hit(cache):
+    al, loc, beta, bins = nullcache.lookup(100, *geometry)
+    assert (al, loc, beta) == fit_lo
+    assert nullcache.lookup(101, *geometry) is None
+
+@pytest.mark.parametrize('dists', [3.5, 4.5, 5.0, 6.0])
+def test_interpolated_percentile_between_neighbours(cache, dists):
+    lo, hi = _pct(100, dists)[0], _pct(102, dists)[0]
+    pct, bins, centers = _pct(101, dists)
+    assert min(lo, hi) <= pct <= max(lo, hi)
+    assert np.allclose(bins, 101.0)
+    # averaging the parameters instead lands outside the neighbours here
+    al, loc, beta = [(a + b)/2. for a, b in zip(fit_lo, fit_hi)]
+    assert not (min(lo, hi) <= 100.0*lognorm.cdf(dists, al, loc=loc, scale=beta) <= max(lo, hi))
+
+def test_far_n_is_a_miss(cache):
+    assert nullcache.bracket(101, *geometry) is not None
+    assert nullcache.bracket(99, *geometry) is None
+    assert nullcache.bracket(150, *geometry) is None
+
+def test_frozen_cache_mixes_only_old_entries(cache):
+    # during a scan an exact entry stored by another step is used (seeded entries are the same
+    # whoever writes them), but which neighbours exist mustn't depend on what was stored meanwhile
+    snap = nullcache.freeze()
+    try:
+        before = _pct(101, 4.5)[0]
+        nullcache.store(101, *geometry, vals=np.zeros(10), al=1.0, loc=0.0, beta=3.0, bins=np.zeros(400))
+        nullcache.store(103, *geometry, vals=np.zeros(10), al=1.0, loc=0.0, beta=3.0, bins=np.zeros(400))
+        assert nullcache.lookup(101, *geometry)[:3] == (1.0, 0.0, 3.0)
+        assert _pct(101, 4.5)[0] != before
+        assert 103 not in nullcache._cached_ns(nullcache._geom_dir(*geometry))
+    finally:
+        nullcache.thaw()
+    assert 101 not in snap[list(snap)[0]]
+    assert 103 in nullcache._cached_ns(nullcache._geom_dir(*geometry))
+
+def test_seeded_entry_is_the_same_from_any_step(tmp_path, monkeypatch):
+    # the entry for an n is seeded from (seed, n, geometry), not from the step that stores it
+    stored = []
+    for k, (dists, dm) in enumerate(((3.0, 23.0), (9.0, 25.5))):
+        monkeypatch.setattr(nullcache, 'cache_dir', str(tmp_path / str(k)))
+        monkeypatch.setattr(nullcache, '_count', None)
+        if k:
+            magfilter.distfit(70, 5.0, 'test', 5.0, 5.0, 1.0, 24.0, samples=200, seed=11)
+        magfilter.distfit(60, dists, 'test', 5.0, 5.0, 1.0, dm, samples=200, seed=11)
+        with np.load(nullcache._entry(nullcache._geom_dir(5.0, 5.0, 1.0, 200), 60)) as d:
+            stored.append(d['vals'].copy())
+    assert np.array_equal(stored[0], stored[1])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# checks for the region masking and text database reading in regions: run with
+# python -m pytest test_regions.py
+# the .mag.1 files are laid out as apphot.phot writes them: a #N/#U/#F group per record
+# line, values left justified in their #F widths (names cut to fit, so a long one runs
+# straight into the next field), continuation lines indented by 3 and ended by \, and
+# the last group repeated for every aperture
+import re
+
+import numpy as np
+import pytest
+
+import regions
+
+groups = [
+    ('IMAGE XINIT YINIT ID COORDS LID', '%-23s %-10.3f %-10.3f %-6d %-23s %-6d'),
+    ('XCENTER YCENTER XSHIFT YSHIFT XERR YERR CIER CERROR', '%-14.3f %-11.3f %-8.3f %-8.3f %-8.3f %-15.3f %-5d %-9s'),
+    ('MSKY STDEV SSKEW NSKY NSREJ SIER SERROR', '%-18.7g %-15.7g %-15.7g %-7d %-9d %-5d %-9s'),
+    ('ITIME XAIRMASS IFILTER OTIME', '%-18.7g %-15.7g %-23s %-23s'),
+    ('RAPERT SUM AREA FLUX MAG MERR PIER PERROR', '%-12.2f %-14.7g %-11.7g %-14.7g %-7.3f %-6.3f %-5d %-9s'),
+]
+
+def _value(fmt, v):
+    # a value the way phot prints it: INDEF in place of a missing number, cut to its width
+    width = int(re.match(r'%-(\d+)', fmt).group(1))
+    if v is None:
+        fmt, v = '%-{:d}s'.format(width), 'INDEF'
+    return (fmt % v)[:width]
+
+def _line(k, vals, last):
+    # the indent of a continuation line counts in the width of its first field
+    fmts = groups[k][1].split()
+    indent = ''
+    if k > 0:
+        width = int(re.match(r'%-(\d+)', fmts[0]).group(1))
+        fmts[0] = fmts[0].replace(str(width), str(width - 3), 1)
+        indent = '   '
+    text = indent + ''.join(_value(f, v) for f, v in zip(fmts, vals))
+    return text + ('*' if last else '\\') + '\n'
+
+def _header():
+    head = []
+    for names, fmts in groups:
+        cols = [max(len(n), int(re.match(r'%-(\d+)', f).group(1))) for n, f in zip(names.split(), fmts.split())]
+        for tag, words in (('#N', names.split()), ('#U', ['##']*len(cols)), ('#F', fmts.split())):
+            head.append(tag + ' ' + ''.join(w.ljust(c) for w, c in zip(words, cols)) + '\\\n')
+        head.append('#\n')
+    return head
+
+def _record(image, coords, ident, xy, mags):
+    # one star: its centre and (mag, merr) in each aperture, None for INDEF
+    x, y = xy
+    lines = [
+        _line(0, (image, x - 0.4, y + 0.3, ident, coords, ident), False),
+        _line(1, (x, y, 0.4, -0.3, 0.012, 0.011, 0, 'NoError'), False),
+        _line(2, (88.36107, 1.927853, 0.06117654, 293, 12, 0, 'NoError'), False),
+        _line(3, (300., 1.172, 'odi_g', 'INDEF'), False),
+    ]
+    for k, (mag, merr) in enumerate(mags):
+        flux = None if mag is None else 10**(-0.4*(mag - 25.))
+        lines.append(_line(4, (3.*(k + 1), 12345.67, 28.3*(k + 1)**2, flux, mag, merr, 0, 'NoError'), k == len(mags) - 1))
+    return lines
+
+def _write(path, records):
+    with open(path, 'w') as f:
+        f.writelines(_header())
+        for rec in records:
+            f.writelines(rec)
+    return str(path)
+
+image = 'AGC249525_g_sh.fits'
+coords = 'AGC249525_g_sh.fits.coo.1'
+
+def test_fixed_width_fields(tmp_path):
+    # the coords name fills its 23 columns and runs into LID; values are read by column
+    recs = [_record(image, coords, 1, (313.021, 88.75), [(21.204, 0.031), (20.95, 0.028)]),
+            _record(image, coords, 2, (1204.5, 2217.125), [(None, None), (22.5, 0.1)])]
+    assert recs[0][0][49:78] == coords[:23] + '1     '
+    header, fields, records = regions.read_textdb(_write(tmp_path / 'a.mag.1', recs))
+    assert len(records) == 2 and [len(r) for r in records] == [6, 6]
+    assert ('XCENTER', 1, 0, 14) in fields and ('MAG', 4, 51, 58) in fields
+    x, y, mag, merr, lid = regions.textdb_columns(fields, records, 'XCE', 'YCENTER', 'MAG', 'MERR', 'LID')
+    assert x == pytest.approx([313.021, 1204.5]) and y == pytest.approx([88.75, 2217.125])
+    # the first aperture, as pselect's MAG is MAG[1]
+    assert mag[0] == pytest.approx(21.204) and np.isnan(mag[1])
+    assert merr[0] == pytest.approx(0.031) and np.isnan(merr[1])
+    assert lid == pytest.approx([1, 2])
+    with pytest.raises(KeyError):
+        regions.textdb_columns(fields, records, 'FWHM')
+
+def test_select_apphot_boxes(tmp_path):
+    # the second star is centred in a box, the fourth has MAG INDEF but MERR set, and the
+    # other two are kept, written out line for line under the header
+    with open(str(tmp_path / 'mask.reg'), 'w') as f:
+        f.write('physical\nbox 1200 2220 40 40 0\nbox 100 3000 20 20 0\n')
+    boxes = regions.read_regions(str(tmp_path / 'mask.reg'))
+    recs = [_record(image, coords, 1, (313.021, 88.75), [(21.204, 0.031)]),
+            _record(image, coords, 2, (1204.5, 2217.125), [(20.5, 0.02)]),
+            _record(image, coords, 3, (1230.25, 2217.125), [(22.1, 0.05)]),
+            _record(image, coords, 4, (600., 700.), [(None, 0.05)])]
+    in_file = _write(tmp_path / 'a.mag.1', recs)
+    out_file = str(tmp_path / 'a.mag.1a')
+    assert regions.select_apphot(in_file, out_file, boxes, require=('MAG',)) == 2
+    assert open(out_file).readlines() == _header() + recs[0] + recs[2]
+    assert regions.select_apphot(in_file, out_file, require=('MERR',)) == 4
+
+def test_no_formats(tmp_path):
+    # without #F lines the fields are the words of each line
+    path = str(tmp_path / 'a.coo')
+    with open(path, 'w') as f:
+        f.write('#N XCENTER YCENTER MAG \\\n#N ID\n12.5 30.25 INDEF \\\n   7\n40.0 50.0 21.3 \\\n   8\n')
+    header, fields, records = regions.read_textdb(path)
+    x, mag, ident = regions.textdb_columns(fields, records, 'XCENTER', 'MAG', 'ID')
+    assert x == pytest.approx([12.5, 40.]) and ident == pytest.approx([7, 8])
+    assert np.isnan(mag[0]) and mag[1] == pytest.approx(21.3)
+
+def test_completeness_fields(tmp_path):
+    # what completeness reads from addstar's .art and phot's .mag.1 for compl/ images,
+    # whose names are longer than IMAGE and COORDS and so fill them to the next field
+    name = 'compl/AGC249525_g_crop_add.+20.0'
+    recs = [_record(name + '.fits', name + '.coo.1', 17, (313.021, 88.75), [(21.204, 0.031)]),
+            _record(name + '.fits', name + '.coo.1', 18, (1204.5, 2217.125), [(None, None)])]
+    assert recs[0][0][:33] == name[:23] + '312.621   '
+    header, fields, records = regions.read_textdb(_write(tmp_path / 'a.mag.1', recs))
+    ident, x, y, mag, merr = regions.textdb_columns(fields, records, 'ID', 'XINIT', 'YINIT', 'MAG', 'MERR')
+    assert ident == pytest.approx([17, 18])
+    assert x == pytest.approx([312.621, 1204.1]) and y == pytest.approx([89.05, 2217.425])
+    assert mag[0] == pytest.approx(21.204) and merr[0] == pytest.approx(0.031)
+    assert np.isnan(mag[1]) and np.isnan(merr[1])
+    path = str(tmp_path / 'a.fits.art')
+    with open(path, 'w') as f:
+        f.write('#N ID    XCENTER   YCENTER   MAG         \\\n#U ##    pixels    pixels    magnitudes  \\\n'
+                '#F %-9d  %-10.3f   %-10.3f   %-12.3f     \n#\n')
+        f.write('%-9d%-10.3f%-10.3f%-12.3f\n' % (1, 1021.375, 12.5, 20.512))
+        f.write('%-9d%-10.3f%-10.3f%-12.3f\n' % (123456789, 2040.25, 1999.875, 21.037))
+    header, fields, records = regions.read_textdb(path)
+    ident, x, y, mag = regions.textdb_columns(fields, records, 'ID', 'XCENTER', 'YCENTER', 'MAG')
+    assert ident == pytest.approx([1, 123456789]) and mag == pytest.approx([20.512, 21.037])
+    assert x == pytest.approx([1021.375, 2040.25]) and y == pytest.approx([12.5, 1999.875])
@@ -10,41 +10,26 @@ from astropy import wcs
 from astropy.io import fits
 from pyraf import iraf
 from escut import escut 
+import aphot
+import regions
+import catalog
 from rand_bkg import bkg_boxes
-from odi_calibrate import calibrate, js_calibrate, download_sdss
+from odi_calibrate import calibrate, js_calibrate, download_sdss, apply_calibration
 
 def getfwhm(image, coords, outputfile, radius=4.0, buff=7.0, width=5.0, rplot=15.0, center='yes'):
     '''
-    Get a fwhm estimate for the image using the SDSS catalog stars and IRAF imexam (SLOW, but works)
+    Get a fwhm estimate for the image using imexam-style gaussian profile fits (aphot.radprof)
     Adapted from Kathy's getfwhm script (this implementation is simpler in practice)
     '''
-    from pyraf import iraf
     import numpy as np
     import os
     
-    iraf.tv.rimexam.setParam('radius',radius)
-    iraf.tv.rimexam.setParam('buffer',buff)
-    iraf.tv.rimexam.setParam('width',width)
-    iraf.tv.rimexam.setParam('rplot',rplot)
-    iraf.tv.rimexam.setParam('center',center)
     # fit a gaussian, rather than a moffat profile (it's more robust for faint sources)
-    iraf.tv.rimexam.setParam('fittype','gaussian')
-    iraf.tv.rimexam.setParam('iterati',1)
-    
+    # the log has the imexam 'a' columns; unmeasured values are 999, as the old log cleanup made them
     if not os.path.isfile(outputfile):
-        iraf.tv.imexamine(image, frame=10, logfile = outputfile, keeplog = 'yes', defkey = "a", nframes=0, imagecur = coords, wcs = "logical", use_display='no',  StdoutG='/dev/null',mode='h')
-    outputfile_clean = open(outputfile.replace('.log','_clean.log'),"w")
-    for line in open(outputfile,"r"):
-        if not 'INDEF' in line:
-            outputfile_clean.write(line)
-        if 'INDEF' in line:
-            outputfile_clean.write(line.replace('INDEF','999'))
-    outputfile_clean.close()
-    os.rename(outputfile.replace('.log','_clean.log'),outputfile)
-    #
-    # # unfortunately we have to toss the first measured fwhm value from the median because of the file format
-    # # gfwhm = np.genfromtxt(outputfile, usecols=(3,), skip_header=4, skip_footer=3, unpack=True)
-    gfwhm = np.loadtxt(outputfile, usecols=(10,), unpack=True)
+        prof = aphot.radprof(image, coords, radius=radius, buff=buff, width=width, rplot=rplot, center=(center == 'yes'), fittype='gaussian')
+        aphot.write_log(outputfile, prof, layout='imexam', indef='999')
+    gfwhm = np.loadtxt(outputfile, usecols=(13,), unpack=True)
     # hdulist = ast.io.fits.open(image)
     # seeing = hdulist[0].header['FWHMSTAR']
     # gfwhm = seeing/0.11
@@ -323,79 +308,25 @@ if not os.path.isfile('mask.reg'):
     raw_input("Press Enter when finished:")
 
 
-m3,m4,m5,m6 = np.loadtxt('mask.reg',usecols=(2,3,4,5),unpack=True)
-# g image pselects
-if not os.path.isfile(fits_g+'.mag.1a') :
-    if os.path.isfile('temp2') :    
-        os.remove('temp2')
-    iraf.ptools.pselect(infi=fits_g+'.mag.1', outfi='temp1', expr="MAG != INDEF")
-    for i in range(len(m3)) :
-        mx1 = m3[i] - (m5[i]/2.)
-        mx2 = m3[i] + (m5[i]/2.)
-        my1 = m4[i] - (m6[i]/2.)
-        my2 = m4[i] + (m6[i]/2.)
-        iraf.ptools.pselect(infi='temp1', outfi='temp2', expr='(XCE < '+repr(int(mx1))+' || XCE > '+repr(int(mx2))+') || (YCE < '+repr(int(my1))+' || YCE > '+repr(int(my2))+')')
-        os.rename('temp2', 'temp1')
-    os.rename('temp1', fits_g+'.mag.1a')
-    if os.path.isfile('temp1') :    
-        os.remove('temp1')
-
-# i image pselects
-if not os.path.isfile(fits_i+'.mag.1a') :
-    if os.path.isfile('temp2') :    
-        os.remove('temp2')
-    iraf.ptools.pselect(infi=fits_i+'.mag.1', outfi='temp1', expr="MAG != INDEF")
-    for i in range(len(m3)) :
-        mx1 = m3[i] - (m5[i]/2.)
-        mx2 = m3[i]+ (m5[i]/2.)
-        my1 = m4[i] - (m6[i]/2.)
-        my2 = m4[i] + (m6[i]/2.)
-        iraf.ptools.pselect(infi='temp1', outfi='temp2', expr='(XCE < '+repr(int(mx1))+' || XCE > '+repr(int(mx2))+') || (YCE < '+repr(int(my1))+' || YCE > '+repr(int(my2))+')')
-        os.rename('temp2', 'temp1')
-    os.rename('temp1', fits_i+'.mag.1a')
-    if os.path.isfile('temp1') :    
-        os.remove('temp1')
-
-# mkobsfile stuff
-# mkobsfile MATCHES sources between images to get rid of random sources, things that are masked in one or the other, etc.
-iraf.digiphot.mkobsfile.setParam('photfiles',title_string+'_*.fits.mag.1a')
-iraf.digiphot.mkobsfile.setParam('idfilters','odi_i,odi_g')
-iraf.digiphot.mkobsfile.setParam('imsets',title_string+'.imsets')
-iraf.digiphot.mkobsfile.setParam('obscolumns','2 3 4 5')
-iraf.digiphot.mkobsfile.setParam('shifts','')
-iraf.digiphot.mkobsfile.setParam('apercors','')
-iraf.digiphot.mkobsfile.setParam('allfilters','yes')
-
-# if not os.path.isfile('ifirst_tol6.out') :
-#     iraf.mkobsfile.setParam('observations','ifirst_tol6.out')
-#     iraf.mkobsfile.setParam('tolerance',6.)
-#     iraf.mkobsfile()
-
-if not os.path.isfile('ifirst_tol7.out') :
-    iraf.digiphot.mkobsfile.setParam('observations','ifirst_tol7.out')
-    iraf.digiphot.mkobsfile.setParam('tolerance',7.) # number of pixels away matched source can be, DATA DEPENDENT!
-    iraf.digiphot.mkobsfile(mode='h')
-
-# if not os.path.isfile('ifirst_tol8.out') :
-#     iraf.mkobsfile.setParam('observations','ifirst_tol8.out')
-#     iraf.mkobsfile.setParam('tolerance',8.)
-#     iraf.mkobsfile()
-# call("awk '{ if ($2 ~ "odi_i") print $5, $6 }' ifirst_tol7.dat > tol7_i.pos")
-
-# print matched sources to a file suitable for marking
+# drop INDEF magnitudes and everything centred in a mask.reg box (the old pselect passes)
+mask_boxes = regions.read_regions('mask.reg')
+for fits_ in (fits_g, fits_i) :
+    if not os.path.isfile(fits_+'.mag.1a') :
+        regions.select_apphot(fits_+'.mag.1', fits_+'.mag.1a', mask_boxes, require=('MAG',))
+
+# match the sources between the images to get rid of random sources, things that are masked in one or the other, etc.
+# (what mkobsfile used to do): every i source paired with the nearest g source within match_tol pixels, each used once
+match_tol = 7. # number of pixels away matched source can be, DATA DEPENDENT!
 if len(glob.glob('tol*.pos')) < 2:
-    if os.path.isfile('ifirst_tol7.out') :
-        mx,my = np.loadtxt('ifirst_tol7.out',usecols=(4,5),unpack=True)
-        mfilter = np.loadtxt('ifirst_tol7.out',usecols=(1,),dtype=str,unpack=True)
-        match_pos_file_g = open("tol7_g.pos", 'w+')
-        match_pos_file_i = open("tol7_i.pos", 'w+')
-        for i in range(len(mx)) :
-            if mfilter[i]== 'odi_g' :
-                print >> match_pos_file_g, mx[i], my[i]
-            if mfilter[i] == 'odi_i' :
-                print >> match_pos_file_i, mx[i], my[i]
-        match_pos_file_g.close()
-        match_pos_file_i.close()
+    header, fields, records = regions.read_textdb(fits_g+'.mag.1a')
+    mx_g, my_g = regions.textdb_columns(fields, records, 'XCENTER', 'YCENTER')
+    header, fields, records = regions.read_textdb(fits_i+'.mag.1a')
+    mx_i, my_i = regions.textdb_columns(fields, records, 'XCENTER', 'YCENTER')
+    m_i, m_g, m_sep = catalog.match_xy(mx_i, my_i, mx_g, my_g, match_tol)
+    print 'matched', len(m_i), 'of', len(mx_i), 'i and', len(mx_g), 'g sources within', match_tol, 'px'
+    # print matched sources to a file suitable for marking, one line per pair in both files
+    np.savetxt('tol7_g.pos', np.column_stack((mx_g[m_g], my_g[m_g])), fmt='%.3f')
+    np.savetxt('tol7_i.pos', np.column_stack((mx_i[m_i], my_i[m_i])), fmt='%.3f')
     
 # import the getfwhm task as a pyraf task
 # iraf.task(getfwhm = "home$scripts/getfwhm.cl")
@@ -490,42 +421,12 @@ if not os.path.isfile('apcor.tbl.txt'):
         # iraf.getfwhm.setParam('outfile','apcorfwhmcheck_i.log')
         # iraf.getfwhm()
     
-        iraf.unlearn(iraf.apphot.phot,iraf.datapars,iraf.photpars,iraf.centerpars,iraf.fitskypars)
-    
-        iraf.apphot.phot.setParam('interactive','no')
-        iraf.apphot.phot.setParam('verify','no')
-    
-        iraf.datapars.setParam('gain',"gain")
-        iraf.datapars.setParam('ccdread',"rdnoise")
-        iraf.datapars.setParam('exposure',"exptime")
-        iraf.datapars.setParam('airmass',"airmass")
-        iraf.datapars.setParam('filter',"filter")
-        iraf.datapars.setParam('obstime',"time-obs")
-        iraf.datapars.setParam('sigma','INDEF')
-        iraf.photpars.setParam('zmag',0.)
-        iraf.centerpars.setParam('cbox',9.)
-        iraf.centerpars.setParam('maxshift',3.)
-        iraf.fitskypars.setParam('salgorithm',"median")
-        iraf.fitskypars.setParam('dannulus',10.)
-    
-        iraf.datapars.setParam('fwhmpsf',ap_avg_g)
-        iraf.photpars.setParam('apertures',str('"'+repr(ap_avg_g)+','+repr(5.0*ap_avg_g)+'"'))
-        iraf.fitskypars.setParam('annulus',6.5*ap_avg_g)
-    
-        iraf.apphot.phot(image=fits_g, coords='apcor_stars_g.txt', output="g.apcor.mag.1")
-    
-        iraf.datapars.setParam('fwhmpsf',ap_avg_i)
-        iraf.photpars.setParam('apertures',str('"'+repr(ap_avg_i)+','+repr(5.0*ap_avg_i)+'"'))
-        iraf.fitskypars.setParam('annulus',6.5*ap_avg_i)
-        iraf.apphot.phot(image=fits_i, coords='apcor_stars_i.txt', output="i.apcor.mag.1")
-    
-        apt_file_g = open("apcor_table_g.txt", 'w+')
-        apt_file_i = open("apcor_table_i.txt", 'w+')
-    
-        iraf.ptools.txdump(textfiles='g.apcor.mag.1', fields="ID,XCEN,YCEN,MAG", expr='yes', Stdout=apt_file_g)
-        iraf.ptools.txdump(textfiles='i.apcor.mag.1', fields="ID,XCEN,YCEN,MAG", expr='yes', Stdout=apt_file_i)
-        apt_file_g.close()
-        apt_file_i.close()
+        # 1x and 5x fwhm apertures with aphot (IRAF apphot.phot recipe: cbox=9, maxshift=3,
+        # median sky in a 10 pixel annulus from 6.5x fwhm, no datamax as before)
+        ph_g = aphot.phot(fits_g, 'apcor_stars_g.txt', [ap_avg_g, 5.0*ap_avg_g], 6.5*ap_avg_g, dannulus=10., datamax=np.inf)
+        aphot.write_txdump("apcor_table_g.txt", ph_g, ['id','xcen','ycen','mag'])
+        ph_i = aphot.phot(fits_i, 'apcor_stars_i.txt', [ap_avg_i, 5.0*ap_avg_i], 6.5*ap_avg_i, dannulus=10., datamax=np.inf)
+        aphot.write_txdump("apcor_table_i.txt", ph_i, ['id','xcen','ycen','mag'])
     
         onex_g,four5x_g = np.loadtxt('apcor_table_g.txt',usecols=(3,4),unpack=True)
         onex_i,four5x_i = np.loadtxt('apcor_table_i.txt',usecols=(3,4),unpack=True)
@@ -593,46 +494,23 @@ else :
 escut_i = escut(fits_i, 'tol7_i.pos', ap_fwhm_i, ap_peak_i)
     
 # finally rephot just the good stuff to get a good number
+# Use an aperture that is 1 x <fwhm>, because an aperture correction
+# will be applied in the calc_calib_mags step
+# Using a sky annulus that begins at 6 x <fwhm> should be fine
+# (aphot, IRAF apphot.phot recipe: cbox=9, maxshift=3, median sky in a 10 pixel annulus, datamax=50000)
+# g-band
 if os.path.isfile('escut_g.pos') :
-    iraf.unlearn(iraf.phot,iraf.datapars,iraf.photpars,iraf.centerpars,iraf.fitskypars)
-    #
-    iraf.apphot.phot.setParam('interactive',"no")
-    iraf.apphot.phot.setParam('verify',"no")
-    iraf.datapars.setParam('datamin',"INDEF")
-    iraf.datapars.setParam('datamax',50000.)
-    iraf.datapars.setParam('gain',"gain")
-    iraf.datapars.setParam('ccdread',"rdnoise")
-    iraf.datapars.setParam('exposure',"exptime")
-    iraf.datapars.setParam('airmass',"airmass")
-    iraf.datapars.setParam('filter',"filter")
-    iraf.datapars.setParam('obstime',"time-obs")
-    iraf.datapars.setParam('sigma',"INDEF")
-    iraf.photpars.setParam('zmag',0.)
-    iraf.centerpars.setParam('calgorithm',"centroid")
-    iraf.centerpars.setParam('cbox',9.)
-    iraf.centerpars.setParam('maxshift',3.)
-    iraf.fitskypars.setParam('salgorithm',"median")
-    iraf.fitskypars.setParam('dannulus',10.)
-#
-    # Use an aperture that is 1 x <fwhm>, because an aperture correction
-    # will be applied in the calc_calib_mags step
-    # Using a sky annulus thatbegins at 6 x <fwhm> should be fine
-    # g-band
-    if not os.path.isfile(title_string+'_sources_g.mag.1') :
-        print 'Phot-ing g band point sources, this could take a while.'
-        iraf.datapars.setParam('fwhmpsf',ap_avg_g)
-        iraf.photpars.setParam('apertures',ap_avg_g)
-        iraf.fitskypars.setParam('annulus',6*ap_avg_g)
-        iraf.apphot.phot(image=fits_g, coords='escut_g.pos', output=title_string+'_sources_g.mag.1')
+    if not os.path.isfile(title_string+'_sources_g.txdump') :
+        print 'Phot-ing g band point sources...'
+        ph = aphot.phot(fits_g, 'escut_g.pos', ap_avg_g, 6*ap_avg_g, dannulus=10., datamax=50000.)
+        aphot.write_txdump(title_string+'_sources_g.txdump', ph, aphot.txdump_fields)
 
 # i-band    
 if os.path.isfile('escut_i.pos') :
-    if not os.path.isfile(title_string+'_sources_i.mag.1') :
-        print 'Phot-ing i band point sources, this could take a while.'
-        iraf.datapars.setParam('fwhmpsf',ap_avg_i)
-        iraf.photpars.setParam('apertures',ap_avg_i)
-        iraf.fitskypars.setParam('annulus',6*ap_avg_i)
-        iraf.apphot.phot(image=fits_i, coords='escut_i.pos', output=title_string+'_sources_i.mag.1')
+    if not os.path.isfile(title_string+'_sources_i.txdump') :
+        print 'Phot-ing i band point sources...'
+        ph = aphot.phot(fits_i, 'escut_i.pos', ap_avg_i, 6*ap_avg_i, dannulus=10., datamax=50000.)
+        aphot.write_txdump(title_string+'_sources_i.txdump', ph, aphot.txdump_fields)
 
 
 def getexttbl(ra,dec,fname='extinction.tbl.txt'):
@@ -706,7 +584,8 @@ print 'Reddening correction :: g = {0:7.4f} : i = {1:7.4f}'.format(cal_A_g,cal_A
 # print title_string
 if not os.path.isfile('phot_sources.txdump'):
     txdump_out = open('phot_sources.txdump','w+')
-    iraf.ptools.txdump(textfiles=title_string+'_sources_*.mag.1', fields="id,mag,merr,msky,stdev,rapert,xcen,ycen,ifilter,xairmass,image", expr='yes', headers='no', Stdout=txdump_out)
+    for band_file in sorted(glob.glob(title_string+'_sources_*.txdump')):
+        txdump_out.write(open(band_file).read())
     txdump_out.close()
 
 if not os.path.isfile('calibration.dat'):
@@ -739,29 +618,9 @@ if not os.path.isfile(title_string+'_help_js.txt'):
 else:
     eps_g, std_eps_g, zp_g, std_zp_g, eps_i, std_eps_i, zp_i, std_zp_i = np.loadtxt(title_string+'_help_js.txt', usecols=(0,1,2,3,4,5,6,7), skiprows=32, unpack=True)
 
-# use the instrumental magnitude and initial color guess to ITERATE 
-# until you reach a converged calibrated magnitude/color
-tolerance = 0.0001
-g_mag = []
-i_mag = []
-for j,mag in enumerate(g0):
-    g_0 = g0[j]
-    i_0 = i0[j]
-    color_guess = 0.0
-    color_diff = 1.0
-    while abs(color_diff) > tolerance:
-        g_cal = g_0 + eps_g*color_guess + zp_g
-        i_cal = i_0 + eps_i*color_guess + zp_i
-        
-        color_new = g_cal - i_cal
-        color_diff = color_guess-color_new
-        color_guess = color_new
-        # print j, g_cal, i_cal, color_new
-    g_mag.append(g_cal)
-    i_mag.append(i_cal)
-
-g_mag = np.array(g_mag)
-i_mag = np.array(i_mag)
+# solve for the calibrated magnitudes/colors of all the stars at once (the color terms make
+# each magnitude depend on the calibrated color)
+g_mag, i_mag = apply_calibration(g0, i0, eps_g, zp_g, eps_i, zp_i)
 g_mag = g_mag - cal_A_g 
 i_mag = i_mag - cal_A_i
 gmi = g_mag - i_mag